@@ -0,0 +1,493 @@
+# マスコットアプリのベンチマーク（Qtのoffscreenプラットフォームで画面なしで実行する）
+#
+# 使い方:
+#   python benchmarks/bench_mascot.py                  # 計測して結果を保存し、基準値と比べる
+#   python benchmarks/bench_mascot.py --quick          # マスコット数を減らして短時間で計測
+#   python benchmarks/bench_mascot.py --save-baseline  # 今回の結果を基準値として保存
+#
+# 結果はすべて「小さいほどよい」値で、基準値より tolerance 以上悪くなった項目があれば終了コード1を返す
+# 自動移動の1回あたりの時間（500体、p95）が予算（BEHAVIOR_TICK_BUDGET_MS）を超えた場合も終了コード1を返す
+
+# 必要なライブラリをインポート
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import tempfile
+import argparse
+import platform
+import gc
+import statistics
+
+# 画面なしで動かす（PyQt5をインポートする前に設定する）
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QEvent, QElapsedTimer, QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtGui import QImage, QColor
+
+# 結果と基準値のデフォルトの保存先
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results.json")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# 起動時間を計るマスコット数
+STARTUP_COUNTS = [1, 10, 100, 500]
+QUICK_STARTUP_COUNTS = [1, 10, 100]
+
+# 自動移動の1回の計算と反映の時間を計るマスコット数と回数
+BEHAVIOR_COUNT = 500
+BEHAVIOR_TICKS = 300
+QUICK_BEHAVIOR_TICKS = 60
+
+# 基準値より悪くなったとみなす割合
+DEFAULT_TOLERANCE = 0.25
+
+# 合成する画像（名前, 幅, 高さ, フレーム数、フレーム数1はPNG）
+SYNTHETIC_IMAGES = [
+    ("small_gif", 64, 64, 8),
+    ("medium_gif", 160, 120, 24),
+    ("large_gif", 320, 240, 48),
+    ("small_png", 64, 64, 1),
+    ("large_png", 512, 512, 1),
+]
+
+# GIFの画像データを圧縮せずにLZW形式で書く関数（9ビットのコードだけを使う最小限のエンコーダー）
+def lzw_uncompressed(indices):
+    output = bytearray()
+    bit_buffer = 0
+    bit_count = 0
+    
+    def emit(code):
+        nonlocal bit_buffer, bit_count
+        bit_buffer |= code << bit_count
+        bit_count += 9
+        while bit_count >= 8:
+            output.append(bit_buffer & 0xFF)
+            bit_buffer >>= 8
+            bit_count -= 8
+    
+    # 辞書が9ビットを超えないように一定数ごとにクリアコードを入れる
+    emit(256)
+    written = 0
+    for index in indices:
+        emit(index)
+        written += 1
+        if written == 254:
+            emit(256)
+            written = 0
+    emit(257)
+    if bit_count:
+        output.append(bit_buffer & 0xFF)
+    
+    blocks = bytearray([8])
+    for start in range(0, len(output), 255):
+        chunk = output[start:start + 255]
+        blocks.append(len(chunk))
+        blocks += chunk
+    blocks.append(0)
+    return bytes(blocks)
+
+# アニメーションGIFを書き出す関数（フレームごとに模様がずれる）
+def write_gif(path, width, height, frame_count, delay_cs=10):
+    palette = bytearray()
+    for i in range(256):
+        palette += bytes([(i * 7) & 255, (i * 13) & 255, (i * 29) & 255])
+    
+    data = bytearray(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF7, 0, 0) + palette)
+    data += b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00"  # 無限ループ
+    for frame in range(frame_count):
+        # 透明色0、前のフレームを残さない
+        data += b"\x21\xf9\x04" + struct.pack("<BHBB", 0x09, delay_cs, 0, 0)
+        data += b"\x2c" + struct.pack("<HHHHB", 0, 0, width, height, 0)
+        indices = [0 if (x + y) % 9 == 0 else ((x // 8 + y // 8 + frame) % 255) + 1
+                   for y in range(height) for x in range(width)]
+        data += lzw_uncompressed(indices)
+    data += b"\x3b"
+    
+    with open(path, "wb") as f:
+        f.write(bytes(data))
+
+# 静止画のPNGを書き出す関数
+def write_png(path, width, height):
+    image = QImage(width, height, QImage.Format_ARGB32)
+    image.fill(QColor(0, 0, 0, 0))
+    for y in range(0, height, 4):
+        for x in range(0, width, 4):
+            if (x + y) % 12:
+                image.setPixelColor(x, y, QColor(x % 256, y % 256, 128, 255))
+    image.save(path, "PNG")
+
+# 合成画像を作って画像リストを返す関数
+def create_images(directory):
+    image_list = []
+    for name, width, height, frame_count in SYNTHETIC_IMAGES:
+        if frame_count > 1:
+            path = os.path.join(directory, name + ".gif")
+            write_gif(path, width, height, frame_count)
+        else:
+            path = os.path.join(directory, name + ".png")
+            write_png(path, width, height)
+        image_list.append({"id": name, "path": path, "name": name, "is_gif": frame_count > 1})
+    return image_list
+
+# 計測用の環境クラス（一時的なホームディレクトリに設定ファイルとキャッシュを置く）
+class BenchEnvironment:
+    def __init__(self, root):
+        self.root = root
+        self.image_dir = os.path.join(root, "images")
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.image_list = create_images(self.image_dir)
+        self.run_count = 0
+    
+    # 新しいホームディレクトリを用意して設定ファイルを書くメソッド（キャッシュは空の状態）
+    def prepare(self, mascot_count, image_ids=None):
+        self.run_count += 1
+        home = os.path.join(self.root, f"home{self.run_count}")
+        app_data_dir = os.path.join(home, ".mascot_app")
+        os.makedirs(app_data_dir, exist_ok=True)
+        os.environ["HOME"] = home
+        os.environ["USERPROFILE"] = home
+        
+        if image_ids is None:
+            image_ids = [image_info["id"] for image_info in self.image_list]
+            
+        # マスコットは格子状に並べる
+        last_mascots = []
+        for i in range(mascot_count):
+            last_mascots.append({
+                "image_id": image_ids[i % len(image_ids)],
+                "position": {"x": (i % 25) * 40, "y": (i // 25) * 40}
+            })
+            
+        config = {
+            "config_version": 2,
+            "image_list": self.image_list,
+            "is_topmost": True,
+            "last_mascots": last_mascots
+        }
+        with open(os.path.join(app_data_dir, "mascot_config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False)
+
+# イベントループを指定時間回す関数
+def spin(qapp, ms):
+    timer = QElapsedTimer()
+    timer.start()
+    while timer.elapsed() < ms:
+        qapp.processEvents()
+        time.sleep(0.001)
+
+# 起動時のマスコットが全部作られ、最初のフレームが表示されるまで待つ関数（かかった時間をミリ秒で返す）
+def wait_until_ready(qapp, mascot_app, timeout_ms=60000):
+    timer = QElapsedTimer()
+    timer.start()
+    while timer.elapsed() < timeout_ms:
+        qapp.processEvents()
+        # 起動時のマスコットは何回かのイベントループに分けて作られる
+        if not getattr(mascot_app, "startup_finished", True):
+            time.sleep(0.001)
+            continue
+        if all(mascot.frame_set is not None and mascot.pending_frame_set is None
+               for mascot in mascot_app.mascot_widgets):
+            return timer.elapsed()
+        time.sleep(0.001)
+    raise RuntimeError("画像の読み込みが時間内に終わりませんでした")
+
+# MascotAppを片付ける関数（終了処理と同じ順番で、アプリケーションは終了させない）
+def destroy_app(qapp, mascot_app):
+    qapp.aboutToQuit.disconnect(mascot_app.config_saver.close)
+    mascot_app.config_saver.close()
+    mascot_app.perf_metrics.set_hud_visible(False)
+    mascot_app.remove_all_mascots()
+    mascot_app.frame_store.thread_pool.waitForDone()
+    mascot_app.tray_icon.hide()
+    mascot_app.deleteLater()
+    qapp.sendPostedEvents(None, QEvent.DeferredDelete)
+    qapp.processEvents()
+
+# 常駐メモリ（バイト）を返す関数（取得できない環境ではNone）
+def resident_memory():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# 中央値と95パーセンタイルを返す関数
+def summarize(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(len(ordered) * 0.95)) - 1)]
+    return round(statistics.median(ordered), 3), round(p95, 3)
+
+# 起動時間を計る関数（load_last_mascotsまでと、全フレームの表示まで）
+def bench_startup(qapp, module, env, counts, results):
+    for count in counts:
+        env.prepare(count)
+        start = time.perf_counter()
+        mascot_app = module.MascotApp()
+        init_ms = (time.perf_counter() - start) * 1000
+        ready_ms = wait_until_ready(qapp, mascot_app)
+        results[f"startup_init_ms[{count}]"] = round(init_ms, 2)
+        results[f"startup_ready_ms[{count}]"] = round(init_ms + ready_ms, 2)
+        destroy_app(qapp, mascot_app)
+        print(f"  起動 {count:4d}体: 初期化 {init_ms:8.1f}ms / 表示完了 {init_ms + ready_ms:8.1f}ms")
+
+# 同じGIFを表示するマスコットを増やしたときの1体あたりのメモリを計る関数
+def bench_duplicate_memory(qapp, module, env, results, duplicates=50):
+    env.prepare(1, ["large_gif"])
+    mascot_app = module.MascotApp()
+    wait_until_ready(qapp, mascot_app)
+    spin(qapp, 100)
+    gc.collect()
+    
+    frame_bytes_before = mascot_app.frame_store.total_bytes
+    rss_before = resident_memory()
+    image_info = mascot_app.image_registry.get("large_gif")
+    for _ in range(duplicates):
+        mascot_app.create_mascot(image_info)
+    wait_until_ready(qapp, mascot_app)
+    spin(qapp, 100)
+    gc.collect()
+    
+    frame_bytes = (mascot_app.frame_store.total_bytes - frame_bytes_before) / duplicates
+    results["duplicate_frame_bytes_per_mascot"] = round(frame_bytes, 1)
+    rss_after = resident_memory()
+    if rss_before is not None and rss_after is not None:
+        results["duplicate_rss_bytes_per_mascot"] = round((rss_after - rss_before) / duplicates, 1)
+    destroy_app(qapp, mascot_app)
+    print(f"  同じGIFのマスコット1体あたり: フレーム {frame_bytes:.0f}B / "
+          f"常駐メモリ {results.get('duplicate_rss_bytes_per_mascot', '-')}B")
+
+# GIFのマスコット1体が使うフレームのメモリを、全フレームをARGB32で持つ場合と比べる関数
+def bench_compact_frames(qapp, module, env, results):
+    gif_names = [name for name, _, _, frame_count in SYNTHETIC_IMAGES if frame_count > 1]
+    env.prepare(len(gif_names), gif_names)
+    mascot_app = module.MascotApp()
+    wait_until_ready(qapp, mascot_app)
+    spin(qapp, 500)  # 何フレームか再生して展開しておくフレームがそろうまで待つ
+    
+    for mascot in mascot_app.mascot_widgets:
+        name = mascot.image_info["name"]
+        frame_set = mascot.frame_set
+        results[f"frame_bytes_per_mascot[{name}]"] = frame_set.byte_size
+        saved = frame_set.full_bytes - frame_set.byte_size
+        print(f"  {name} 1体のフレーム: {frame_set.byte_size / 1024:.0f}KB "
+              f"（全フレームARGB32 {frame_set.full_bytes / 1024:.0f}KB、{saved / 1024:.0f}KB節約）")
+    destroy_app(qapp, mascot_app)
+
+# 設定の保存と、トレイメニューの更新にかかる時間を計る関数
+def bench_save_and_menu(qapp, module, env, results, mascot_count=100, repeat=30):
+    env.prepare(mascot_count)
+    mascot_app = module.MascotApp()
+    wait_until_ready(qapp, mascot_app)
+    
+    # 保存（設定の組み立てから書き込み完了まで）
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mascot_app.save_config()
+        mascot_app.config_saver.flush(wait=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    median, p95 = summarize(samples)
+    results[f"save_config_ms[{mascot_count}]"] = median
+    results[f"save_config_p95_ms[{mascot_count}]"] = p95
+    print(f"  save_config {mascot_count}体: 中央値 {median:.3f}ms / p95 {p95:.3f}ms")
+    
+    # トレイメニューの状態更新
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mascot_app.update_tray_menu()
+        samples.append((time.perf_counter() - start) * 1000)
+    median, p95 = summarize(samples)
+    results[f"update_tray_menu_ms[{mascot_count}]"] = median
+    print(f"  update_tray_menu {mascot_count}体: 中央値 {median:.3f}ms / p95 {p95:.3f}ms")
+    
+    # 初めてサブメニューを開いたときの構築
+    model = mascot_app.tray_menu_model
+    start = time.perf_counter()
+    for lazy_menu in (model.display_menu, model.active_mascots_menu, model.images_menu):
+        lazy_menu.ensure_built()
+    build_ms = (time.perf_counter() - start) * 1000
+    results[f"tray_menu_build_ms[{mascot_count}]"] = round(build_ms, 3)
+    print(f"  トレイメニューの構築 {mascot_count}体: {build_ms:.3f}ms")
+    
+    destroy_app(qapp, mascot_app)
+
+# アニメーション中のCPU使用率を計る関数
+def bench_animation_cpu(qapp, module, env, results, mascot_count=50, duration_ms=3000):
+    env.prepare(mascot_count, ["small_gif", "medium_gif", "large_gif"])
+    mascot_app = module.MascotApp()
+    wait_until_ready(qapp, mascot_app)
+    spin(qapp, 500)  # デコードの後始末が終わるまで待つ
+    
+    rendered_before = sum(mascot.rendered_frames for mascot in mascot_app.mascot_widgets)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    spin(qapp, duration_ms)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    rendered = sum(mascot.rendered_frames for mascot in mascot_app.mascot_widgets) - rendered_before
+    
+    # spinの待ち時間以外のCPU時間（このプロセス全体）
+    results[f"animation_cpu_percent[{mascot_count}]"] = round(cpu / wall * 100, 2)
+    results[f"animation_cpu_ms_per_frame[{mascot_count}]"] = round(cpu * 1000 / max(1, rendered), 4)
+    destroy_app(qapp, mascot_app)
+    print(f"  アニメーション {mascot_count}体: CPU {cpu / wall * 100:.1f}% / "
+          f"{rendered / wall:.0f}フレーム毎秒")
+
+# 自動移動の1回あたりの時間を計る関数（予算内に収まっていればTrue、NumPyがなければ計らずにTrue）
+def bench_behavior(qapp, module, env, results, mascot_count=BEHAVIOR_COUNT, ticks=BEHAVIOR_TICKS):
+    if not module.BehaviorEngine.available():
+        print("  自動移動: NumPyがないため計測しません")
+        return True
+    
+    env.prepare(mascot_count, ["small_png"])
+    mascot_app = module.MascotApp()
+    wait_until_ready(qapp, mascot_app)
+    
+    # タイマーでは進めず、同じ時間幅で直接進める
+    engine = mascot_app.behavior_engine
+    engine.set_enabled(True)
+    engine.timer.stop()
+    dt = module.BEHAVIOR_TICK_INTERVAL / 1000
+    for _ in range(10):
+        engine.step(dt)
+        engine.apply()
+        qapp.processEvents()
+    
+    # 1回分の時間には、移動で発生したイベントの処理（露出・表示の確認など）も含める
+    # 予算に収めるために動かすのを後回しにしたマスコットがあれば失敗にする
+    step_samples = []
+    tick_samples = []
+    moved = 0
+    unapplied = 0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        engine.step(dt)
+        step_end = time.perf_counter()
+        moved += engine.apply()
+        qapp.processEvents()
+        end = time.perf_counter()
+        step_samples.append((step_end - start) * 1000)
+        tick_samples.append((end - start) * 1000)
+        unapplied = max(unapplied, engine.pending_count())
+    driven = len(engine.mascots)
+    
+    step_median, step_p95 = summarize(step_samples)
+    tick_median, tick_p95 = summarize(tick_samples)
+    results[f"behavior_step_ms[{mascot_count}]"] = step_median
+    results[f"behavior_tick_ms[{mascot_count}]"] = tick_median
+    results[f"behavior_tick_p95_ms[{mascot_count}]"] = tick_p95
+    destroy_app(qapp, mascot_app)
+    
+    budget = module.BEHAVIOR_TICK_BUDGET_MS
+    within_budget = tick_p95 <= budget
+    print(f"  自動移動 {mascot_count}体（動かすのは{driven}体）: 計算 {step_median:.3f}ms / "
+          f"計算・反映・イベント処理 中央値 {tick_median:.3f}ms p95 {tick_p95:.3f}ms / 1回あたり{moved / ticks:.0f}体を移動 "
+          f"（予算 {budget:.1f}ms {'以内' if within_budget else '超過'}）")
+    if unapplied:
+        print(f"  自動移動: 計算した位置に動かせなかったマスコットがあります（最大{unapplied}体）")
+    return within_budget and unapplied == 0
+
+# 基準値と比べて結果を表示する関数（悪くなった項目の数を返す）
+def compare_with_baseline(results, baseline, tolerance):
+    regressions = 0
+    print(f"\n基準値との比較（{tolerance * 100:.0f}%以上悪化で警告）")
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or base < 0:
+            print(f"  {name:45s} {value:12.3f}  （比較なし）")
+            continue
+        if base == 0:
+            ratio = 1.0 if value <= 0 else float("inf")
+        else:
+            ratio = value / base
+        mark = ""
+        if ratio > 1 + tolerance:
+            mark = "  <-- 悪化"
+            regressions += 1
+        elif ratio < 1 - tolerance:
+            mark = "  改善"
+        print(f"  {name:45s} {value:12.3f}  基準 {base:12.3f}  x{ratio:6.2f}{mark}")
+    return regressions
+
+# ベンチマークを実行する関数
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="マスコットアプリのベンチマーク")
+    parser.add_argument("--quick", action="store_true", help="マスコット数を減らして短時間で計測する")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="結果のJSONファイル")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="比較する基準値のJSONファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="悪化とみなす割合")
+    args = parser.parse_args(argv)
+    
+    qapp = QApplication.instance() or QApplication(sys.argv[:1])
+    qapp.setQuitOnLastWindowClosed(False)
+    import mascot_app as module
+    
+    root = tempfile.mkdtemp(prefix="mascot_bench_")
+    original_home = os.environ.get("HOME")
+    results = {}
+    try:
+        env = BenchEnvironment(root)
+        print("計測中...")
+        # メモリは前の計測の後始末の影響を受けにくいように最初に計る
+        bench_duplicate_memory(qapp, module, env, results, 10 if args.quick else 50)
+        bench_compact_frames(qapp, module, env, results)
+        bench_startup(qapp, module, env, QUICK_STARTUP_COUNTS if args.quick else STARTUP_COUNTS, results)
+        bench_save_and_menu(qapp, module, env, results, 100)
+        bench_animation_cpu(qapp, module, env, results, 20 if args.quick else 50,
+                            1000 if args.quick else 3000)
+        within_budget = bench_behavior(qapp, module, env, results, BEHAVIOR_COUNT,
+                                       QUICK_BEHAVIOR_TICKS if args.quick else BEHAVIOR_TICKS)
+    finally:
+        if original_home is not None:
+            os.environ["HOME"] = original_home
+        shutil.rmtree(root, ignore_errors=True)
+    
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "qt": QT_VERSION_STR,
+            "pyqt": PYQT_VERSION_STR,
+            "platform": platform.platform(),
+            "qpa": os.environ.get("QT_QPA_PLATFORM"),
+            "quick": args.quick
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"\n結果を保存しました: {args.output}")
+    
+    if not within_budget:
+        print("自動移動の1回あたりの時間が予算を超えています")
+    
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"基準値を保存しました: {args.baseline}")
+        return 0 if within_budget else 1
+    
+    if not os.path.exists(args.baseline):
+        print(f"基準値がありません（--save-baseline で作成できます）: {args.baseline}")
+        return 0 if within_budget else 1
+    
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    return 1 if regressions or not within_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,3641 @@
 # 必要なライブラリをインポート
+import time
+
+# 起動時間を計る基準（--profile-startupで表示する内訳はここからの時間）
+PROCESS_START_TIME = time.perf_counter()
+
 import sys
 import json
-from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QMenu, QAction, 
+from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QMenu, QAction,
                             QFileDialog, QVBoxLayout, QSystemTrayIcon, QInputDialog,
-                            QHBoxLayout, QSpinBox, QDialog, QCheckBox, QMessageBox)
-from PyQt5.QtCore import Qt, QPoint, QSize
-from PyQt5.QtGui import QPixmap, QCursor, QIcon, QMovie
+                            QMessageBox, QProgressDialog)
+from PyQt5.QtCore import (Qt, QPoint, QPointF, QSize, QRect, QTimer, QObject, QElapsedTimer,
+                          QRunnable, QThreadPool, QThread, QEvent, QLockFile, pyqtSignal)
+from PyQt5.QtGui import (QPixmap, QCursor, QIcon, QImage, QImageReader, QColor, QPainter,
+                         QRegion, QBitmap, QMouseEvent)
+from PyQt5 import sip
 import os
 import uuid
+import threading
+import struct
+import math
+import itertools
+from contextlib import contextmanager
+from datetime import datetime
+from collections import OrderedDict
+
+# NumPyがあれば全マスコットの自動移動をまとめて計算する（なければ自動移動は使えない）
+# 起動を速くするため、自動移動を始めるときに読み込む
+np = None
+
+# NumPyを読み込む関数（読み込めなければFalseを返す）
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+# フレームキャッシュのデフォルト上限（MB）
+DEFAULT_FRAME_CACHE_MB = 256
+
+# 遅延が極端に短いGIFフレームの表示時間（ミリ秒、ブラウザと同じ扱い）
+DEFAULT_FRAME_DELAY = 100
+
+# 設定ファイルの形式のバージョン（2: 画像を固定IDで参照）
+CONFIG_VERSION = 2
+
+# マスコットの表示倍率と最大サイズの選択肢
+SCALE_CHOICES = [0.25, 0.5, 0.75, 1.0, 1.5, 2.0]
+MAX_SIZE_CHOICES = [0, 64, 128, 256, 512]
+
+# 吸着する距離（ピクセル）
+SNAP_DISTANCE = 12
+
+# 空間インデックスのセルの大きさ（ピクセル）
+SPATIAL_CELL_SIZE = 256
+
+# オーバーレイ表示でマウスを受け付ける範囲の変わった部分1つを作り直すのにかかる時間（全体を作り直すときのマスコット何体分か）
+# 変わった部分が多く、全体を作り直すほうが速くなったら全体を作り直す
+OVERLAY_MASK_RECT_COST = 16
+
+# 最後の変更から設定ファイルを書き込むまでの待ち時間（ミリ秒）
+CONFIG_SAVE_DELAY = 500
+
+# 設定の保存に失敗したときに再試行するまでの最大の待ち時間（ミリ秒、失敗するたびに倍にしていく）
+CONFIG_RETRY_MAX_DELAY = 60 * 1000
+
+# ディスクキャッシュのデフォルト上限（MB）
+DEFAULT_DISK_CACHE_MB = 512
+
+# デコード中のGIFフレームをまとめてGUIスレッドに送る枚数
+DECODE_BATCH_FRAMES = 8
+
+# アニメーションの最大フレームレートのデフォルト
+DEFAULT_MAX_FPS = 60
+
+# 全画面アプリと無操作時間を確認する間隔（ミリ秒、Windowsのみ）
+VISIBILITY_POLL_INTERVAL = 1000
+
+# この時間操作がなければアニメーションを止める（ミリ秒、Windowsのみ）
+IDLE_SUSPEND_TIME = 5 * 60 * 1000
+
+# 止めたマスコットのフレームを返却するまでの猶予（ミリ秒）
+FRAME_RELEASE_DELAY = 30 * 1000
+
+# パフォーマンス表示を更新する間隔（ミリ秒）
+METRICS_SAMPLE_INTERVAL = 1000
+
+# 追加できる画像の拡張子
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+# 一括追加の結果に表示する失敗・重複の最大件数
+IMPORT_SUMMARY_LIMIT = 10
+
+# スプライトシート（全フレームを1枚に並べた画像とフレーム表）のファイル名の末尾と形式名
+SPRITE_SHEET_SUFFIX = ".sheet.json"
+SPRITE_SHEET_FORMAT = "mascot-sprite-sheet"
+
+# 画像を選ぶダイアログのファイルの種類
+IMAGE_FILE_FILTER = "画像ファイル (*.png *.jpg *.jpeg *.bmp *.gif *.sheet.json)"
+
+# 起動時に1回のイベントループで作るマスコットの数（残りは次のループで作る）
+STARTUP_BATCH_SIZE = 8
+
+# 外部のスクリプトから操作するためのローカルサーバーの名前と、1行のリクエストの上限（バイト）
+CONTROL_SERVER_NAME = "mascot_app_control"
+CONTROL_MAX_REQUEST_BYTES = 4 * 1024 * 1024
+
+# スクリプトから指定できる表示倍率・最大サイズ・座標の範囲
+CONTROL_SCALE_RANGE = (0.05, 8.0)
+CONTROL_MAX_SIZE_LIMIT = 4096
+CONTROL_COORDINATE_LIMIT = 100000
+
+# 二重起動を防ぐロックファイルの名前と、2つ目の起動が起動中のアプリに引数を渡すまで待つ時間（ミリ秒）
+INSTANCE_LOCK_FILE = "instance.lock"
+INSTANCE_FORWARD_TIMEOUT = 3000
+
+# 設定ファイルのロックを待つ時間（ミリ秒）
+CONFIG_LOCK_TIMEOUT = 2000
+
+# 削除したマスコットのウィジェットを使い回すために残しておく数（0で使い回さない）
+DEFAULT_WIDGET_POOL_SIZE = 16
+
+# 自動移動（歩く・落ちる・跳ねる）を計算する間隔（ミリ秒）と、1回の計算と反映にかけてよい時間（ミリ秒）
+BEHAVIOR_TICK_INTERVAL = 16
+BEHAVIOR_TICK_BUDGET_MS = 10.0
+
+# 自動移動で動かすマスコットの最大数（表示順で先頭から、残りはその場にとどまる）
+# ウィンドウを動かすのにも動かしたあとのイベント処理にも1体ずつ時間がかかるので、
+# 毎回全員を動かしても1回分がBEHAVIOR_TICK_BUDGET_MSに収まる数にする
+BEHAVIOR_MAX_MASCOTS = 256
+
+# 自動移動の重力（ピクセル/秒^2）、歩く速さと押し合う速さ（ピクセル/秒）、跳ね返りの強さ、着地とみなす落下の速さ（ピクセル/秒）
+BEHAVIOR_GRAVITY = 2000.0
+BEHAVIOR_WALK_SPEED = 40.0
+BEHAVIOR_SEPARATION_SPEED = 120.0
+BEHAVIOR_BOUNCE = 0.4
+BEHAVIOR_REST_SPEED = 80.0
+
+# 押し合いを調べる相手の数（x座標の並び順で前後それぞれ、全部の組み合わせは調べない）
+BEHAVIOR_SEPARATION_NEIGHBORS = 4
+
+# 自動移動中に配置を保存する間隔（ミリ秒）
+BEHAVIOR_SAVE_INTERVAL = 10 * 1000
+
+# 自動移動で動いたマスコットの表示の確認を1回の計算ごとに行う数（残りは次の回に順番に回す）
+BEHAVIOR_VISIBILITY_CHECKS = 32
+
+# GIFのフレームを小さく保存するときのキーフレーム（差分ではなく全体を持つフレーム）の間隔と、
+# 表示用にARGB32に展開しておくフレームの数（表示中とこれから表示するフレーム、使っているマスコット1体あたり）
+COMPACT_KEYFRAME_INTERVAL = 8
+EXPANDED_FRAME_RING = 4
+
+# 右クリックメニューに出すサムネイルの大きさ（ピクセル）と、覚えておくサムネイルの数
+THUMBNAIL_SIZE = 32
+THUMBNAIL_CACHE_SIZE = 128
+
+# 表示倍率と最大サイズから表示サイズを計算する関数
+def scaled_size(size, scale=1.0, max_size=0):
+    width = size.width() * scale
+    height = size.height() * scale
+    
+    # 最大サイズを超える場合は縦横比を保って縮める
+    if max_size > 0 and max(width, height) > max_size:
+        factor = max_size / max(width, height)
+        width *= factor
+        height *= factor
+    
+    return QSize(max(1, round(width)), max(1, round(height)))
+
+# ファイルの内容のSHA-1ハッシュを返す関数（同じ画像を見分けるために使う）
+def file_sha1(path):
+    import hashlib  # 起動を速くするため使うときに読み込む
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 画像のピクセルデータをbytesで返す関数
+def image_bytes(image):
+    return image.constBits().asstring(image.bytesPerLine() * image.height())
+
+# 2つのフレームで変化した範囲を返す関数（同じならば空のQRect、ARGB32の画像どうしで比べる）
+def changed_rect(previous, image):
+    if previous.size() != image.size() or previous.format() != image.format():
+        return image.rect()
+    
+    stride = image.bytesPerLine()
+    row_bytes = image.width() * 4
+    old_data = image_bytes(previous)
+    new_data = image_bytes(image)
+    
+    # 変化のある行
+    rows = [y for y in range(image.height())
+            if old_data[y * stride:y * stride + row_bytes] != new_data[y * stride:y * stride + row_bytes]]
+    if not rows:
+        return QRect()
+    
+    # 変化のある列の範囲（バイト単位、[left, right)）は行ごとに二分探索で広げる
+    left = row_bytes
+    right = 0
+    for y in rows:
+        old_row = old_data[y * stride:y * stride + row_bytes]
+        new_row = new_data[y * stride:y * stride + row_bytes]
+        
+        if left > 0 and old_row[:left] != new_row[:left]:
+            low, high = 0, left - 1
+            while low < high:
+                middle = (low + high) // 2
+                if old_row[:middle + 1] != new_row[:middle + 1]:
+                    high = middle
+                else:
+                    low = middle + 1
+            left = low
+        
+        if right < row_bytes and old_row[right:] != new_row[right:]:
+            low, high = right, row_bytes - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if old_row[middle:] != new_row[middle:]:
+                    low = middle
+                else:
+                    high = middle - 1
+            right = low + 1
+    
+    x1 = left // 4
+    x2 = (right - 1) // 4
+    return QRect(x1, rows[0], x2 - x1 + 1, rows[-1] - rows[0] + 1)
+
+# フレームを小さく保存する形式に変換する関数
+# rectの範囲だけを切り出し、256色以内ならパレット形式（1ピクセル1バイト）にする
+# 戻り値は(範囲, 画像)で、範囲が空なら前のフレームと同じ（画像はNone）
+def compact_frame(image, rect):
+    if rect.isEmpty():
+        return rect, None
+    crop = image if rect == image.rect() else image.copy(rect)
+    
+    # 色の表は乗算済みでないARGBで作る（元に戻して同じになるときだけパレット形式を使う）
+    argb = crop.convertToFormat(QImage.Format_ARGB32)
+    colors = set(memoryview(image_bytes(argb)).cast("I"))
+    if len(colors) <= 256:
+        indexed = argb.convertToFormat(QImage.Format_Indexed8, list(colors))
+        if image_bytes(indexed.convertToFormat(QImage.Format_ARGB32_Premultiplied)) == image_bytes(crop):
+            return rect, indexed
+    return rect, crop
+
+# 小さく保存したフレームのメモリ使用量を返す関数
+def compact_frame_bytes(image):
+    if image is None:
+        return 0
+    return image.bytesPerLine() * image.height() + image.colorCount() * 4
+
+# 当たり判定のマスククラス（フレームの不透明な部分を1ピクセル1ビットで持つ）
+# 前のフレームと同じマスクは同じオブジェクトを使うので、変わったかどうかはisで比べられる
+class HitMask:
+    def __init__(self, mask_image):
+        self.image = mask_image  # Format_MonoLSB（1が不透明）
+        self.width = mask_image.width()
+        self.height = mask_image.height()
+        self.region = None  # ウィンドウの入力範囲（GUIスレッドで最初に使うときに作る）
+    
+    # フレームから当たり判定のマスクを作る関数（アルファが半分以上の部分が不透明、previousと同じならそれを返す）
+    @staticmethod
+    def from_image(image, previous=None):
+        mask_image = image.createAlphaMask(Qt.ThresholdAlphaDither)
+        if (previous is not None and previous.image.size() == mask_image.size()
+                and image_bytes(previous.image) == image_bytes(mask_image)):
+            return previous
+        return HitMask(mask_image)
+    
+    # 指定位置が不透明かどうかを返すメソッド
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and self.image.pixelIndex(x, y) == 1
+    
+    # マスクのメモリ使用量を返すメソッド
+    def byte_size(self):
+        return self.image.bytesPerLine() * self.height
+    
+    # 不透明な部分のQRegionを返すメソッド（空の範囲はマスクなしと同じになるので1ピクセルにする）
+    def input_region(self):
+        if self.region is None:
+            self.region = QRegion(QBitmap.fromImage(self.image))
+            if self.region.isEmpty():
+                self.region = QRegion(0, 0, 1, 1)
+        return self.region
+
+# フレーム間で変化した範囲を順番に求めるクラス（ワーカースレッドでデコードしながら使う）
+class FrameDiffer:
+    def __init__(self):
+        self.first = None
+        self.previous = None
+    
+    # 前のフレームから変化した範囲を返すメソッド（最初のフレームは全体）
+    def diff(self, image):
+        rect = image.rect() if self.previous is None else changed_rect(self.previous, image)
+        if self.first is None:
+            self.first = image
+        self.previous = image
+        return rect
+    
+    # 最後のフレームから最初のフレームに戻るときに変化する範囲を返すメソッド
+    def loop_rect(self):
+        if self.previous is self.first:
+            return self.first.rect()
+        return changed_rect(self.previous, self.first)
+
+# 操作用サーバーの名前を返す関数（同じパソコンのほかのユーザーと重ならないようにする）
+def control_server_name():
+    user = os.path.basename(os.path.expanduser('~')) or "user"
+    return f"{CONTROL_SERVER_NAME}_{user}"
+
+# 起動中のマスコットアプリにリクエストを送って応答を返す関数（スクリプトから使う）
+def send_control_request(request, server_name=None, timeout_ms=5000):
+    from PyQt5.QtNetwork import QLocalSocket  # 起動を速くするため使うときに読み込む
+    socket = QLocalSocket()
+    socket.connectToServer(server_name or control_server_name())
+    if not socket.waitForConnected(timeout_ms):
+        raise ConnectionError(f"マスコットアプリに接続できません: {socket.errorString()}")
+    
+    try:
+        socket.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        socket.waitForBytesWritten(timeout_ms)
+        
+        # 応答は1行のJSON
+        data = bytearray()
+        while b"\n" not in data:
+            if not socket.waitForReadyRead(timeout_ms):
+                raise TimeoutError("マスコットアプリから応答がありません")
+            data += bytes(socket.readAll())
+        return json.loads(bytes(data[:data.index(b"\n")]).decode("utf-8"))
+    finally:
+        socket.disconnectFromServer()
+
+# 起動中のアプリに引数を渡す関数（2つ目の起動で使う、終了コードを返す）
+def forward_to_running_instance(args, timeout_ms=INSTANCE_FORWARD_TIMEOUT):
+    request = {"op": "open_args", "args": args, "cwd": os.getcwd()}
+    deadline = time.perf_counter() + timeout_ms / 1000
+    while True:
+        try:
+            response = send_control_request(request, timeout_ms=timeout_ms)
+            return 0 if response.get("ok") else 1
+        except ConnectionError as e:
+            # 起動中のアプリがまだサーバーを開いていなければ少し待って再試行する
+            if time.perf_counter() >= deadline:
+                print(f"起動中のマスコットアプリに接続できません: {e}")
+                return 1
+            time.sleep(0.05)
+        except Exception as e:
+            print(f"起動中のマスコットアプリへの送信エラー: {e}")
+            return 1
+
+# ファイルをほかのプロセスと同時に読み書きしないようにロックする関数（withで使う）
+@contextmanager
+def locked_file(path, timeout_ms=CONFIG_LOCK_TIMEOUT):
+    lock = QLockFile(path + ".lock")
+    if not lock.tryLock(timeout_ms):
+        raise TimeoutError(f"ファイルのロックを取得できません: {path}")
+    try:
+        yield
+    finally:
+        lock.unlock()
+
+# スプライトシートかどうかを返す関数
+def is_sprite_sheet(path):
+    return path.lower().endswith(SPRITE_SHEET_SUFFIX)
+
+# 追加できる画像のファイルかどうかを返す関数（1枚ずつの追加と一括追加で同じ判定を使う）
+def is_image_file(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS) or is_sprite_sheet(path)
+
+# アニメーションとして扱う画像かどうかを返す関数（GIFとスプライトシート）
+def is_animated_image(path):
+    return path.lower().endswith(".gif") or is_sprite_sheet(path)
+
+# 同じ大きさのフレームを格子状に1枚の画像に並べる関数（画像と各フレームの範囲を返す）
+def pack_frames(images):
+    frame_size = images[0].size()
+    columns = max(1, math.ceil(math.sqrt(len(images))))
+    rows = math.ceil(len(images) / columns)
+    
+    sheet = QImage(columns * frame_size.width(), rows * frame_size.height(), QImage.Format_ARGB32_Premultiplied)
+    sheet.fill(Qt.transparent)
+    
+    rects = []
+    painter = QPainter(sheet)
+    painter.setCompositionMode(QPainter.CompositionMode_Source)
+    for i, image in enumerate(images):
+        rect = QRect((i % columns) * frame_size.width(), (i // columns) * frame_size.height(),
+                     frame_size.width(), frame_size.height())
+        painter.drawImage(rect.topLeft(), image)
+        rects.append(rect)
+    painter.end()
+    return sheet, rects
+
+# スプライトシートを読み込む関数（ワーカースレッドで実行、表示サイズが違えば縮小して並べ直す）
+# 画像とフレームの範囲・表示時間・ループの開始フレーム・前のフレームから変化した範囲を返す
+def load_sprite_sheet(path, scale=1.0, max_size=0):
+    with open(path, 'r', encoding='utf-8') as f:
+        table = json.load(f)
+    if table.get("format") != SPRITE_SHEET_FORMAT:
+        raise ValueError("スプライトシートの形式ではありません")
+    
+    image_path = os.path.join(os.path.dirname(path), table["image"])
+    sheet = QImageReader(image_path).read()
+    if sheet.isNull():
+        raise ValueError(f"スプライトシートの画像を読み込めません: {image_path}")
+    
+    # ループの終わりより後のフレームは再生されないので読み込まない
+    frames = table.get("frames", [])
+    frames = frames[:table.get("loop_end", len(frames) - 1) + 1]
+    if not frames:
+        raise ValueError("スプライトシートにフレームがありません")
+    loop_start = min(max(0, table.get("loop_start", 0)), len(frames) - 1)
+    
+    frame_size = QSize(table["frame_width"], table["frame_height"])
+    rects = [QRect(QPoint(frame["x"], frame["y"]), frame_size) for frame in frames]
+    if not all(sheet.rect().contains(rect) for rect in rects):
+        raise ValueError("フレームの範囲が画像の外にあります")
+    
+    delays = []
+    for frame in frames:
+        delay = frame.get("delay", DEFAULT_FRAME_DELAY)
+        delays.append(delay if delay > 10 else DEFAULT_FRAME_DELAY)
+    
+    # 表示サイズへの縮小・拡大は読み込み時に一度だけ行う
+    target_size = scaled_size(frame_size, scale, max_size)
+    if target_size != frame_size:
+        sheet, rects = pack_frames([sheet.copy(rect).scaled(target_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+                                    for rect in rects])
+    else:
+        sheet = sheet.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    
+    # 最初のフレームはループで最後のフレームから戻ったときの変化
+    differ = FrameDiffer()
+    dirty_rects = []
+    masks = []
+    for rect in rects:
+        frame = sheet.copy(rect)
+        dirty_rects.append(differ.diff(frame))
+        masks.append(HitMask.from_image(frame, masks[-1] if masks else None))
+    dirty_rects[0] = differ.loop_rect()
+    
+    return sheet, rects, delays, loop_start, dirty_rects, masks
+
+# GIFをスプライトシートに変換する関数（作ったフレーム表のパスを返す）
+def convert_gif_to_sprite_sheet(gif_path, output_dir):
+    reader = QImageReader(gif_path)
+    images = []
+    delays = []
+    while True:
+        image = reader.read()
+        if image.isNull():
+            break
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        delay = reader.nextImageDelay()
+        delay = delay if delay > 10 else DEFAULT_FRAME_DELAY
+        
+        # 同じフレームが続く場合は1枚にまとめて表示時間を足す
+        if images and image == images[-1]:
+            delays[-1] += delay
+        else:
+            images.append(image)
+            delays.append(delay)
+    
+    if not images:
+        raise ValueError(reader.errorString())
+    
+    sheet, rects = pack_frames(images)
+    
+    # 元のパスごとに別の名前にする
+    import hashlib  # 起動を速くするため使うときに読み込む
+    stem = os.path.splitext(os.path.basename(gif_path))[0]
+    base_name = f"{stem}_{hashlib.sha1(os.path.abspath(gif_path).encode('utf-8')).hexdigest()[:8]}"
+    os.makedirs(output_dir, exist_ok=True)
+    
+    image_name = base_name + ".sheet.png"
+    if not sheet.save(os.path.join(output_dir, image_name), "PNG"):
+        raise ValueError("スプライトシートの画像を保存できません")
+    
+    table = {
+        "format": SPRITE_SHEET_FORMAT,
+        "version": 1,
+        "image": image_name,
+        "frame_width": images[0].width(),
+        "frame_height": images[0].height(),
+        "frames": [{"x": rect.x(), "y": rect.y(), "delay": delay} for rect, delay in zip(rects, delays)],
+        "loop_start": 0,
+        "loop_end": len(images) - 1,
+        "source": gif_path
+    }
+    json_path = os.path.join(output_dir, base_name + SPRITE_SHEET_SUFFIX)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False, indent=4)
+    return json_path
+
+# サムネイルを読み込む関数（ワーカースレッドで実行、最初のフレームだけを縮小して読む）
+def load_thumbnail(path, size):
+    clip = None
+    if is_sprite_sheet(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            table = json.load(f)
+        frame = table["frames"][0]
+        clip = QRect(frame["x"], frame["y"], table["frame_width"], table["frame_height"])
+        path = os.path.join(os.path.dirname(path), table["image"])
+    
+    reader = QImageReader(path)
+    source_size = reader.size() if clip is None else clip.size()
+    if clip is not None:
+        reader.setClipRect(clip)
+    if source_size.isValid():
+        reader.setScaledSize(source_size.scaled(size, size, Qt.KeepAspectRatio))
+    
+    image = reader.read()
+    if image.isNull():
+        raise ValueError(reader.errorString())
+    if image.width() > size or image.height() > size:
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+# デコード済みフレームのセットクラス（同じ画像を表示するマスコット間で共有）
+class FrameSet:
+    def __init__(self, key, path, is_gif, scale=1.0, max_size=0):
+        self.key = key
+        self.path = path
+        self.is_gif = is_gif
+        self.scale = scale  # 表示倍率
+        self.max_size = max_size  # 表示する最大の幅・高さ（0は制限なし）
+        self.is_sheet = is_sprite_sheet(path)
+        
+        # GIFは前のフレームから変化した範囲だけをパレット形式で持ち、表示するフレームだけを展開する
+        self.compact = is_gif and not self.is_sheet
+        
+        # QPixmapのリスト、小さく保存する場合は(範囲, 画像)のリスト（デコードが進むにつれて増える）
+        self.frames = []
+        self.delays = []  # 各フレームの表示時間（ミリ秒）
+        self.dirty_rects = []  # 前のフレームから変化した範囲（最初のフレームは最後のフレームからの変化）
+        self.masks = []  # 各フレームの当たり判定のマスク（HitMask、同じマスクは共有）
+        self.sheet = None  # スプライトシート（全フレームが並んだ1枚のピクスマップ）
+        self.rects = []  # スプライトシート上の各フレームの範囲
+        self.loop_start = 0  # 最後まで再生したら戻るフレーム
+        self.ref_count = 0  # このフレームを使用中のマスコット数
+        self.stored_bytes = 0  # 保存しているフレームのメモリ使用量
+        self.full_bytes = 0  # 全フレームをARGB32のまま持った場合のメモリ使用量（当たり判定のマスクを含む）
+        
+        # ARGB32に展開済みのフレーム（番号 -> QPixmap、古い順）と、次の差分を重ねる最後に展開したフレーム
+        self.expanded = OrderedDict()
+        self.work_image = None
+        self.work_index = -1
+        self.complete = False  # 全フレームのデコードが終わったかどうか
+        self.failed = False
+        self.task = None  # デコード中のタスク
+        self.listeners = []  # フレームの到着を待っているマスコット
+        self.decode_ms = 0.0  # デコード（またはディスクキャッシュの読み込み）にかかった時間
+        self.from_disk_cache = False
+    
+    # フレーム数を返すメソッド
+    def frame_count(self):
+        if self.sheet is not None:
+            return len(self.rects)
+        return len(self.frames)
+    
+    # 最初のフレームが表示できるかどうかを返すメソッド
+    def is_ready(self):
+        return self.frame_count() > 0
+    
+    # アニメーションかどうかを返すメソッド（デコード中のGIFも含む）
+    def is_animated(self):
+        if self.complete:
+            return self.frame_count() > 1
+        return self.is_gif
+    
+    # メモリ使用量を返すメソッド（展開済みのフレームを含む）
+    @property
+    def byte_size(self):
+        expanded_count = len(self.expanded) + (1 if self.work_image is not None else 0)
+        if expanded_count == 0:
+            return self.stored_bytes
+        size = self.size()
+        return self.stored_bytes + expanded_count * size.width() * size.height() * 4
+    
+    # 指定フレームのピクスマップを返すメソッド（スプライトシートではシート全体）
+    def pixmap(self, index):
+        if self.sheet is not None:
+            return self.sheet
+        if not self.compact:
+            return self.frames[index]
+        
+        pixmap = self.expand(index)
+        
+        # この後に表示するフレームも展開しておく
+        upcoming = index
+        for _ in range(EXPANDED_FRAME_RING - 1):
+            upcoming += 1
+            if upcoming >= len(self.frames):
+                if not self.complete:
+                    break
+                upcoming = self.loop_start
+            if upcoming == index:
+                break
+            if upcoming not in self.expanded:
+                self.expand(upcoming)
+        return pixmap
+    
+    # 展開しておくフレームの数を返すメソッド（表示しているマスコットごとに別のフレームを表示していることがある）
+    def ring_capacity(self):
+        return min(len(self.frames), EXPANDED_FRAME_RING * max(1, self.ref_count))
+    
+    # 小さく保存したフレームをARGB32に展開するメソッド
+    def expand(self, index):
+        pixmap = self.expanded.get(index)
+        if pixmap is not None:
+            self.expanded.move_to_end(index)
+            return pixmap
+        
+        # 最後に展開したフレームに差分を重ねる（離れていれば手前のキーフレームから重ね直す）
+        keyframe = index - index % COMPACT_KEYFRAME_INTERVAL
+        if self.work_image is not None and keyframe <= self.work_index < index:
+            start = self.work_index + 1
+        else:
+            self.work_image = self.frames[keyframe][1].convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            start = keyframe + 1
+        
+        if start <= index:
+            painter = QPainter(self.work_image)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            for rect, image in self.frames[start:index + 1]:
+                if image is not None:
+                    painter.drawImage(rect.topLeft(), image)
+            painter.end()
+        self.work_index = index
+        
+        pixmap = QPixmap.fromImage(self.work_image)
+        self.expanded[index] = pixmap
+        while len(self.expanded) > self.ring_capacity():
+            self.expanded.popitem(last=False)
+        return pixmap
+    
+    # 小さく保存しても展開しておくフレームの分ほども節約にならなければ、全フレームを展開して持つメソッド
+    # （256色を超えて全体が変わるフレームが多い場合や、多くのマスコットで共有して展開するフレームが増えた場合、
+    # デコード完了時と使用するマスコットが増えたときに呼ぶ。展開した後は全マスコットで1組のフレームを共有する）
+    def expand_if_not_smaller(self):
+        if not self.compact or not self.frames:
+            return
+        size = self.size()
+        frame_bytes = size.width() * size.height() * 4
+        if self.full_bytes - self.stored_bytes >= (self.ring_capacity() + 1) * frame_bytes:
+            return
+        
+        self.frames = [self.expand(index) for index in range(len(self.frames))]
+        self.compact = False
+        self.stored_bytes = self.full_bytes
+        self.release_expanded()
+    
+    # 展開済みのフレームを捨てるメソッド（小さく保存したフレームは残す）
+    def release_expanded(self):
+        self.expanded.clear()
+        self.work_image = None
+        self.work_index = -1
+    
+    # 指定フレームのピクスマップ上の範囲を返すメソッド（スプライトシート以外はNoneで全体）
+    def source_rect(self, index):
+        if self.sheet is not None:
+            return self.rects[index]
+        return None
+    
+    # 指定フレームの表示時間を返すメソッド
+    def delay(self, index):
+        return self.delays[index]
+    
+    # 前のフレームから指定フレームに切り替えるときに描き直す範囲を返すメソッド
+    def dirty_rect(self, index):
+        return self.dirty_rects[index]
+    
+    # 指定フレームの当たり判定のマスクを返すメソッド
+    def hit_mask(self, index):
+        return self.masks[index]
+    
+    # フレームサイズを返すメソッド
+    def size(self):
+        if self.sheet is not None:
+            return self.rects[0].size()
+        if self.compact:
+            return self.frames[0][1].size()
+        return self.frames[0].size()
+    
+    # スプライトシートを設定するメソッド
+    def set_sheet(self, image, rects):
+        self.sheet = QPixmap.fromImage(image)
+        self.rects = rects
+        self.stored_bytes += image.width() * image.height() * 4
+        self.full_bytes += image.width() * image.height() * 4
+    
+    # 当たり判定のマスクを追加するメソッド（前のフレームと同じマスクは数えない）
+    def append_masks(self, masks):
+        for mask in masks:
+            if not self.masks or mask is not self.masks[-1]:
+                # マスクはどちらの持ち方でも同じだけ使う
+                self.stored_bytes += mask.byte_size()
+                self.full_bytes += mask.byte_size()
+            self.masks.append(mask)
+    
+    # デコードしたフレームを追加するメソッド（小さく保存する場合は(範囲, 画像)を受け取る）
+    def append_frames(self, images, delays, dirty_rects):
+        for frame in images:
+            if self.compact:
+                self.frames.append(frame)
+                self.stored_bytes += compact_frame_bytes(frame[1])
+                size = self.size()
+            else:
+                self.frames.append(QPixmap.fromImage(frame))
+                size = frame.size()
+                self.stored_bytes += size.width() * size.height() * 4
+            self.full_bytes += size.width() * size.height() * 4
+        self.delays.extend(delays)
+        self.dirty_rects.extend(dirty_rects)
+
+# 画像デコードタスククラス（ワーカースレッドで実行）
+class DecodeTask(QRunnable):
+    def __init__(self, store, frame_set):
+        super().__init__()
+        self.store = store
+        self.frame_set = frame_set
+        self.path = frame_set.path
+        self.is_gif = frame_set.is_gif
+        self.scale = frame_set.scale
+        self.max_size = frame_set.max_size
+        self.compact = frame_set.compact  # GUIスレッドがデコード完了後に展開して変えることがあるので最初の値を使う
+        self.cancelled = False
+    
+    # 小さく保存するフレームセットなら、送る前にフレームを変換するメソッド
+    # rectは前のフレームから変化した範囲（キーフレームでは全体を持つ）
+    def encode(self, image, index, rect):
+        if not self.compact:
+            return image
+        if index % COMPACT_KEYFRAME_INTERVAL == 0:
+            rect = image.rect()
+        return compact_frame(image, rect)
+    
+    # デコードを実行するメソッド（最初のフレームはすぐに、残りはまとめて送る）
+    def run(self):
+        try:
+            start_time = time.perf_counter()
+            
+            # スプライトシートは1枚の画像を一度デコードするだけでよい
+            if self.frame_set.is_sheet:
+                sheet, rects, delays, loop_start, dirty_rects, masks = load_sprite_sheet(self.path, self.scale,
+                                                                                         self.max_size)
+                self.frame_set.loop_start = loop_start
+                self.frame_set.decode_ms = (time.perf_counter() - start_time) * 1000
+                if not self.cancelled:
+                    self.store.sheet_decoded.emit(self.frame_set, sheet, rects, delays, dirty_rects, masks)
+                return
+            
+            # ディスクキャッシュにあればデコードせずにそのまま使う（変化した範囲とマスクも保存してある）
+            disk_cache = self.store.disk_cache
+            if disk_cache is not None:
+                cached = disk_cache.load(self.frame_set.key, self.compact)
+                if cached is not None:
+                    frames, cached_delays, dirty_rects, masks, loop_rect = cached
+                    self.frame_set.decode_ms = (time.perf_counter() - start_time) * 1000
+                    self.frame_set.from_disk_cache = True
+                    self.store.frames_decoded.emit(self.frame_set, frames, cached_delays, dirty_rects, masks,
+                                                   loop_rect, True)
+                    return
+            
+            reader = QImageReader(self.path)
+            images = []
+            delays = []
+            dirty_rects = []
+            masks = []
+            sent_count = 0
+            target_size = None
+            last_mask = None  # 前のフレームのマスク（同じなら共有する）
+            
+            # 前のフレームから変化した範囲はデコードしながら求めておく
+            differ = FrameDiffer()
+            
+            # ディスクキャッシュに保存するために送ったものを全部覚えておく
+            all_frames = []
+            all_delays = []
+            all_dirty_rects = []
+            all_masks = []
+            
+            while not self.cancelled:
+                image = reader.read()
+                if image.isNull():
+                    break
+                
+                # 表示サイズへの縮小・拡大はデコード時に一度だけ行う
+                if target_size is None:
+                    target_size = scaled_size(image.size(), self.scale, self.max_size)
+                if image.size() != target_size:
+                    image = image.scaled(target_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+                if image.format() != QImage.Format_ARGB32_Premultiplied:
+                    image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+                
+                dirty_rects.append(differ.diff(image))
+                images.append(self.encode(image, len(all_frames), dirty_rects[-1]))
+                last_mask = HitMask.from_image(image, last_mask)
+                masks.append(last_mask)
+                
+                # 遅延が0や極端に短いフレームは既定値で表示
+                delay = reader.nextImageDelay()
+                delays.append(delay if delay > 10 else DEFAULT_FRAME_DELAY)
+                
+                all_frames.append(images[-1])
+                all_delays.append(delays[-1])
+                all_dirty_rects.append(dirty_rects[-1])
+                all_masks.append(last_mask)
+                
+                # 静止画は最初のフレームだけ使う
+                if not self.is_gif:
+                    break
+                
+                # 最初のフレームと、一定数たまったフレームを送る
+                if sent_count == 0 or len(images) >= DECODE_BATCH_FRAMES:
+                    self.store.frames_decoded.emit(self.frame_set, images, delays, dirty_rects, masks, None, False)
+                    sent_count += len(images)
+                    images = []
+                    delays = []
+                    dirty_rects = []
+                    masks = []
+            
+            if self.cancelled:
+                return
+            
+            if sent_count == 0 and not images:
+                self.store.decode_failed.emit(self.frame_set, reader.errorString())
+            else:
+                self.frame_set.decode_ms = (time.perf_counter() - start_time) * 1000
+                loop_rect = differ.loop_rect()
+                self.store.frames_decoded.emit(self.frame_set, images, delays, dirty_rects, masks, loop_rect, True)
+                
+                # 次回の起動ですぐに読み込めるようにディスクキャッシュに保存
+                if disk_cache is not None:
+                    disk_cache.store(self.frame_set.key, self.compact, all_frames, all_delays,
+                                     all_dirty_rects, all_masks, loop_rect)
+        except Exception as e:
+            self.store.decode_failed.emit(self.frame_set, str(e))
+
+# ディスクキャッシュクラス（デコード済みフレームをファイルに保存し、次回起動時にそのまま読み込む）
+# フレームは送ったときの形（小さく保存する場合は変化した範囲のパレット形式）のまま、
+# 変化した範囲と当たり判定のマスクも一緒に保存する
+class DiskFrameCache:
+    # ファイルの先頭に置くヘッダー
+    # 識別子, バージョン, 小さく保存しているかどうか, フレーム数, マスク数,
+    # 元ファイルのサイズ, 元ファイルの更新日時, 表示倍率, 最大サイズ, パスの長さ
+    HEADER = struct.Struct("<4sHHIIQqdII")
+    # フレームごとの情報: 前のフレームから変化した範囲, 保存した範囲, マスクの番号
+    FRAME = struct.Struct("<iiiiiiiiI")
+    # 範囲（最後のフレームから最初のフレームに戻るときの変化）
+    RECT = struct.Struct("<iiii")
+    # 画像ごとの情報: 画像形式（Format_Invalidは画像なし）, 幅, 高さ, 1行のバイト数, 色の数
+    IMAGE = struct.Struct("<IIIII")
+    MAGIC = b"MSCF"
+    VERSION = 2
+    
+    def __init__(self, cache_dir, max_mb=DEFAULT_DISK_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        
+        # 統計情報（ワーカースレッドから数えるのでロックで守る）
+        self.count_lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+        
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"ディスクキャッシュの作成エラー: {e}")
+            self.max_bytes = 0
+    
+    # キャッシュが有効かどうかを返すメソッド
+    def enabled(self):
+        return self.max_bytes > 0
+    
+    # 読み込めたかどうかを数えるメソッド
+    def count(self, hit):
+        with self.count_lock:
+            if hit:
+                self.hit_count += 1
+            else:
+                self.miss_count += 1
+    
+    # キャッシュファイルのパスを返すメソッド（元ファイルと表示サイズの指定ごとに1つ）
+    def entry_path(self, key):
+        import hashlib  # 起動を速くするため使うときに読み込む
+        norm_path, _, _, scale, max_size = key
+        name = hashlib.sha1(f"{norm_path}|{scale}|{max_size}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name + ".frames")
+    
+    # キャッシュからフレームを読み込むメソッド（なければNone）
+    # 戻り値は(フレーム, 表示時間, 変化した範囲, マスク, 最初のフレームに戻るときの変化)
+    def load(self, key, compact):
+        if not self.enabled():
+            return None
+        
+        import mmap  # 起動を速くするため使うときに読み込む
+        norm_path, source_mtime, source_size, scale, max_size = key
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    (magic, version, cached_compact, frame_count, mask_count, cached_size, cached_mtime,
+                     cached_scale, cached_max_size, path_length) = self.HEADER.unpack_from(mapped, 0)
+                    offset = self.HEADER.size
+                    cached_path = bytes(mapped[offset:offset + path_length]).decode("utf-8")
+                    offset += path_length
+                    
+                    # 元ファイルのパス・サイズ・更新日時と保存の形が一致しなければ使わない
+                    if (magic != self.MAGIC or version != self.VERSION or cached_path != norm_path
+                            or cached_size != source_size or cached_mtime != source_mtime
+                            or cached_scale != scale or cached_max_size != max_size
+                            or bool(cached_compact) != compact or frame_count == 0):
+                        self.count(False)
+                        return None
+                    
+                    delays = list(struct.unpack_from(f"<{frame_count}I", mapped, offset))
+                    offset += 4 * frame_count
+                    entries = []
+                    for _ in range(frame_count):
+                        entries.append(self.FRAME.unpack_from(mapped, offset))
+                        offset += self.FRAME.size
+                    loop_rect = QRect(*self.RECT.unpack_from(mapped, offset))
+                    offset = self.align(offset + self.RECT.size)
+                    
+                    # 画像のデータはコピーするだけ（デコードしない）
+                    view = memoryview(mapped)
+                    try:
+                        images = []
+                        for _ in range(frame_count + mask_count):
+                            image, offset = self.read_image(view, offset)
+                            images.append(image)
+                    finally:
+                        view.release()
+            
+            masks = [HitMask(image) for image in images[frame_count:]]
+            frames = []
+            dirty_rects = []
+            mask_list = []
+            for entry, image in zip(entries, images):
+                dirty_rects.append(QRect(*entry[0:4]))
+                frames.append((QRect(*entry[4:8]), image) if compact else image)
+                mask_list.append(masks[entry[8]])
+            
+            # 最終使用日時として更新日時を新しくする（古いものから削除するため）
+            os.utime(path, None)
+            self.count(True)
+            return frames, delays, dirty_rects, mask_list, loop_rect
+        except FileNotFoundError:
+            self.count(False)
+            return None
+        except Exception as e:
+            print(f"ディスクキャッシュの読み込みエラー: {e}")
+            self.count(False)
+            return None
+    
+    # 保存した画像を1つ読み込むメソッド（画像と次の画像の位置を返す）
+    def read_image(self, view, offset):
+        image_format, width, height, bytes_per_line, color_count = self.IMAGE.unpack_from(view, offset)
+        offset += self.IMAGE.size
+        colors = list(struct.unpack_from(f"<{color_count}I", view, offset))
+        offset += 4 * color_count
+        
+        image = None
+        if image_format != QImage.Format_Invalid:
+            chunk = view[offset:offset + bytes_per_line * height]
+            image = QImage(sip.voidptr(chunk), width, height, bytes_per_line, image_format).copy()
+            chunk.release()
+            if colors:
+                image.setColorTable(colors)
+            offset += bytes_per_line * height
+        return image, self.align(offset)
+    
+    # 画像を1つ書き込むメソッド（Noneは画像なしとして書く）
+    def write_image(self, f, image):
+        if image is None:
+            f.write(self.IMAGE.pack(QImage.Format_Invalid, 0, 0, 0, 0))
+        else:
+            colors = image.colorTable()
+            f.write(self.IMAGE.pack(image.format(), image.width(), image.height(), image.bytesPerLine(), len(colors)))
+            f.write(struct.pack(f"<{len(colors)}I", *colors))
+            f.write(image_bytes(image))
+        f.write(b"\0" * (self.align(f.tell()) - f.tell()))
+    
+    # フレームをキャッシュに保存するメソッド
+    # framesはフレームセットに送ったときの形（小さく保存する場合は(範囲, 画像)）のまま受け取る
+    def store(self, key, compact, frames, delays, dirty_rects, masks, loop_rect):
+        if not self.enabled() or not frames:
+            return
+        
+        norm_path, source_mtime, source_size, scale, max_size = key
+        
+        # 元ファイルが見つからない場合は保存しない
+        if source_size == 0 and source_mtime == 0:
+            return
+        
+        # 同じマスクは1つだけ保存して番号で参照する
+        unique_masks = []
+        mask_numbers = {}
+        for mask in masks:
+            if id(mask) not in mask_numbers:
+                mask_numbers[id(mask)] = len(unique_masks)
+                unique_masks.append(mask)
+        encoded_path = norm_path.encode("utf-8")
+        
+        path = self.entry_path(key)
+        temp_path = None
+        try:
+            import tempfile  # 起動を速くするため使うときに読み込む
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, int(compact), len(frames), len(unique_masks),
+                                         source_size, source_mtime, scale, max_size, len(encoded_path)))
+                f.write(encoded_path)
+                f.write(struct.pack(f"<{len(delays)}I", *delays))
+                
+                images = []
+                for frame, dirty_rect, mask in zip(frames, dirty_rects, masks):
+                    rect, image = frame if compact else (frame.rect(), frame)
+                    f.write(self.FRAME.pack(dirty_rect.x(), dirty_rect.y(), dirty_rect.width(), dirty_rect.height(),
+                                            rect.x(), rect.y(), rect.width(), rect.height(), mask_numbers[id(mask)]))
+                    images.append(image)
+                f.write(self.RECT.pack(loop_rect.x(), loop_rect.y(), loop_rect.width(), loop_rect.height()))
+                f.write(b"\0" * (self.align(f.tell()) - f.tell()))
+                
+                for image in images:
+                    self.write_image(f, image)
+                for mask in unique_masks:
+                    self.write_image(f, mask.image)
+            os.replace(temp_path, path)
+            temp_path = None
+        except Exception as e:
+            print(f"ディスクキャッシュの保存エラー: {e}")
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+        
+        self.cleanup()
+    
+    # 上限を超えた分を使われていない順に削除するメソッド
+    def cleanup(self):
+        with self.lock:
+            try:
+                entries = []
+                total = 0
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith(".frames"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+                
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes:
+                        break
+                    os.remove(path)
+                    total -= size
+            except OSError as e:
+                print(f"ディスクキャッシュの整理エラー: {e}")
+    
+    # フレームデータの開始位置を揃えるメソッド
+    @staticmethod
+    def align(offset):
+        return (offset + 63) // 64 * 64
+
+# フレームストアクラス（プロセス全体でデコード済みフレームを共有・管理）
+class FrameStore(QObject):
+    # ワーカースレッドからデコード結果を受け取るシグナル
+    frames_decoded = pyqtSignal(object, object, object, object, object, object, bool)
+    sheet_decoded = pyqtSignal(object, object, object, object, object, object)
+    decode_failed = pyqtSignal(object, str)
+    
+    def __init__(self, budget_mb=DEFAULT_FRAME_CACHE_MB, parent=None, disk_cache=None, metrics=None):
+        super().__init__(parent)
+        self.disk_cache = disk_cache  # デコード済みフレームのディスクキャッシュ（なくてもよい）
+        self.metrics = metrics  # デコード時間を記録するパフォーマンス統計（なくてもよい）
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.active = {}  # 使用中のフレームセット（キー -> FrameSet）
+        self.unused = OrderedDict()  # 未使用のフレームセット（古い順、LRU）
+        
+        # デコード用のスレッドプール（GUIスレッドを止めないため）
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max(1, QThread.idealThreadCount() - 1))
+        
+        self.frames_decoded.connect(self.on_frames_decoded)
+        self.sheet_decoded.connect(self.on_sheet_decoded)
+        self.decode_failed.connect(self.on_decode_failed)
+    
+    # 全フレームセットのメモリ使用量を返すメソッド（展開済みのフレームは表示に合わせて増減する）
+    @property
+    def total_bytes(self):
+        return (sum(frame_set.byte_size for frame_set in self.active.values())
+                + sum(frame_set.byte_size for frame_set in self.unused.values()))
+    
+    # 全フレームセットを全フレームARGB32で持った場合と比べて節約しているメモリ量を返すメソッド
+    def saved_bytes(self):
+        return sum(frame_set.full_bytes - frame_set.byte_size
+                   for frame_sets in (self.active.values(), self.unused.values())
+                   for frame_set in frame_sets)
+    
+    # キャッシュのキーを作るメソッド（パス・更新日時・ファイルサイズと表示サイズの指定）
+    def make_key(self, path, scale=1.0, max_size=0):
+        norm_path = os.path.normcase(os.path.abspath(path))
+        try:
+            stat = os.stat(path)
+            return (norm_path, stat.st_mtime_ns, stat.st_size, scale, max_size)
+        except OSError:
+            return (norm_path, 0, 0, scale, max_size)
+    
+    # フレームセットを取得するメソッド（参照カウントを増やす）
+    # まだデコードしていなければバックグラウンドでデコードを始め、
+    # フレームが届いたら listener の on_frames_ready / on_frames_failed を呼ぶ
+    # 同じ画像でも表示サイズが違えば別のフレームセットとして縮小済みのものを持つ
+    def acquire(self, path, is_gif, listener=None, scale=1.0, max_size=0):
+        key = self.make_key(path, scale, max_size)
+        
+        frame_set = self.active.get(key)
+        if frame_set is None:
+            frame_set = self.unused.pop(key, None)
+            if frame_set is None:
+                frame_set = FrameSet(key, path, is_gif, scale, max_size)
+                frame_set.task = DecodeTask(self, frame_set)
+                self.thread_pool.start(frame_set.task)
+            self.active[key] = frame_set
+        
+        frame_set.ref_count += 1
+        if frame_set.complete:
+            frame_set.expand_if_not_smaller()
+        if listener is not None and not frame_set.complete:
+            frame_set.listeners.append(listener)
+        return frame_set
+    
+    # フレームセットを返却するメソッド（参照カウントを減らす）
+    def release(self, frame_set, listener=None):
+        if frame_set is None or self.active.get(frame_set.key) is not frame_set:
+            return
+        
+        if listener in frame_set.listeners:
+            frame_set.listeners.remove(listener)
+        
+        frame_set.ref_count -= 1
+        if frame_set.ref_count <= 0:
+            del self.active[frame_set.key]
+            
+            if not frame_set.complete or frame_set.failed:
+                # デコード途中や失敗したものは中止して破棄する
+                self.discard(frame_set)
+            else:
+                # 誰も使っていなければ展開済みのフレームを捨ててLRUに移す（上限を超えていれば解放）
+                frame_set.release_expanded()
+                self.unused[frame_set.key] = frame_set
+                self.evict()
+    
+    # フレームセットを破棄するメソッド
+    def discard(self, frame_set):
+        if frame_set.task is not None:
+            frame_set.task.cancelled = True
+            frame_set.task = None
+        frame_set.frames = []
+        frame_set.masks = []
+        frame_set.sheet = None
+        frame_set.rects = []
+        frame_set.stored_bytes = 0
+        frame_set.release_expanded()
+        frame_set.listeners = []
+    
+    # 上限を超えた分の未使用フレームを古い順に解放するメソッド
+    def evict(self):
+        while self.total_bytes > self.budget_bytes and self.unused:
+            _, frame_set = self.unused.popitem(last=False)
+            self.discard(frame_set)
+    
+    # メモリ上限を変更するメソッド
+    def set_budget(self, budget_mb):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.evict()
+    
+    # デコード済みフレームを受け取るメソッド（GUIスレッドで実行）
+    # loop_rectはデコード完了時に送られる、最後のフレームから最初のフレームに戻るときの変化
+    def on_frames_decoded(self, frame_set, images, delays, dirty_rects, masks, loop_rect, done):
+        # 途中で破棄されたフレームセットの結果は捨てる
+        if self.active.get(frame_set.key) is not frame_set:
+            return
+        
+        was_ready = frame_set.is_ready()
+        frame_set.append_masks(masks)
+        frame_set.append_frames(images, delays, dirty_rects)
+        
+        if done:
+            if loop_rect is not None and frame_set.dirty_rects:
+                frame_set.dirty_rects[0] = loop_rect
+            frame_set.expand_if_not_smaller()
+            frame_set.complete = True
+            frame_set.task = None
+            if self.metrics is not None:
+                self.metrics.record_time("disk_cache_load" if frame_set.from_disk_cache else "decode",
+                                         frame_set.decode_ms)
+        
+        # 最初のフレームの到着とデコード完了を待っているマスコットに知らせる
+        if not was_ready or done:
+            for listener in list(frame_set.listeners):
+                listener.on_frames_ready(frame_set)
+        if done:
+            frame_set.listeners = []
+        
+        self.evict()
+    
+    # 読み込んだスプライトシートを受け取るメソッド（GUIスレッドで実行）
+    def on_sheet_decoded(self, frame_set, sheet, rects, delays, dirty_rects, masks):
+        if self.active.get(frame_set.key) is not frame_set:
+            return
+        
+        frame_set.set_sheet(sheet, rects)
+        
+        # 表示時間とマスクの追加と完了の通知はGIFと同じ
+        self.on_frames_decoded(frame_set, [], delays, dirty_rects, masks, None, True)
+    
+    # デコードの失敗を受け取るメソッド（GUIスレッドで実行）
+    def on_decode_failed(self, frame_set, message):
+        if self.active.get(frame_set.key) is not frame_set:
+            return
+        
+        print(f"画像の読み込みエラー: {frame_set.path}: {message}")
+        frame_set.failed = True
+        frame_set.complete = True
+        frame_set.task = None
+        
+        listeners = frame_set.listeners
+        frame_set.listeners = []
+        for listener in listeners:
+            listener.on_frames_failed(frame_set)
+
+# アニメーションスケジューラクラス（1つのタイマーで全マスコットのGIFを進める）
+class AnimationScheduler(QObject):
+    def __init__(self, parent=None, max_fps=DEFAULT_MAX_FPS):
+        super().__init__(parent)
+        
+        # 再生中のマスコット（登録順を保つためdictを使う）
+        self.mascots = {}
+        
+        # 共通の時計
+        self.clock = QElapsedTimer()
+        self.clock.start()
+        self.last_tick = -1000
+        self.next_due = None
+        
+        # 全体のフレームレート上限
+        self.min_interval = 0
+        self.set_max_fps(max_fps)
+        
+        # 全マスコット共通のタイマー
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+    
+    # 現在時刻（ミリ秒）を返すメソッド
+    def now(self):
+        return self.clock.elapsed()
+    
+    # フレームレート上限を設定するメソッド
+    def set_max_fps(self, max_fps):
+        self.max_fps = max_fps
+        self.min_interval = int(1000 / max_fps) if max_fps and max_fps > 0 else 0
+    
+    # マスコットが再生対象かどうかを返すメソッド
+    def is_registered(self, mascot):
+        return mascot in self.mascots
+    
+    # マスコットを再生対象に登録するメソッド（next_frame_timeは呼び出し側で設定しておく）
+    def register(self, mascot):
+        self.mascots[mascot] = True
+        self.request_tick(mascot.next_frame_time)
+    
+    # マスコットを再生対象から外すメソッド
+    def unregister(self, mascot):
+        self.mascots.pop(mascot, None)
+        if not self.mascots:
+            self.timer.stop()
+            self.next_due = None
+    
+    # 指定時刻までに次のティックが来るようにするメソッド
+    def request_tick(self, due):
+        if self.timer.isActive() and self.next_due is not None and self.next_due <= due:
+            return
+        self.start_timer(due)
+    
+    # タイマーを開始するメソッド（フレームレート上限を考慮）
+    def start_timer(self, due):
+        now = self.now()
+        due = max(due, self.last_tick + self.min_interval)
+        self.next_due = due
+        self.timer.start(max(0, due - now))
+    
+    # 全マスコットのアニメーションを一度に進めるメソッド
+    def tick(self):
+        now = self.now()
+        self.last_tick = now
+        self.next_due = None
+        
+        next_due = None
+        
+        # 見えないマスコットはVisibilityManagerが登録から外している
+        # 再描画はこのティック内でまとめて要求される
+        for mascot in list(self.mascots):
+            mascot.advance_animation(now)
+            if next_due is None or mascot.next_frame_time < next_due:
+                next_due = mascot.next_frame_time
+        
+        if next_due is not None:
+            self.start_timer(next_due)
+
+# Windowsの構造体（最後の入力時刻, 矩形, モニター情報）を作る関数
+# ctypesはWindowsでしか使わないので、使うときに読み込む
+def windows_structures():
+    import ctypes
+    
+    class LastInputInfo(ctypes.Structure):
+        _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+    
+    class WinRect(ctypes.Structure):
+        _fields_ = [("left", ctypes.c_long), ("top", ctypes.c_long),
+                    ("right", ctypes.c_long), ("bottom", ctypes.c_long)]
+    
+    class MonitorInfo(ctypes.Structure):
+        _fields_ = [("cbSize", ctypes.c_uint), ("rcMonitor", WinRect),
+                    ("rcWork", WinRect), ("dwFlags", ctypes.c_uint)]
+    
+    return LastInputInfo, WinRect, MonitorInfo
+
+# デスクトップの状態を調べるクラス（全画面アプリと無操作時間、Windows以外では何もしない）
+class DesktopActivity:
+    # SHQueryUserNotificationStateの戻り値（Direct3Dの排他的全画面）
+    QUNS_RUNNING_D3D_FULL_SCREEN = 3
+    
+    def __init__(self):
+        self.user32 = None
+        self.kernel32 = None
+        self.shell32 = None
+        
+        if sys.platform != "win32":
+            return
+        
+        try:
+            import ctypes
+            self.LastInputInfo, self.WinRect, self.MonitorInfo = windows_structures()
+            WinRect, MonitorInfo = self.WinRect, self.MonitorInfo
+            user32 = ctypes.windll.user32
+            user32.GetForegroundWindow.restype = ctypes.c_void_p
+            user32.GetDesktopWindow.restype = ctypes.c_void_p
+            user32.GetShellWindow.restype = ctypes.c_void_p
+            user32.GetWindowThreadProcessId.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong)]
+            user32.GetWindowRect.argtypes = [ctypes.c_void_p, ctypes.POINTER(WinRect)]
+            user32.MonitorFromWindow.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+            user32.MonitorFromWindow.restype = ctypes.c_void_p
+            user32.GetMonitorInfoW.argtypes = [ctypes.c_void_p, ctypes.POINTER(MonitorInfo)]
+            self.user32 = user32
+            self.kernel32 = ctypes.windll.kernel32
+            self.shell32 = ctypes.windll.shell32
+        except Exception as e:
+            print(f"デスクトップ状態の取得エラー: {e}")
+            self.user32 = None
+    
+    # 状態を調べられるかどうかを返すメソッド
+    def available(self):
+        return self.user32 is not None
+    
+    # 最後の入力からの経過時間（ミリ秒）を返すメソッド
+    def idle_time(self):
+        import ctypes
+        info = self.LastInputInfo()
+        info.cbSize = ctypes.sizeof(info)
+        if not self.user32.GetLastInputInfo(ctypes.byref(info)):
+            return 0
+        return (self.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF
+    
+    # 全画面で表示されているほかのアプリの画面範囲と、排他的全画面かどうかを返すメソッド
+    def fullscreen_window(self):
+        import ctypes
+        hwnd = self.user32.GetForegroundWindow()
+        if not hwnd or hwnd in (self.user32.GetDesktopWindow(), self.user32.GetShellWindow()):
+            return None, False
+        
+        # 自分のウィンドウ（オーバーレイなど）は対象外
+        pid = ctypes.c_ulong()
+        self.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        if pid.value == os.getpid():
+            return None, False
+        
+        rect = self.WinRect()
+        if not self.user32.GetWindowRect(hwnd, ctypes.byref(rect)):
+            return None, False
+        
+        info = self.MonitorInfo()
+        info.cbSize = ctypes.sizeof(info)
+        monitor = self.user32.MonitorFromWindow(hwnd, 2)  # MONITOR_DEFAULTTONEAREST
+        if not monitor or not self.user32.GetMonitorInfoW(monitor, ctypes.byref(info)):
+            return None, False
+        
+        screen = info.rcMonitor
+        if (rect.left > screen.left or rect.top > screen.top or
+                rect.right < screen.right or rect.bottom < screen.bottom):
+            return None, False
+        
+        state = ctypes.c_int()
+        exclusive = (self.shell32.SHQueryUserNotificationState(ctypes.byref(state)) == 0 and
+                     state.value == self.QUNS_RUNNING_D3D_FULL_SCREEN)
+        return (screen.left, screen.top, screen.right - screen.left, screen.bottom - screen.top), exclusive
+
+# マスコットが見えているかどうかを管理するクラス（見えないマスコットのアニメーションを止める）
+class VisibilityManager(QObject):
+    def __init__(self, app, release_delay=FRAME_RELEASE_DELAY):
+        super().__init__(app)
+        self.app = app
+        self.release_delay = release_delay
+        
+        self.mascots = {}  # 管理しているマスコット
+        self.suspended = {}  # 止めているマスコット -> 止めた時刻（フレーム返却後はNone）
+        self.windows = {}  # ネイティブウィンドウ -> マスコット（露出イベントの送り元）
+        self.exposed = {}  # ネイティブウィンドウ -> 最後の露出イベントで見えていたかどうか
+        self.dirty = {}  # 確認待ちのマスコット
+        
+        # 画面の範囲（画面の追加・削除・変更のときだけ取り直す）
+        self.screens = []
+        self.screens_dirty = True
+        
+        # 全画面アプリと無操作の状態
+        self.activity = DesktopActivity()
+        self.fullscreen_rect = None
+        self.fullscreen_exclusive = False
+        self.user_idle = False
+        
+        # 見えているかどうかの確認はイベントループの次のターンでまとめて行う
+        self.check_timer = QTimer(self)
+        self.check_timer.setSingleShot(True)
+        self.check_timer.timeout.connect(self.check_pending)
+        
+        # 止めてから時間がたったマスコットのフレームを返却するタイマー
+        self.release_timer = QTimer(self)
+        self.release_timer.setSingleShot(True)
+        self.release_timer.timeout.connect(self.release_expired)
+        
+        # 全画面アプリと無操作時間を確認するタイマー（調べられる環境のときだけ）
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(VISIBILITY_POLL_INTERVAL)
+        self.poll_timer.timeout.connect(self.poll_activity)
+        if self.activity.available():
+            self.poll_timer.start()
+        
+        # 画面の構成が変わったら全マスコットを確認し直す
+        qapp = QApplication.instance()
+        qapp.screenAdded.connect(self.on_screen_added)
+        qapp.screenRemoved.connect(self.on_screens_changed)
+        for screen in QApplication.screens():
+            screen.geometryChanged.connect(self.on_screens_changed)
+    
+    # 現在時刻（アニメーションと共通の時計）を返すメソッド
+    def now(self):
+        return self.app.animation_scheduler.now()
+    
+    # マスコットの管理を開始するメソッド
+    def track(self, mascot):
+        if mascot in self.mascots:
+            return
+        self.mascots[mascot] = True
+        self.watch_window(mascot)
+        self.schedule_check(mascot)
+    
+    # マスコットの管理を終了するメソッド
+    def untrack(self, mascot):
+        if self.mascots.pop(mascot, None) is None:
+            return
+        self.unwatch_windows(mascot)
+        self.suspended.pop(mascot, None)
+        self.dirty.pop(mascot, None)
+    
+    # マスコットのネイティブウィンドウの露出イベントを受け取るようにするメソッド
+    def watch_window(self, mascot):
+        window = mascot.windowHandle()
+        if window is None or self.windows.get(window) is mascot:
+            return
+        
+        # ウィンドウフラグの変更でネイティブウィンドウが作り直された場合は古いものを外す
+        self.unwatch_windows(mascot)
+        self.windows[window] = mascot
+        window.installEventFilter(self)
+    
+    # マスコットのネイティブウィンドウの監視をやめるメソッド
+    def unwatch_windows(self, mascot):
+        for window, owner in list(self.windows.items()):
+            if owner is mascot:
+                del self.windows[window]
+                self.exposed.pop(window, None)
+                if not sip.isdeleted(window):
+                    window.removeEventFilter(self)
+    
+    # マスコットが表示・非表示になったときに呼ばれるメソッド
+    # （イベントフィルタでは移動のたびに呼ばれて遅くなるので、マスコットのshowEvent・hideEventから呼ぶ）
+    def mascot_shown(self, mascot, shown):
+        if mascot not in self.mascots:
+            return
+        if shown:
+            self.watch_window(mascot)
+        self.schedule_check(mascot)
+    
+    # ネイティブウィンドウの露出の変化を受け取るメソッド
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Expose:
+            # 移動のたびに届く露出イベントは、見えているかどうかが変わったときだけ確認する
+            mascot = self.windows.get(obj)
+            if mascot is not None:
+                exposed = obj.isExposed()
+                if self.exposed.get(obj) != exposed:
+                    self.exposed[obj] = exposed
+                    self.schedule_check(mascot)
+        return False
+    
+    # 画面が追加されたときに呼ばれるメソッド
+    def on_screen_added(self, screen):
+        screen.geometryChanged.connect(self.on_screens_changed)
+        self.on_screens_changed()
+    
+    # 画面の構成が変わったときに呼ばれるメソッド
+    def on_screens_changed(self, *args):
+        self.screens_dirty = True
+        self.schedule_check_all()
+    
+    # マスコットの確認を予約するメソッド（移動や表示の変化のたびに呼ばれる）
+    def schedule_check(self, mascot):
+        self.dirty[mascot] = True
+        if not self.check_timer.isActive():
+            self.check_timer.start(0)
+    
+    # 全マスコットの確認を予約するメソッド
+    def schedule_check_all(self):
+        for mascot in self.mascots:
+            self.schedule_check(mascot)
+    
+    # 予約されたマスコットをまとめて確認するメソッド
+    def check_pending(self):
+        if self.screens_dirty:
+            self.screens = [screen.geometry() for screen in QApplication.screens()]
+            self.screens_dirty = False
+        
+        dirty = self.dirty
+        self.dirty = {}
+        for mascot in dirty:
+            if mascot in self.mascots:
+                self.update_mascot(mascot)
+    
+    # マスコットが見えているかどうかを返すメソッド
+    def is_visible(self, mascot):
+        if self.user_idle:
+            return False
+        
+        if not mascot.is_animation_visible(self.screens):
+            return False
+        
+        # 全画面アプリに隠れている場合（前面表示なら排他的全画面のときだけ隠れる）
+        if self.fullscreen_rect is not None and (self.fullscreen_exclusive or not self.app.is_topmost):
+            if QRect(*self.fullscreen_rect).contains(mascot.geometry()):
+                return False
+        
+        return True
+    
+    # マスコットのアニメーションを止めるか再開するかを決めるメソッド
+    def update_mascot(self, mascot):
+        visible = self.is_visible(mascot)
+        if visible and mascot in self.suspended:
+            del self.suspended[mascot]
+            mascot.resume_animation()
+        elif not visible and mascot not in self.suspended:
+            self.suspended[mascot] = self.now()
+            mascot.suspend_animation()
+            self.schedule_release()
+    
+    # 一番早くフレームを返却するマスコットに合わせてタイマーを開始するメソッド
+    def schedule_release(self):
+        if self.release_delay <= 0:
+            return
+        times = [since for since in self.suspended.values() if since is not None]
+        if not times:
+            self.release_timer.stop()
+            return
+        self.release_timer.start(max(0, min(times) + self.release_delay - self.now()))
+    
+    # 猶予を過ぎたマスコットのフレームを返却するメソッド
+    def release_expired(self):
+        now = self.now()
+        for mascot, since in list(self.suspended.items()):
+            if since is not None and now - since >= self.release_delay:
+                mascot.release_suspended_frames()
+                self.suspended[mascot] = None
+        self.schedule_release()
+    
+    # 全画面アプリと無操作時間を確認するメソッド
+    def poll_activity(self):
+        try:
+            user_idle = self.activity.idle_time() >= IDLE_SUSPEND_TIME
+            fullscreen_rect, exclusive = self.activity.fullscreen_window()
+        except Exception as e:
+            print(f"デスクトップ状態の取得エラー: {e}")
+            self.poll_timer.stop()
+            return
+        
+        if (user_idle, fullscreen_rect, exclusive) != (self.user_idle, self.fullscreen_rect, self.fullscreen_exclusive):
+            self.user_idle = user_idle
+            self.fullscreen_rect = fullscreen_rect
+            self.fullscreen_exclusive = exclusive
+            self.schedule_check_all()
+
+# 設定ファイルを書き込むタスククラス（ワーカースレッドで実行）
+class ConfigWriteTask(QRunnable):
+    def __init__(self, saver, data):
+        super().__init__()
+        self.saver = saver
+        self.data = data
+    
+    def run(self):
+        self.saver.write_finished.emit(self.saver.write_file(self.data))
+
+# 設定保存クラス（保存要求をまとめて、一定時間操作がなければ一度だけ書き込む）
+class ConfigSaver(QObject):
+    write_finished = pyqtSignal(str)  # ワーカースレッドでの書き込みの結果（空文字列なら成功、それ以外はエラー）
+    save_failed = pyqtSignal(str)  # 保存に失敗し始めたときに一度だけ送る（成功するまでは送らない）
+    
+    def __init__(self, config_file, build_config, delay=CONFIG_SAVE_DELAY, parent=None, metrics=None):
+        super().__init__(parent)
+        self.config_file = config_file
+        self.build_config = build_config  # 保存する設定の辞書を作る関数
+        self.metrics = metrics  # 保存時間を記録するパフォーマンス統計（なくてもよい）
+        self.delay = delay
+        self.dirty = False
+        self.closed = False
+        self.failure_count = 0  # 続けて保存に失敗した回数（再試行の間隔を延ばすのに使う）
+        
+        # 統計情報
+        self.request_count = 0  # 保存要求の回数
+        self.write_count = 0  # 実際に書き込んだ回数
+        self.coalesced_count = 0  # まとめられて省略された書き込みの回数
+        self.pending_requests = 0
+        
+        # 最後の保存要求から一定時間後に書き込むタイマー
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+        
+        # 書き込みは1本のワーカースレッドで順番に行う
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self.write_lock = threading.Lock()
+        self.write_finished.connect(self.on_write_finished)
+    
+    # 保存を要求するメソッド（すぐには書き込まない）
+    def request_save(self):
+        if self.closed:
+            return
+        
+        self.request_count += 1
+        self.pending_requests += 1
+        self.dirty = True
+        self.timer.start(self.delay)
+    
+    # 保存待ちの設定を書き込むメソッド（wait=Trueなら書き込み完了まで待つ）
+    def flush(self, wait=False):
+        self.timer.stop()
+        
+        if self.dirty:
+            self.dirty = False
+            self.coalesced_count += max(0, self.pending_requests - 1)
+            self.pending_requests = 0
+            
+            try:
+                # 設定の内容はGUIスレッドで確定させる
+                start_time = time.perf_counter()
+                data = json.dumps(self.build_config(), ensure_ascii=False, indent=4)
+                if self.metrics is not None:
+                    self.metrics.record_time("config_build", (time.perf_counter() - start_time) * 1000)
+            except Exception as e:
+                self.retry(str(e))
+                return
+            
+            if wait:
+                self.thread_pool.waitForDone()
+                self.on_write_finished(self.write_file(data))
+            else:
+                self.thread_pool.start(ConfigWriteTask(self, data))
+        elif wait:
+            self.thread_pool.waitForDone()
+    
+    # 書き込みが終わったときに呼ばれるメソッド（errorが空文字列なら成功）
+    def on_write_finished(self, error):
+        if error:
+            self.retry(error)
+        elif self.failure_count > 0:
+            print("設定ファイルの保存が回復しました")
+            self.failure_count = 0
+    
+    # 保存に失敗した設定をもう一度書き込むメソッド（失敗が続くほど間隔を延ばし、エラーは最初の一度だけ知らせる）
+    def retry(self, error):
+        self.failure_count += 1
+        if self.failure_count == 1:
+            print(f"設定ファイルの保存エラー: {error}")
+            self.save_failed.emit(error)
+        self.dirty = True
+        if not self.closed:
+            self.timer.start(min(CONFIG_RETRY_MAX_DELAY, self.delay * 2 ** self.failure_count))
+    
+    # 終了時に保存を確定し、以降の保存要求を受け付けないようにするメソッド
+    def close(self):
+        self.flush(wait=True)
+        self.closed = True
+    
+    # 一時ファイルに書いてから置き換えるメソッド（途中で落ちても壊れない、成功したら空文字列、失敗したらエラーを返す）
+    def write_file(self, data):
+        with self.write_lock:
+            directory = os.path.dirname(os.path.abspath(self.config_file))
+            temp_path = None
+            start_time = time.perf_counter()
+            try:
+                # ほかのプロセスが同じ設定ファイルを読み書きしている間は待つ
+                with locked_file(self.config_file):
+                    import tempfile  # 起動を速くするため使うときに読み込む
+                    fd, temp_path = tempfile.mkstemp(prefix=".mascot_config.", suffix=".tmp", dir=directory)
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(temp_path, self.config_file)
+                    temp_path = None
+                self.write_count += 1
+                if self.metrics is not None:
+                    self.metrics.record_time("config_write", (time.perf_counter() - start_time) * 1000)
+                return ""
+            except Exception as e:
+                return str(e) or type(e).__name__
+            finally:
+                if temp_path is not None and os.path.exists(temp_path):
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+
+# 画像レジストリクラス（画像を固定IDで管理し、パスや使用中のマスコットからすぐに引けるようにする）
+class ImageRegistry:
+    def __init__(self):
+        self.images = {}  # ID -> 画像情報（追加順）
+        self.path_index = {}  # パス -> ID
+        self.mascot_index = {}  # ID -> その画像を表示中のマスコット
+        self.version = 0  # 画像の追加・削除・差し替えのたびに増える（メニューの作り直しの判定用）
+    
+    # 新しい画像IDを作るメソッド
+    def new_id(self):
+        image_id = uuid.uuid4().hex[:12]
+        while image_id in self.images:
+            image_id = uuid.uuid4().hex[:12]
+        return image_id
+    
+    # 画像を登録するメソッド（同じパスが登録済みならその画像情報を返す）
+    def add(self, image_info):
+        existing_id = self.path_index.get(image_info["path"])
+        if existing_id is not None:
+            return self.images[existing_id]
+        
+        # IDがない・重複している場合は新しく振る
+        image_id = image_info.get("id")
+        if not image_id or image_id in self.images:
+            image_id = self.new_id()
+            image_info["id"] = image_id
+        
+        self.images[image_id] = image_info
+        self.path_index[image_info["path"]] = image_id
+        self.mascot_index[image_id] = {}
+        self.version += 1
+        
+        # スプライトシートに変換済みの画像は元のパスでも引けるようにする
+        if image_info.get("source_path"):
+            self.path_index.setdefault(image_info["source_path"], image_id)
+        return image_info
+    
+    # 画像を削除するメソッド（削除した画像情報と、それを表示中のマスコットを返す）
+    def remove(self, image_id):
+        image_info = self.images.pop(image_id, None)
+        if image_info is None:
+            return None, []
+        
+        for path in (image_info["path"], image_info.get("source_path")):
+            if path is not None and self.path_index.get(path) == image_id:
+                del self.path_index[path]
+        mascots = list(self.mascot_index.pop(image_id, {}))
+        self.version += 1
+        return image_info, mascots
+    
+    # 画像のファイルを差し替えるメソッド（元のパスでも引けるように残す）
+    def set_path(self, image_id, path):
+        image_info = self.images.get(image_id)
+        if image_info is None:
+            return
+        image_info.setdefault("source_path", image_info["path"])
+        image_info["path"] = path
+        self.path_index[path] = image_id
+        self.version += 1
+    
+    # IDから画像情報を返すメソッド
+    def get(self, image_id):
+        return self.images.get(image_id)
+    
+    # パスから画像情報を返すメソッド
+    def find_by_path(self, path):
+        image_id = self.path_index.get(path)
+        return self.images.get(image_id) if image_id is not None else None
+    
+    # 画像が登録されているかどうかを返すメソッド
+    def contains(self, image_info):
+        return image_info is not None and self.images.get(image_info.get("id")) is image_info
+    
+    # マスコットが画像を表示し始めたことを記録するメソッド
+    def attach(self, mascot, image_info):
+        if self.contains(image_info):
+            self.mascot_index[image_info["id"]][mascot] = True
+    
+    # マスコットが画像を表示しなくなったことを記録するメソッド
+    def detach(self, mascot, image_info):
+        if self.contains(image_info):
+            self.mascot_index[image_info["id"]].pop(mascot, None)
+    
+    # 画像を表示中のマスコットを返すメソッド
+    def mascots_for(self, image_id):
+        return list(self.mascot_index.get(image_id, {}))
+    
+    # 登録されている画像のリストを返すメソッド
+    def to_list(self):
+        return list(self.images.values())
+    
+    def __iter__(self):
+        return iter(list(self.images.values()))
+    
+    def __len__(self):
+        return len(self.images)
+
+# 開いたときに中身を作るサブメニュークラス
+class LazyMenu:
+    def __init__(self, title, empty_text, fill, count, parent):
+        self.menu = QMenu(title, parent)
+        self.fill = fill  # 中身を作る関数
+        self.count = count  # 項目数を返す関数
+        self.built = False
+        
+        # 項目がないときの表示
+        self.empty_action = QAction(empty_text, self.menu)
+        self.empty_action.setEnabled(False)
+        self.menu.addAction(self.empty_action)
+        
+        self.menu.aboutToShow.connect(self.ensure_built)
+    
+    # 中身がまだなければ作るメソッド
+    def ensure_built(self):
+        if not self.built:
+            self.built = True
+            self.fill()
+        self.update_empty()
+    
+    # 「項目がありません」の表示を切り替えるメソッド
+    def update_empty(self):
+        self.empty_action.setVisible(self.count() == 0)
+    
+    # 中身を捨てて、次に開いたときに作り直すようにするメソッド
+    def reset(self):
+        for action in self.menu.actions():
+            if action is not self.empty_action:
+                self.menu.removeAction(action)
+                if action.menu() is not None:
+                    action.menu().deleteLater()
+                action.deleteLater()
+        self.built = False
+
+# 画像を調べるタスククラス（ワーカースレッドで形式・サイズ・フレーム数・ハッシュを調べる）
+class ImageProbeTask(QRunnable):
+    def __init__(self, importer, path, order=0, hash_only=False, image_id=None):
+        super().__init__()
+        self.importer = importer
+        self.path = path
+        self.order = order  # 選択された順番（結果を同じ順番で並べるため）
+        self.hash_only = hash_only  # 登録済みの画像のハッシュだけを求める場合
+        self.image_id = image_id
+    
+    def run(self):
+        result = {
+            "path": self.path,
+            "order": self.order,
+            "hash_only": self.hash_only,
+            "image_id": self.image_id,
+            "ok": False,
+            "error": ""
+        }
+        
+        try:
+            if self.importer.cancelled:
+                result["error"] = "取り消されました"
+            elif not self.hash_only and not is_image_file(self.path):
+                result["error"] = "追加できる画像の形式ではありません"
+            else:
+                result["sha1"] = file_sha1(self.path)
+                
+                if self.hash_only:
+                    result["ok"] = True
+                elif is_sprite_sheet(self.path):
+                    # スプライトシートはフレーム表と画像を読み込んで確かめる（読めなければ例外になる）
+                    _, rects, _, _, _, _ = load_sprite_sheet(self.path)
+                    result.update({
+                        "ok": True,
+                        "format": "sheet",
+                        "width": rects[0].width(),
+                        "height": rects[0].height(),
+                        "frame_count": len(rects)
+                    })
+                else:
+                    # 最初のフレームを実際にデコードして読めるかどうかを確かめる
+                    reader = QImageReader(self.path)
+                    image_format = bytes(reader.format()).decode('ascii', 'replace').lower()
+                    frame_count = reader.imageCount()
+                    image = reader.read()
+                    if image.isNull():
+                        result["error"] = reader.errorString()
+                    else:
+                        result.update({
+                            "ok": True,
+                            "format": image_format,
+                            "width": image.width(),
+                            "height": image.height(),
+                            "frame_count": max(1, frame_count)
+                        })
+        except Exception as e:
+            result["error"] = str(e)
+        
+        self.importer.probe_finished.emit(result)
+
+# 画像の一括追加クラス（並列に調べて、重複を除いてからまとめて登録する）
+class ImageImporter(QObject):
+    # ワーカースレッドから調べた結果を受け取るシグナル
+    probe_finished = pyqtSignal(object)
+    
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.results = []
+        self.already_registered = []  # 同じパスで登録済みだった画像
+        self.pending = 0
+        self.total = 0
+        self.cancelled = False
+        self.progress = None
+        
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max(1, QThread.idealThreadCount()))
+        
+        self.probe_finished.connect(self.on_probe_finished)
+    
+    # 一括追加の途中かどうかを返すメソッド
+    def is_running(self):
+        return self.pending > 0
+    
+    # 一括追加を開始するメソッド
+    def start(self, paths):
+        if self.is_running():
+            return False
+        
+        self.results = []
+        self.already_registered = []
+        self.cancelled = False
+        
+        # 同じパスは一度だけ調べる
+        tasks = []
+        seen = set()
+        for path in paths:
+            norm_path = os.path.normcase(os.path.abspath(path))
+            if norm_path in seen:
+                continue
+            seen.add(norm_path)
+            
+            existing = self.app.image_registry.find_by_path(path)
+            if existing is not None:
+                self.already_registered.append((os.path.basename(path), existing["name"]))
+            else:
+                tasks.append(ImageProbeTask(self, path, len(tasks)))
+        
+        # ハッシュのない登録済みの画像も重複の確認のためにハッシュを求める
+        for image_info in self.app.image_registry:
+            if "sha1" not in image_info and os.path.exists(image_info["path"]):
+                tasks.append(ImageProbeTask(self, image_info["path"], hash_only=True, image_id=image_info["id"]))
+        
+        self.pending = len(tasks)
+        self.total = len(tasks)
+        if not tasks:
+            self.finish()
+            return True
+        
+        # 時間がかかるときだけ進み具合を表示する
+        self.progress = QProgressDialog("画像を確認しています...", "キャンセル", 0, self.total)
+        self.progress.setWindowTitle("画像の一括追加")
+        self.progress.setMinimumDuration(500)
+        self.progress.setAutoClose(False)
+        self.progress.setAutoReset(False)
+        self.progress.canceled.connect(self.cancel)
+        self.progress.setValue(0)
+        
+        for task in tasks:
+            self.thread_pool.start(task)
+        return True
+    
+    # 一括追加を取り消すメソッド（調べ終わっていないファイルは飛ばす）
+    def cancel(self):
+        self.cancelled = True
+    
+    # 1つのファイルを調べ終わったときに呼ばれるメソッド（GUIスレッドで実行）
+    def on_probe_finished(self, result):
+        self.pending -= 1
+        
+        if result["hash_only"]:
+            image_info = self.app.image_registry.get(result["image_id"])
+            if result["ok"] and image_info is not None:
+                image_info["sha1"] = result["sha1"]
+        else:
+            self.results.append(result)
+        
+        if self.progress is not None:
+            self.progress.setValue(self.total - self.pending)
+        
+        if self.pending == 0:
+            self.finish()
+    
+    # 全ファイルを調べ終わったら重複を除いて登録するメソッド
+    def finish(self):
+        if self.progress is not None:
+            # 閉じるときにもcanceledが送られるので先に切り離す
+            self.progress.canceled.disconnect(self.cancel)
+            self.progress.close()
+            self.progress.deleteLater()
+            self.progress = None
+        
+        if self.cancelled:
+            self.results = []
+            return
+        
+        # 登録済みの画像と、今回追加した画像のハッシュ
+        known = {}
+        for image_info in self.app.image_registry:
+            if image_info.get("sha1"):
+                known.setdefault(image_info["sha1"], image_info)
+        
+        added = []
+        duplicates = list(self.already_registered)
+        failed = []
+        for result in sorted(self.results, key=lambda r: r["order"]):
+            file_name = os.path.basename(result["path"])
+            if not result["ok"]:
+                failed.append((file_name, result["error"] or "読み込めない形式です"))
+                continue
+            
+            existing = known.get(result["sha1"])
+            if existing is not None:
+                duplicates.append((file_name, existing["name"]))
+                continue
+            
+            # 名前はファイル名から自動で付ける
+            image_info = self.app.image_registry.add({
+                "path": result["path"],
+                "name": file_name,
+                "is_gif": is_animated_image(result["path"]) or result["format"] == "gif",
+                "sha1": result["sha1"]
+            })
+            known[result["sha1"]] = image_info
+            added.append(image_info)
+        
+        self.results = []
+        self.already_registered = []
+        self.app.images_imported(added, duplicates, failed)
+
+# GIFをスプライトシートに変換するタスククラス（ワーカースレッドで実行）
+class SpriteSheetConvertTask(QRunnable):
+    def __init__(self, converter, image_id, path):
+        super().__init__()
+        self.converter = converter
+        self.image_id = image_id
+        self.path = path
+    
+    def run(self):
+        try:
+            json_path = convert_gif_to_sprite_sheet(self.path, self.converter.output_dir)
+            self.converter.converted.emit(self.image_id, json_path, "")
+        except Exception as e:
+            self.converter.converted.emit(self.image_id, "", str(e))
+
+# スプライトシート変換クラス（登録済みのGIFをまとめて変換する）
+class SpriteSheetConverter(QObject):
+    # ワーカースレッドから変換結果を受け取るシグナル（画像ID, フレーム表のパス, エラー）
+    converted = pyqtSignal(str, str, str)
+    
+    def __init__(self, app, output_dir):
+        super().__init__(app)
+        self.app = app
+        self.output_dir = output_dir
+        self.pending = 0
+        self.results = []
+        
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max(1, QThread.idealThreadCount() - 1))
+        
+        self.converted.connect(self.on_converted)
+    
+    # 変換の途中かどうかを返すメソッド
+    def is_running(self):
+        return self.pending > 0
+    
+    # 変換を開始するメソッド
+    def start(self, image_infos):
+        if self.is_running() or not image_infos:
+            return False
+        self.results = []
+        self.pending = len(image_infos)
+        for image_info in image_infos:
+            self.thread_pool.start(SpriteSheetConvertTask(self, image_info["id"], image_info["path"]))
+        return True
+    
+    # 1つの画像の変換が終わったときに呼ばれるメソッド（GUIスレッドで実行）
+    def on_converted(self, image_id, json_path, error):
+        self.pending -= 1
+        self.results.append((image_id, json_path, error))
+        if self.pending == 0:
+            results = self.results
+            self.results = []
+            self.app.sprite_sheets_converted(results)
+
+# トレイメニュークラス（変更があった項目だけを追加・削除・更新する）
+class TrayMenuModel(QObject):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.menu = QMenu()
+        
+        # 項目ごとのアクション（一度開かれたサブメニューだけ中身を持つ）
+        self.display_actions = {}  # 画像ID -> 「マスコットを表示」の項目
+        self.image_actions = {}  # 画像ID -> 「画像管理」の項目
+        self.mascot_actions = {}  # マスコット -> 「表示中のマスコット」の項目
+        self.mascot_serial = 0  # マスコットの通し番号（削除しても番号は振り直さない）
+        
+        # 起動直後は終了だけの最小限のメニューにして、残りはbuildで作る
+        self.built = False
+        starting_action = QAction("起動中...", self.menu)
+        starting_action.setEnabled(False)
+        self.menu.addAction(starting_action)
+        exit_action = QAction("終了", self.menu)
+        exit_action.triggered.connect(self.app.on_exit)
+        self.menu.addAction(exit_action)
+    
+    # メニューの固定部分を作るメソッド（一度だけ、起動の途中で呼ばれる）
+    def build(self):
+        if self.built:
+            return
+        self.menu.clear()
+        self.built = True
+        
+        # 「画像を追加」メニュー項目
+        add_images_action = QAction("画像を追加", self.menu)
+        add_images_action.triggered.connect(self.app.add_images)
+        self.menu.addAction(add_images_action)
+        
+        # 「フォルダから画像を追加」メニュー項目（フォルダ内の画像をまとめて追加）
+        add_folder_action = QAction("フォルダから画像を追加", self.menu)
+        add_folder_action.triggered.connect(self.app.add_image_folder)
+        self.menu.addAction(add_folder_action)
+        
+        # 「GIFをスプライトシートに変換」メニュー項目（重いアニメーションを軽くする）
+        convert_action = QAction("GIFをスプライトシートに変換", self.menu)
+        convert_action.triggered.connect(self.app.convert_gifs_to_sprite_sheets)
+        self.menu.addAction(convert_action)
+        
+        self.menu.addSeparator()  # 区切り線
+        
+        # 「マスコットを表示」サブメニュー（開いたときに中身を作る）
+        self.display_menu = self.create_lazy_menu("マスコットを表示", "画像がありません", self.fill_display_menu,
+                                                  lambda: len(self.display_actions))
+        
+        # 「表示中のマスコット」サブメニュー
+        self.active_mascots_menu = self.create_lazy_menu("表示中のマスコット", "表示中のマスコットがありません", self.fill_active_mascots_menu,
+                                                        lambda: len(self.mascot_actions))
+        
+        # 「画像管理」サブメニュー
+        self.images_menu = self.create_lazy_menu("画像管理", "画像がありません", self.fill_images_menu,
+                                                 lambda: len(self.image_actions))
+        
+        self.menu.addSeparator()  # 区切り線
+        
+        # 「シーン」サブメニュー（名前を付けて保存した配置を切り替える）
+        self.scenes_menu = self.create_lazy_menu("シーン", "シーンがありません", self.fill_scenes_menu,
+                                                 lambda: len(self.app.scenes))
+        
+        # 「今の配置をシーンとして保存」メニュー項目
+        save_scene_action = QAction("今の配置をシーンとして保存...", self.menu)
+        save_scene_action.triggered.connect(self.app.ask_save_scene)
+        self.menu.addAction(save_scene_action)
+        
+        self.menu.addSeparator()  # 区切り線
+        
+        # 「すべてのマスコットを削除」メニュー項目
+        self.remove_all_action = QAction("すべてのマスコットを削除", self.menu)
+        self.remove_all_action.triggered.connect(self.app.remove_all_mascots)
+        self.menu.addAction(self.remove_all_action)
+        
+        self.menu.addSeparator()  # 区切り線
+        
+        # 「常に前面に表示」メニュー項目（チェックボックス付き）
+        self.topmost_action = QAction("常に前面に表示", self.menu)
+        self.topmost_action.setCheckable(True)  # チェックボックスにする
+        self.topmost_action.triggered.connect(self.app.toggle_topmost)
+        self.menu.addAction(self.topmost_action)
+        
+        # 「オーバーレイ表示」メニュー項目（多数のマスコットをまとめて描画）
+        self.overlay_action = QAction("オーバーレイ表示（軽量モード）", self.menu)
+        self.overlay_action.setCheckable(True)
+        self.overlay_action.triggered.connect(self.app.toggle_render_mode)
+        self.menu.addAction(self.overlay_action)
+        
+        # 「画面の端に吸着」「ほかのマスコットに吸着」メニュー項目
+        self.snap_edges_action = QAction("画面の端に吸着", self.menu)
+        self.snap_edges_action.setCheckable(True)
+        self.snap_edges_action.triggered.connect(self.app.toggle_snap_to_edges)
+        self.menu.addAction(self.snap_edges_action)
+        
+        self.snap_mascots_action = QAction("ほかのマスコットに吸着", self.menu)
+        self.snap_mascots_action.setCheckable(True)
+        self.snap_mascots_action.triggered.connect(self.app.toggle_snap_to_mascots)
+        self.menu.addAction(self.snap_mascots_action)
+        
+        # 「自動で歩く・落ちる」メニュー項目（NumPyがなければ使えない）
+        self.behavior_action = QAction("自動で歩く・落ちる", self.menu)
+        self.behavior_action.setCheckable(True)
+        self.behavior_action.triggered.connect(self.app.toggle_behavior)
+        if not BehaviorEngine.available():
+            self.behavior_action.setText("自動で歩く・落ちる（NumPyが必要です）")
+            self.behavior_action.setEnabled(False)
+        self.menu.addAction(self.behavior_action)
+        
+        # 「透明な部分はクリックを通す」メニュー項目
+        self.click_through_action = QAction("透明な部分はクリックを通す", self.menu)
+        self.click_through_action.setCheckable(True)
+        self.click_through_action.triggered.connect(self.app.toggle_click_through)
+        self.menu.addAction(self.click_through_action)
+        
+        self.menu.addSeparator()  # 区切り線
+        
+        # 「パフォーマンス表示」「統計を書き出す」メニュー項目
+        self.perf_hud_action = QAction("パフォーマンス表示", self.menu)
+        self.perf_hud_action.setCheckable(True)
+        self.perf_hud_action.triggered.connect(self.app.toggle_perf_hud)
+        self.menu.addAction(self.perf_hud_action)
+        
+        export_metrics_action = QAction("統計を書き出す", self.menu)
+        export_metrics_action.triggered.connect(self.app.export_metrics)
+        self.menu.addAction(export_metrics_action)
+        
+        self.menu.addSeparator()  # 区切り線
+        
+        # 「終了」メニュー項目
+        exit_action = QAction("終了", self.menu)
+        exit_action.triggered.connect(self.app.on_exit)
+        self.menu.addAction(exit_action)
+        
+        self.refresh_state()
+    
+    # 開いたときに中身を作るサブメニューを作るメソッド
+    def create_lazy_menu(self, title, empty_text, fill, count):
+        submenu = LazyMenu(title, empty_text, lambda: self.measured(fill), count, self.menu)
+        self.menu.addMenu(submenu.menu)
+        return submenu
+    
+    # 項目ごとのサブメニューを作るメソッド（中身は開いたときに作る）
+    def create_item_submenu(self, parent_menu, fill):
+        item_menu = QMenu(parent_menu.menu)
+        state = {"built": False}
+        
+        def ensure_built():
+            if not state["built"]:
+                state["built"] = True
+                self.measured(fill, item_menu)
+        
+        item_menu.aboutToShow.connect(ensure_built)
+        return item_menu
+    
+    # メニューを作る処理の時間をパフォーマンス統計に記録するメソッド
+    def measured(self, fill, *args):
+        with self.app.perf_metrics.measure("tray_menu"):
+            fill(*args)
+    
+    # アクションとそのサブメニューを削除するメソッド
+    def delete_action(self, submenu, action):
+        submenu.menu.removeAction(action)
+        if action.menu() is not None:
+            action.menu().deleteLater()
+        action.deleteLater()
+        submenu.update_empty()
+    
+    # 「マスコットを表示」の中身を作るメソッド
+    def fill_display_menu(self):
+        for image_info in self.app.image_registry:
+            self.add_display_action(image_info)
+    
+    # 「表示中のマスコット」の中身を作るメソッド
+    def fill_active_mascots_menu(self):
+        for mascot in self.app.mascot_widgets:
+            self.add_mascot_action(mascot)
+    
+    # 「画像管理」の中身を作るメソッド
+    def fill_images_menu(self):
+        for image_info in self.app.image_registry:
+            self.add_image_action(image_info)
+    
+    # 「シーン」の中身を作るメソッド
+    def fill_scenes_menu(self):
+        for name, layout in self.app.scenes.items():
+            label = f"{name}（{len(layout)}体）"
+            if name == self.app.current_scene:
+                label += " ← 表示中"
+            scene_action = QAction(label, self.scenes_menu.menu)
+            
+            # 切り替え・上書き保存・削除のサブメニュー
+            def fill(item_menu, name=name):
+                switch_action = QAction("切り替え", item_menu)
+                switch_action.triggered.connect(lambda checked=False: self.app.switch_scene(name))
+                item_menu.addAction(switch_action)
+                
+                overwrite_action = QAction("今の配置で上書き", item_menu)
+                overwrite_action.triggered.connect(lambda checked=False: self.app.save_scene(name))
+                item_menu.addAction(overwrite_action)
+                
+                remove_action = QAction("削除", item_menu)
+                remove_action.triggered.connect(lambda checked=False: self.app.delete_scene(name))
+                item_menu.addAction(remove_action)
+            
+            scene_action.setMenu(self.create_item_submenu(self.scenes_menu, fill))
+            self.scenes_menu.menu.addAction(scene_action)
+    
+    # 「マスコットを表示」に画像を追加するメソッド
+    def add_display_action(self, image_info):
+        image_action = QAction(image_info["name"], self.display_menu.menu)
+        
+        # ラムダ式を使って各アクションに対応する画像情報を保持
+        info_copy = image_info  # ローカル変数にコピー
+        image_action.triggered.connect(lambda checked=False, info=info_copy: self.app.create_mascot(info))
+        
+        self.display_menu.menu.addAction(image_action)
+        self.display_actions[image_info["id"]] = image_action
+    
+    # 「画像管理」に画像を追加するメソッド
+    def add_image_action(self, image_info):
+        image_action = QAction(image_info["name"], self.images_menu.menu)
+        image_id = image_info["id"]  # ローカル変数にコピー
+        
+        # 画像を削除するサブメニュー
+        def fill(item_menu, image_id=image_id):
+            remove_action = QAction("削除", item_menu)
+            remove_action.triggered.connect(lambda checked=False: self.app.remove_image(image_id))
+            item_menu.addAction(remove_action)
+        
+        image_action.setMenu(self.create_item_submenu(self.images_menu, fill))
+        self.images_menu.menu.addAction(image_action)
+        self.image_actions[image_id] = image_action
+    
+    # 「表示中のマスコット」にマスコットを追加するメソッド
+    def add_mascot_action(self, mascot):
+        mascot_action = QAction(self.mascot_label(mascot), self.active_mascots_menu.menu)
+        target_mascot = mascot  # ローカル変数にコピー
+        
+        # マスコットに移動・削除するサブメニュー
+        def fill(item_menu, m=target_mascot):
+            goto_action = QAction("移動", item_menu)
+            goto_action.triggered.connect(lambda checked=False: m.activateWindow())
+            item_menu.addAction(goto_action)
+            
+            remove_action = QAction("削除", item_menu)
+            remove_action.triggered.connect(lambda checked=False: self.app.remove_mascot(m))
+            item_menu.addAction(remove_action)
+        
+        mascot_action.setMenu(self.create_item_submenu(self.active_mascots_menu, fill))
+        self.active_mascots_menu.menu.addAction(mascot_action)
+        self.mascot_actions[mascot] = mascot_action
+    
+    # マスコットの表示名を返すメソッド
+    def mascot_label(self, mascot):
+        if getattr(mascot, "menu_serial", None) is None:
+            self.mascot_serial += 1
+            mascot.menu_serial = self.mascot_serial
+        name = mascot.image_info["name"] if mascot.image_info else "無名マスコット"
+        return f"{mascot.menu_serial}: {name}"
+    
+    # 画像が追加されたときに呼ぶメソッド
+    def image_added(self, image_info):
+        if not self.built:
+            return
+        if self.display_menu.built and image_info["id"] not in self.display_actions:
+            self.add_display_action(image_info)
+            self.display_menu.update_empty()
+        if self.images_menu.built and image_info["id"] not in self.image_actions:
+            self.add_image_action(image_info)
+            self.images_menu.update_empty()
+    
+    # 画像がまとめて追加されたときに呼ぶメソッド
+    def images_added(self, image_infos):
+        if not self.built:
+            return
+        for image_info in image_infos:
+            if self.display_menu.built and image_info["id"] not in self.display_actions:
+                self.add_display_action(image_info)
+            if self.images_menu.built and image_info["id"] not in self.image_actions:
+                self.add_image_action(image_info)
+        self.display_menu.update_empty()
+        self.images_menu.update_empty()
+    
+    # 画像が削除されたときに呼ぶメソッド
+    def image_removed(self, image_id):
+        if not self.built:
+            return
+        action = self.display_actions.pop(image_id, None)
+        if action is not None:
+            self.delete_action(self.display_menu, action)
+        action = self.image_actions.pop(image_id, None)
+        if action is not None:
+            self.delete_action(self.images_menu, action)
+    
+    # シーンが保存・切り替え・削除されたときに呼ぶメソッド（次に開いたときに作り直す）
+    def scenes_changed(self):
+        if not self.built:
+            return
+        if self.scenes_menu.built:
+            self.scenes_menu.reset()
+    
+    # マスコットが追加されたときに呼ぶメソッド
+    def mascot_added(self, mascot):
+        if not self.built:
+            return
+        if self.active_mascots_menu.built and mascot not in self.mascot_actions:
+            self.add_mascot_action(mascot)
+            self.active_mascots_menu.update_empty()
+        self.app.update_tray_menu()  # まとめて操作している間は最後に一度だけ
+    
+    # マスコットが削除されたときに呼ぶメソッド
+    def mascot_removed(self, mascot):
+        if not self.built:
+            return
+        action = self.mascot_actions.pop(mascot, None)
+        if action is not None:
+            self.delete_action(self.active_mascots_menu, action)
+        self.app.update_tray_menu()  # まとめて操作している間は最後に一度だけ
+    
+    # マスコットの画像が変わったときに呼ぶメソッド
+    def mascot_changed(self, mascot):
+        if not self.built:
+            return
+        action = self.mascot_actions.get(mascot)
+        if action is not None:
+            action.setText(self.mascot_label(mascot))
+    
+    # 全体の状態（削除の可否・前面表示のチェック）を更新するメソッド
+    def refresh_state(self):
+        if not self.built:
+            return
+        with self.app.perf_metrics.measure("tray_menu"):
+            self.remove_all_action.setEnabled(len(self.app.mascot_widgets) > 0)
+            self.topmost_action.setChecked(self.app.is_topmost)
+            self.overlay_action.setChecked(self.app.render_mode == "overlay")
+            self.snap_edges_action.setChecked(self.app.snap_to_edges)
+            self.snap_mascots_action.setChecked(self.app.snap_to_mascots)
+            self.behavior_action.setChecked(self.app.behavior_enabled)
+            self.click_through_action.setChecked(self.app.click_through)
+            self.perf_hud_action.setChecked(self.app.perf_metrics.hud_visible())
+
+# サムネイルを読み込むタスククラス（ワーカースレッドで実行）
+class ThumbnailTask(QRunnable):
+    def __init__(self, cache, key, path):
+        super().__init__()
+        self.cache = cache
+        self.key = key
+        self.path = path
+    
+    def run(self):
+        try:
+            image = load_thumbnail(self.path, THUMBNAIL_SIZE)
+        except Exception as e:
+            print(f"サムネイル読み込みエラー: {e}")
+            image = QImage()
+        self.cache.thumbnail_loaded.emit(self.key, image)
+
+# サムネイルのキャッシュクラス（最近使ったものだけを決まった数まで覚えておく）
+class ThumbnailCache(QObject):
+    # ワーカースレッドから読み込んだサムネイルを受け取るシグナル
+    thumbnail_loaded = pyqtSignal(object, object)
+    # サムネイルが使えるようになったことを知らせるシグナル（パス, QIcon）
+    thumbnail_ready = pyqtSignal(str, object)
+    
+    def __init__(self, parent=None, capacity=THUMBNAIL_CACHE_SIZE):
+        super().__init__(parent)
+        self.capacity = capacity
+        self.icons = OrderedDict()  # (パス, 更新時刻) -> QIcon（古い順）
+        self.pending = set()  # 読み込み中のキー
+        
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(2)
+        
+        self.thumbnail_loaded.connect(self.on_thumbnail_loaded)
+    
+    # キャッシュのキーを返すメソッド（ファイルが変わったら別のキーになる）
+    def cache_key(self, path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        return (path, mtime)
+    
+    # サムネイルを返すメソッド（まだなければ読み込みを始めてNoneを返す）
+    def icon(self, path):
+        key = self.cache_key(path)
+        icon = self.icons.get(key)
+        if icon is not None:
+            self.icons.move_to_end(key)
+            return icon
+        
+        if key not in self.pending:
+            self.pending.add(key)
+            self.thread_pool.start(ThumbnailTask(self, key, path))
+        return None
+    
+    # サムネイルを読み込み終わったときに呼ばれるメソッド（GUIスレッドで実行）
+    def on_thumbnail_loaded(self, key, image):
+        self.pending.discard(key)
+        
+        # 読み込めなかった画像も空のアイコンで覚えておき、何度も読み込まないようにする
+        icon = QIcon(QPixmap.fromImage(image)) if not image.isNull() else QIcon()
+        self.icons[key] = icon
+        self.icons.move_to_end(key)
+        while len(self.icons) > self.capacity:
+            self.icons.popitem(last=False)
+        
+        self.thumbnail_ready.emit(key[0], icon)
+
+# マスコットの右クリックメニュークラス（全マスコットで1つのメニューを使い回す）
+class MascotContextMenu(QObject):
+    def __init__(self, app, thumbnails):
+        super().__init__(app)
+        self.app = app
+        self.thumbnails = thumbnails
+        self.menu = QMenu()
+        self.mascot = None  # メニューを開いているマスコット
+        
+        # 「画像を変更」の項目（開いたときに作り、画像が変わるまで使い回す）
+        self.image_actions = {}  # 画像ID -> 項目
+        self.path_actions = {}  # パス -> 項目（サムネイルを設定するため）
+        self.checked_image_action = None
+        self.built_version = -1
+        
+        self.scale_actions = {}  # 倍率 -> 項目
+        self.max_size_actions = {}  # 最大サイズ -> 項目
+        
+        self.build()
+        self.thumbnails.thumbnail_ready.connect(self.on_thumbnail_ready)
+    
+    # メニューを作るメソッド（一度だけ）
+    def build(self):
+        # 画像を切り替えるサブメニュー
+        self.image_menu = LazyMenu("画像を変更", "画像がありません", self.fill_image_menu,
+                                   lambda: len(self.image_actions), self.menu)
+        self.menu.addMenu(self.image_menu.menu)
+        
+        # 表示サイズを変えるサブメニュー
+        size_menu = QMenu("サイズ", self.menu)
+        for scale in SCALE_CHOICES:
+            scale_action = QAction(f"{int(scale * 100)}%", size_menu)
+            scale_action.setCheckable(True)
+            scale_action.triggered.connect(lambda checked=False, s=scale: self.set_scale(scale=s))
+            size_menu.addAction(scale_action)
+            self.scale_actions[scale] = scale_action
+        
+        size_menu.addSeparator()  # 区切り線
+        
+        for max_size in MAX_SIZE_CHOICES:
+            max_size_action = QAction(f"最大 {max_size}px" if max_size else "最大サイズなし", size_menu)
+            max_size_action.setCheckable(True)
+            max_size_action.triggered.connect(lambda checked=False, s=max_size: self.set_scale(max_size=s))
+            size_menu.addAction(max_size_action)
+            self.max_size_actions[max_size] = max_size_action
+        
+        self.menu.addMenu(size_menu)
+        
+        # 「このマスコットを削除」メニュー項目
+        remove_action = QAction("このマスコットを削除", self.menu)
+        remove_action.triggered.connect(self.remove_mascot)
+        self.menu.addAction(remove_action)
+    
+    # 「画像を変更」の中身を作るメソッド
+    def fill_image_menu(self):
+        with self.app.perf_metrics.measure("context_menu"):
+            self.built_version = self.app.image_registry.version
+            for image_info in self.app.image_registry:
+                image_action = QAction(image_info["name"], self.image_menu.menu)
+                image_action.setCheckable(True)
+                
+                # サムネイルはキャッシュにあればすぐ、なければ読み込み終わってから設定する
+                icon = self.thumbnails.icon(image_info["path"])
+                if icon is not None:
+                    image_action.setIcon(icon)
+                
+                info_copy = image_info  # ローカル変数にコピー
+                image_action.triggered.connect(lambda checked=False, info=info_copy: self.set_image(info))
+                self.image_menu.menu.addAction(image_action)
+                self.image_actions[image_info["id"]] = image_action
+                self.path_actions[image_info["path"]] = image_action
+            
+            self.checked_image_action = None
+            self.update_checks()
+    
+    # メニューを表示するメソッド
+    def show(self, mascot, global_position):
+        with self.app.perf_metrics.measure("context_menu"):
+            self.mascot = mascot
+            
+            # 画像が追加・削除されていれば、次に開いたときに作り直す
+            if self.image_menu.built and self.built_version != self.app.image_registry.version:
+                self.image_menu.reset()
+                self.image_actions.clear()
+                self.path_actions.clear()
+                self.checked_image_action = None
+            
+            self.update_checks()
+        
+        try:
+            self.menu.exec_(global_position)
+        finally:
+            self.mascot = None
+    
+    # 開いているマスコットに合わせてチェックを付けるメソッド
+    def update_checks(self):
+        mascot = self.mascot
+        if mascot is None:
+            return
+        
+        if self.checked_image_action is not None:
+            self.checked_image_action.setChecked(False)
+        image_id = mascot.image_info["id"] if mascot.image_info else None
+        self.checked_image_action = self.image_actions.get(image_id)
+        if self.checked_image_action is not None:
+            self.checked_image_action.setChecked(True)
+        
+        for scale, action in self.scale_actions.items():
+            action.setChecked(mascot.scale == scale)
+        for max_size, action in self.max_size_actions.items():
+            action.setChecked(mascot.max_size == max_size)
+    
+    # サムネイルが読み込まれたときに呼ばれるメソッド
+    def on_thumbnail_ready(self, path, icon):
+        action = self.path_actions.get(path)
+        if action is not None:
+            action.setIcon(icon)
+    
+    # 画像を切り替えるメソッド
+    def set_image(self, image_info):
+        if self.mascot is not None:
+            self.app.set_mascot_image(self.mascot, image_info)
+    
+    # 表示サイズを変えるメソッド
+    def set_scale(self, scale=None, max_size=None):
+        if self.mascot is not None:
+            self.app.set_mascot_scale(self.mascot, scale=scale, max_size=max_size)
+    
+    # マスコットを削除するメソッド
+    def remove_mascot(self):
+        if self.mascot is not None:
+            self.app.remove_mascot(self.mascot)
+
+# オーバーレイウィンドウクラス（1つの画面上の全マスコットをまとめて描画する透明ウィンドウ）
+class OverlayWindow(QWidget):
+    def __init__(self, compositor, screen):
+        super().__init__()
+        self.compositor = compositor
+        self.screen_ref = screen
+        self.grab_target = None  # ボタンを押している間イベントを送るマスコット
+        self.mask_region = QRegion()  # 今のマウスを受け付ける範囲（ウィンドウ座標）
+        
+        # ウィンドウの設定（マスコットのない場所はクリックが下に通り抜ける）
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setAttribute(Qt.WA_ShowWithoutActivating)
+        self.set_topmost(compositor.app.is_topmost)
+        self.setGeometry(screen.geometry())
+        screen.geometryChanged.connect(self.on_screen_geometry_changed)
+    
+    # 前面表示を設定するメソッド
+    def set_topmost(self, topmost):
+        flags = Qt.FramelessWindowHint | Qt.Tool | Qt.WindowDoesNotAcceptFocus
+        if topmost:
+            flags |= Qt.WindowStaysOnTopHint
+        was_visible = self.isVisible()
+        self.setWindowFlags(flags)
+        if was_visible:
+            self.show()
+    
+    # 画面のサイズが変わったときに呼ばれるメソッド
+    def on_screen_geometry_changed(self, geometry):
+        self.setGeometry(geometry)
+        self.update_mask()
+    
+    # 範囲（画面座標）に重なっているマスコットを表示順に返すメソッド（空間インデックスで探す）
+    def mascots_in(self, rect):
+        return self.compositor.mascots_in(rect)
+    
+    # 範囲（画面座標）の中でマウスを受け付ける範囲を返すメソッド（ウィンドウ座標）
+    # （透明な部分を通り抜ける設定では、各マスコットの今のフレームの不透明な部分だけ）
+    def mask_in(self, rect):
+        origin = self.pos()
+        click_through = self.compositor.app.click_through
+        region = QRegion()
+        for mascot in self.mascots_in(rect):
+            if click_through and mascot.hit_mask is not None:
+                region = region.united(mascot.hit_mask.input_region().translated(mascot.pos() - origin))
+            else:
+                region = region.united(QRegion(mascot.geometry().translated(-origin)))
+        return region.intersected(rect.translated(-origin))
+    
+    # マウスを受け付ける範囲をマスコットのある場所だけにするメソッド
+    # rectsを指定するとその範囲（画面座標）だけを作り直し、Noneなら全体を作り直す
+    def update_mask(self, rects=None):
+        geometry = self.geometry()
+        if rects is None:
+            self.mask_region = self.mask_in(geometry)
+        else:
+            origin = self.pos()
+            for rect in rects:
+                rect = rect.intersected(geometry)
+                if not rect.isEmpty():
+                    self.mask_region = self.mask_region.subtracted(QRegion(rect.translated(-origin))).united(self.mask_in(rect))
+        
+        # マスコットが1つもなければウィンドウごと隠す（空のマスクは全体が対象になるため）
+        if self.mask_region.isEmpty():
+            self.hide()
+            return
+        
+        self.setMask(self.mask_region)
+        if not self.isVisible():
+            self.show()
+    
+    # 範囲内のマスコットの現在のフレームを描画するイベント
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        origin = self.pos()
+        dirty = event.rect().translated(origin)
+        for mascot in self.mascots_in(dirty):
+            if not mascot.current_pixmap.isNull():
+                mascot.draw_frame(painter, mascot.pos() - origin, event.rect())
+        painter.end()
+    
+    # マウスイベントを下にあるマスコットに送るメソッド
+    def forward_mouse_event(self, event, mascot):
+        local_pos = event.globalPos() - mascot.pos()
+        forwarded = QMouseEvent(event.type(), QPointF(local_pos), QPointF(event.globalPos()),
+                                event.button(), event.buttons(), event.modifiers())
+        if event.type() == QEvent.MouseButtonPress:
+            mascot.mousePressEvent(forwarded)
+        elif event.type() == QEvent.MouseMove:
+            mascot.mouseMoveEvent(forwarded)
+        else:
+            mascot.mouseReleaseEvent(forwarded)
+    
+    # マウスボタンが押されたときのイベント
+    def mousePressEvent(self, event):
+        mascot = self.compositor.mascot_at(event.globalPos())
+        if mascot is None:
+            event.ignore()
+            return
+        self.grab_target = mascot
+        self.forward_mouse_event(event, mascot)
+    
+    # マウスが動いたときのイベント
+    def mouseMoveEvent(self, event):
+        if self.grab_target is not None:
+            self.forward_mouse_event(event, self.grab_target)
+    
+    # マウスボタンが離されたときのイベント
+    def mouseReleaseEvent(self, event):
+        if self.grab_target is not None:
+            self.forward_mouse_event(event, self.grab_target)
+            if not event.buttons():
+                self.grab_target = None
+
+# オーバーレイ描画クラス（画面ごとのオーバーレイウィンドウに全マスコットを描画する）
+class OverlayCompositor(QObject):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.enabled = False
+        self.overlays = {}  # 画面 -> OverlayWindow
+        
+        # マウスを受け付ける範囲の更新はまとめて行う（変わった範囲だけを作り直す）
+        self.mask_rects = []  # 作り直す範囲（画面座標）
+        self.mask_full = False  # 全体を作り直すかどうか
+        self.mask_timer = QTimer(self)
+        self.mask_timer.setSingleShot(True)
+        self.mask_timer.timeout.connect(self.update_masks)
+    
+    # オーバーレイ表示を有効・無効にするメソッド
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        
+        qapp = QApplication.instance()
+        if enabled:
+            for screen in QApplication.screens():
+                self.add_screen(screen)
+            qapp.screenAdded.connect(self.add_screen)
+            qapp.screenRemoved.connect(self.remove_screen)
+            self.schedule_mask_update()
+        else:
+            qapp.screenAdded.disconnect(self.add_screen)
+            qapp.screenRemoved.disconnect(self.remove_screen)
+            for screen in list(self.overlays):
+                self.remove_screen(screen)
+    
+    # 画面を追加するメソッド
+    def add_screen(self, screen):
+        if screen not in self.overlays:
+            self.overlays[screen] = OverlayWindow(self, screen)
+            self.schedule_mask_update()
+    
+    # 画面を削除するメソッド
+    def remove_screen(self, screen):
+        overlay = self.overlays.pop(screen, None)
+        if overlay is not None:
+            overlay.hide()
+            overlay.deleteLater()
+    
+    # 前面表示を設定するメソッド
+    def set_topmost(self, topmost):
+        for overlay in self.overlays.values():
+            overlay.set_topmost(topmost)
+    
+    # 指定範囲（画面座標）を再描画するメソッド
+    def invalidate(self, rect):
+        for overlay in self.overlays.values():
+            geometry = overlay.geometry()
+            if geometry.intersects(rect):
+                overlay.update(rect.translated(-geometry.topLeft()))
+    
+    # マスコットのフレームが変わったときに呼ぶメソッド
+    # rectはマスコット上の変化した範囲（Noneは全体）
+    def update_mascot(self, mascot, rect=None):
+        if rect is None:
+            self.invalidate(mascot.geometry())
+        else:
+            self.invalidate(rect.translated(mascot.pos()))
+    
+    # マスコットの位置やサイズが変わったときに呼ぶメソッド
+    def mascot_geometry_changed(self, mascot, old_geometry):
+        self.invalidate(old_geometry)
+        self.invalidate(mascot.geometry())
+        self.schedule_mask_update(old_geometry)
+        self.schedule_mask_update(mascot.geometry())
+    
+    # マウスを受け付ける範囲の更新を予約するメソッド（rectは変わった範囲（画面座標）で、Noneは全体）
+    def schedule_mask_update(self, rect=None):
+        if not self.enabled:
+            return
+        if rect is None:
+            self.mask_full = True
+            self.mask_rects = []
+        elif not self.mask_full and not rect.isEmpty():
+            self.mask_rects.append(rect)
+            if len(self.mask_rects) * OVERLAY_MASK_RECT_COST > len(self.app.mascot_widgets):
+                self.mask_full = True
+                self.mask_rects = []
+        if not self.mask_timer.isActive():
+            self.mask_timer.start(0)
+    
+    # マウスを受け付ける範囲を更新するメソッド
+    def update_masks(self):
+        rects = None if self.mask_full else self.mask_rects
+        self.mask_rects = []
+        self.mask_full = False
+        for overlay in self.overlays.values():
+            overlay.update_mask(rects)
+    
+    # 範囲（画面座標）に重なっているマスコットを表示順（手前が後ろ）に返すメソッド
+    def mascots_in(self, rect):
+        return sorted(self.app.spatial_index.query(rect), key=lambda mascot: mascot.z_order)
+    
+    # 指定位置（画面座標）にある一番手前のマスコットを返すメソッド（透明な部分のクリックを通す設定では透明な部分は当たらない）
+    def mascot_at(self, global_pos):
+        for mascot in reversed(self.mascots_in(QRect(global_pos, QSize(1, 1)))):
+            if mascot.hit_test(global_pos - mascot.pos()):
+                return mascot
+        return None
+
+# 空間インデックスクラス（マスコットを格子状のセルに分けて、近くのマスコットだけを探せるようにする）
+class SpatialIndex:
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # セルの座標 -> そのセルに重なるマスコット
+        self.entries = {}  # マスコット -> (重なるセルの範囲, 登録しているセルの座標)
+    
+    # 範囲に重なるセルの範囲（左, 右, 上, 下）を返すメソッド
+    def cell_range(self, rect):
+        size = self.cell_size
+        return (rect.left() // size, rect.right() // size, rect.top() // size, rect.bottom() // size)
+    
+    # 範囲に重なるセルの座標を返すメソッド
+    def cells_for(self, rect):
+        left, right, top, bottom = self.cell_range(rect)
+        return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+    
+    # マスコットを登録するメソッド
+    def insert(self, mascot):
+        self.remove(mascot)
+        geometry = mascot.geometry()
+        cells = self.cells_for(geometry)
+        for cell in cells:
+            self.cells.setdefault(cell, {})[mascot] = True
+        self.entries[mascot] = (self.cell_range(geometry), cells)
+    
+    # 登録済みのマスコットの位置を更新するメソッド（重なるセルが変わらなければ何もしない）
+    # 重なるセルの範囲がすでに分かっていれば渡してもよい
+    def update(self, mascot, cell_range=None):
+        entry = self.entries.get(mascot)
+        if cell_range is None and entry is not None:
+            cell_range = self.cell_range(mascot.geometry())
+        if entry is not None and entry[0] != cell_range:
+            self.insert(mascot)
+    
+    # マスコットを削除するメソッド
+    def remove(self, mascot):
+        for cell in self.entries.pop(mascot, (None, []))[1]:
+            members = self.cells.get(cell)
+            if members is not None:
+                members.pop(mascot, None)
+                if not members:
+                    del self.cells[cell]
+    
+    # 範囲に重なるマスコットを返すメソッド
+    def query(self, rect):
+        found = {}
+        for cell in self.cells_for(rect):
+            for mascot in self.cells.get(cell, ()):
+                if mascot not in found and mascot.geometry().intersects(rect):
+                    found[mascot] = True
+        return list(found)
+
+# ドラッグ制御クラス（マウスの移動を画面のリフレッシュレートに合わせてまとめ、吸着も行う）
+class DragController(QObject):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.mascot = None  # ドラッグ中のマスコット
+        self.pending_pos = None  # まだ反映していない最新の位置
+        
+        # 1フレームに1回だけ位置を反映するタイマー
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.apply_pending)
+    
+    # 移動先を受け取るメソッド（実際の移動は次のフレームでまとめて行う）
+    def request_move(self, mascot, pos):
+        if mascot is not self.mascot:
+            self.apply_pending()
+            self.mascot = mascot
+        self.pending_pos = pos
+        
+        if not self.timer.isActive():
+            # ドラッグの最初の移動はすぐに反映し、以降はリフレッシュレートごとにまとめる
+            self.apply_pending()
+            screen = QApplication.screenAt(pos) or QApplication.primaryScreen()
+            refresh_rate = screen.refreshRate() if screen is not None else 60
+            self.timer.start(max(1, int(1000 / max(refresh_rate, 1))))
+    
+    # 最新の位置を反映するメソッド
+    def apply_pending(self):
+        if self.mascot is None or self.pending_pos is None:
+            self.timer.stop()
+            return
+        
+        pos = self.snap(self.mascot, self.pending_pos)
+        self.pending_pos = None
+        if pos != self.mascot.pos():
+            self.mascot.move(pos)
+    
+    # ドラッグを終えるメソッド（最終位置を確定して一度だけ保存する）
+    def finish(self, mascot):
+        if mascot is self.mascot:
+            self.apply_pending()
+            self.timer.stop()
+            self.mascot = None
+        self.app.mascot_moved(mascot)
+    
+    # 画面の端やほかのマスコットに吸着させた位置を返すメソッド
+    def snap(self, mascot, pos):
+        if not (self.app.snap_to_edges or self.app.snap_to_mascots):
+            return pos
+        
+        rect = QRect(pos, mascot.size())
+        x_edges = []  # (吸着先の位置, 自分の左端からの距離)
+        y_edges = []
+        
+        # 画面（タスクバーを除く）の端
+        if self.app.snap_to_edges:
+            screen = QApplication.screenAt(rect.center()) or QApplication.primaryScreen()
+            if screen is not None:
+                area = screen.availableGeometry()
+                x_edges += [(area.left(), 0), (area.right() + 1, rect.width())]
+                y_edges += [(area.top(), 0), (area.bottom() + 1, rect.height())]
+        
+        # 近くにあるほかのマスコットの端（空間インデックスで近くのものだけ調べる）
+        if self.app.snap_to_mascots:
+            near = rect.adjusted(-SNAP_DISTANCE, -SNAP_DISTANCE, SNAP_DISTANCE, SNAP_DISTANCE)
+            for other in self.app.spatial_index.query(near):
+                if other is mascot:
+                    continue
+                geometry = other.geometry()
+                left, right = geometry.left(), geometry.right() + 1
+                top, bottom = geometry.top(), geometry.bottom() + 1
+                
+                # 縦に重なっていれば左右の端に、横に重なっていれば上下の端に吸着
+                if top < rect.bottom() + 1 + SNAP_DISTANCE and bottom > rect.top() - SNAP_DISTANCE:
+                    x_edges += [(left, rect.width()), (right, 0), (left, 0), (right, rect.width())]
+                if left < rect.right() + 1 + SNAP_DISTANCE and right > rect.left() - SNAP_DISTANCE:
+                    y_edges += [(top, rect.height()), (bottom, 0), (top, 0), (bottom, rect.height())]
+        
+        return QPoint(self.snap_axis(pos.x(), x_edges), self.snap_axis(pos.y(), y_edges))
+    
+    # 一番近い吸着先に合わせた座標を返すメソッド（近くになければそのまま）
+    @staticmethod
+    def snap_axis(value, edges):
+        best = value
+        best_distance = SNAP_DISTANCE + 1
+        for edge, offset in edges:
+            candidate = edge - offset
+            distance = abs(candidate - value)
+            if distance < best_distance:
+                best = candidate
+                best_distance = distance
+        return best
+
+# 自動移動クラス（全マスコットの位置と速度をNumPyの配列で持ち、重力・画面の端・押し合いを1回の計算でまとめて進める）
+class BehaviorEngine(QObject):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.enabled = False
+        self.members_changed = True  # マスコットが増減したので次の計算の前に配列を作り直す
+        
+        # 行はself.mascotsの順番
+        self.mascots = []
+        self.index = {}  # マスコット -> 行
+        self.positions = None  # (N, 2) 左上の位置（小数）
+        self.velocities = None  # (N, 2) 速度（ピクセル/秒）
+        self.sizes = None  # (N, 2) 幅と高さ
+        self.applied = None  # (N, 2) 最後に反映した位置（整数）
+        self.unchecked = {}  # 動かしてからまだ表示を確認していないマスコット（古い順）
+        
+        self.last_tick = None
+        self.last_save = 0
+        
+        # 全マスコット共通のタイマー
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(BEHAVIOR_TICK_INTERVAL)
+        self.timer.timeout.connect(self.tick)
+    
+    # 自動移動が使えるかどうかを返すメソッド（NumPyが必要、読み込むのは開始するときなのでここでは探すだけ）
+    @staticmethod
+    def available():
+        if np is not None:
+            return True
+        import importlib.util
+        return importlib.util.find_spec("numpy") is not None
+    
+    # 自動移動を開始・停止するメソッド（開始するときにNumPyを読み込む）
+    def set_enabled(self, enabled):
+        enabled = bool(enabled) and load_numpy()
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        if enabled:
+            self.members_changed = True
+            self.last_tick = None
+            self.last_save = time.perf_counter()
+            self.timer.start()
+        else:
+            self.timer.stop()
+            self.check_visibility(len(self.unchecked))
+            self.mascots = []
+            self.index = {}
+    
+    # マスコットが増減したことを知らせるメソッド
+    def mascots_changed(self):
+        self.members_changed = True
+        if self.enabled and not self.timer.isActive():
+            self.last_tick = None
+            self.timer.start()
+    
+    # マスコットが自動移動以外で動いたときに呼ばれるメソッド（ドラッグなどで置かれた位置から落ち直す）
+    def mascot_moved(self, mascot):
+        if not self.enabled:
+            return
+        row = self.index.get(mascot)
+        if row is None:
+            return
+        geometry = mascot.geometry()
+        self.sizes[row] = (geometry.width(), geometry.height())
+        if (geometry.x(), geometry.y()) != tuple(self.applied[row]):
+            self.positions[row] = (geometry.x(), geometry.y())
+            self.applied[row] = (geometry.x(), geometry.y())
+            self.velocities[row] = 0
+    
+    # 表示中のマスコット（先頭からBEHAVIOR_MAX_MASCOTS体まで）から配列を作り直すメソッド（続けて表示しているマスコットの速度は引き継ぐ）
+    def rebuild(self):
+        old_velocities = {}
+        for mascot, row in self.index.items():
+            old_velocities[mascot.mascot_id] = self.velocities[row]
+        
+        self.mascots = list(itertools.islice(self.app.mascot_widgets, BEHAVIOR_MAX_MASCOTS))
+        self.index = {mascot: row for row, mascot in enumerate(self.mascots)}
+        self.unchecked = {mascot: True for mascot in self.unchecked if mascot in self.index}
+        count = len(self.mascots)
+        self.positions = np.zeros((count, 2))
+        self.velocities = np.zeros((count, 2))
+        self.sizes = np.zeros((count, 2))
+        for row, mascot in enumerate(self.mascots):
+            geometry = mascot.geometry()
+            self.positions[row] = (geometry.x(), geometry.y())
+            self.sizes[row] = (geometry.width(), geometry.height())
+            velocity = old_velocities.get(mascot.mascot_id)
+            if velocity is not None:
+                self.velocities[row] = velocity
+        self.applied = self.positions.astype(np.int64)
+        self.members_changed = False
+    
+    # 画面ごとの作業領域（タスクバーを除く）を(左, 上, 右, 下)の配列で返すメソッド（メインの画面が先頭）
+    @staticmethod
+    def screen_areas():
+        primary = QApplication.primaryScreen()
+        screens = sorted(QApplication.screens(), key=lambda screen: screen is not primary)
+        areas = []
+        for screen in screens:
+            area = screen.availableGeometry()
+            areas.append((area.left(), area.top(), area.right() + 1, area.bottom() + 1))
+        return np.array(areas, dtype=np.float64).reshape(-1, 4)
+    
+    # 全マスコットの位置と速度をdt秒だけ進めるメソッド
+    def step(self, dt):
+        if self.members_changed:
+            self.rebuild()
+        count = len(self.mascots)
+        areas = self.screen_areas()
+        if count == 0 or len(areas) == 0:
+            return
+        
+        positions = self.positions
+        velocities = self.velocities
+        sizes = self.sizes
+        
+        # ドラッグ中のマスコットは動かさない（ほかのマスコットを押すことはある）
+        free = np.fromiter((not mascot.dragging for mascot in self.mascots), bool, count)
+        
+        # 重力で落とし、速度の分だけ進める
+        velocities[free, 1] += BEHAVIOR_GRAVITY * dt
+        positions[free] += velocities[free] * dt
+        
+        # 重なっているマスコット同士を横に押し離す
+        # 中心のx座標で並べ、並び順で近いBEHAVIOR_SEPARATION_NEIGHBORS体ずつの組をまとめて計算する
+        push = None
+        if count > 1:
+            half = sizes / 2
+            centers = positions + half
+            order = np.argsort(centers[:, 0], kind="stable")
+            max_width = sizes[:, 0].max()
+            push = np.zeros(count)
+            for k in range(1, min(BEHAVIOR_SEPARATION_NEIGHBORS, count - 1) + 1):
+                left_rows = order[:-k]
+                right_rows = order[k:]
+                gap_x = centers[right_rows, 0] - centers[left_rows, 0]
+                if not (gap_x < max_width).any():
+                    break  # 並び順でこれより離れた組は、一番幅の広いマスコット同士でも重ならない
+                overlap_x = half[left_rows, 0] + half[right_rows, 0] - gap_x
+                overlap_y = (half[left_rows, 1] + half[right_rows, 1]
+                             - np.abs(centers[right_rows, 1] - centers[left_rows, 1]))
+                force = np.where((overlap_x > 0) & (overlap_y > 0), overlap_x / 2, 0)
+                push[left_rows] -= force
+                push[right_rows] += force
+            limit = BEHAVIOR_SEPARATION_SPEED * dt
+            push = np.clip(push, -limit, limit) * free
+            positions[:, 0] += push
+        
+        # 中心がある画面（なければ横の範囲が重なる画面、それもなければメインの画面）の作業領域
+        centers = positions + sizes / 2
+        inside_x = (centers[:, 0:1] >= areas[:, 0]) & (centers[:, 0:1] < areas[:, 2])
+        inside_y = (centers[:, 1:2] >= areas[:, 1]) & (centers[:, 1:2] < areas[:, 3])
+        left, top, right, bottom = areas[np.argmax(inside_x + (inside_x & inside_y) * 2, axis=1)].T
+        
+        # 床で跳ね返り、弱くなったら着地する
+        landed = free & (positions[:, 1] + sizes[:, 1] >= bottom)
+        positions[landed, 1] = bottom[landed] - sizes[landed, 1]
+        velocities[landed, 1] = -np.abs(velocities[landed, 1]) * BEHAVIOR_BOUNCE
+        resting = landed & (np.abs(velocities[:, 1]) < BEHAVIOR_REST_SPEED)
+        velocities[resting, 1] = 0
+        
+        # 着地したマスコットは歩く（向きが決まっていなければランダム、押されたら押された向き）
+        idle = resting & (velocities[:, 0] == 0)
+        velocities[idle, 0] = np.where(np.random.random(count)[idle] < 0.5, -1, 1) * BEHAVIOR_WALK_SPEED
+        if push is not None:
+            turned = resting & (push != 0)
+            velocities[turned, 0] = np.sign(push[turned]) * BEHAVIOR_WALK_SPEED
+        
+        # 左右の端で向きを変え、上の端では跳ね返る
+        hit_left = free & (positions[:, 0] < left)
+        positions[hit_left, 0] = left[hit_left]
+        velocities[hit_left, 0] = np.abs(velocities[hit_left, 0])
+        hit_right = free & ~hit_left & (positions[:, 0] + sizes[:, 0] > right)
+        positions[hit_right, 0] = right[hit_right] - sizes[hit_right, 0]
+        velocities[hit_right, 0] = -np.abs(velocities[hit_right, 0])
+        hit_top = free & (positions[:, 1] < top)
+        positions[hit_top, 1] = top[hit_top]
+        velocities[hit_top, 1] = np.abs(velocities[hit_top, 1])
+    
+    # 計算した位置をまとめてマスコットに反映するメソッド（位置が変わったマスコットだけ動かす、動かした数を返す）
+    # 自分で動かしたマスコットの空間インデックスはまとめて求めたセルの範囲で更新し、
+    # 表示の確認は1回にBEHAVIOR_VISIBILITY_CHECKS体ずつ順番に行う
+    def apply(self):
+        if not self.mascots:
+            return 0
+        rounded = np.rint(self.positions).astype(np.int64)
+        offsets = np.abs(rounded - self.applied).max(axis=1)
+        changed = np.flatnonzero(offsets)
+        if len(changed) == 0:
+            self.check_visibility(BEHAVIOR_VISIBILITY_CHECKS)
+            return 0
+        
+        # 重なるセルの範囲（左, 右, 上, 下）をまとめて求める
+        spatial_index = self.app.spatial_index
+        cell_size = spatial_index.cell_size
+        moved = rounded[changed]
+        far = moved + self.sizes[changed].astype(np.int64) - 1
+        cell_ranges = np.stack([moved[:, 0], far[:, 0], moved[:, 1], far[:, 1]], axis=1) // cell_size
+        
+        mascots = self.mascots
+        unchecked = self.unchecked
+        for row, (x, y), cell_range in zip(changed.tolist(), moved.tolist(), cell_ranges.tolist()):
+            mascot = mascots[row]
+            mascot.move_fast(x, y, tuple(cell_range))
+            unchecked[mascot] = True
+        self.applied[changed] = moved
+        self.check_visibility(BEHAVIOR_VISIBILITY_CHECKS)
+        return len(changed)
+    
+    # 計算した位置にまだ動かしていないマスコットの数を返すメソッド（反映した直後は0になる）
+    def pending_count(self):
+        if not self.mascots:
+            return 0
+        return int(np.count_nonzero((np.rint(self.positions).astype(np.int64) != self.applied).any(axis=1)))
+    
+    # 動かしたマスコットのうち古い順に指定した数だけ表示の確認を予約するメソッド
+    def check_visibility(self, count):
+        visibility = self.app.visibility_manager
+        for mascot in list(itertools.islice(self.unchecked, count)):
+            del self.unchecked[mascot]
+            visibility.schedule_check(mascot)
+    
+    # タイマーから呼ばれて1回分進めるメソッド
+    def tick(self):
+        now = time.perf_counter()
+        if self.last_tick is None:
+            dt = BEHAVIOR_TICK_INTERVAL / 1000
+        else:
+            dt = min(now - self.last_tick, 0.05)  # 止まっていた後に大きく飛ばないようにする
+        self.last_tick = now
+        
+        metrics = self.app.perf_metrics
+        with metrics.measure("behavior_tick"):
+            with metrics.measure("behavior_step"):
+                self.step(dt)
+            self.apply()
+        
+        # マスコットがいなければ次に増えるまで止める
+        if not self.mascots:
+            self.timer.stop()
+            return
+        
+        # 動いた配置をときどき保存する
+        if now - self.last_save >= BEHAVIOR_SAVE_INTERVAL / 1000:
+            self.last_save = now
+            self.app.save_config()
 
-# マスコットウィジェットクラス（個々のマスコットを管理）
-class MascotWidget(QWidget):
-    def __init__(self, parent=None, image_info=None):
-        super().__init__(parent)
+# パフォーマンス統計クラス（メモリ・描画・デコード・保存・メニュー作成の時間を集計する）
+class PerfMetrics(QObject):
+    # 統計を取り直したときのシグナル
+    updated = pyqtSignal()
+    
+    # CSVに書き出す列
+    CSV_FIELDS = ["timestamp", "id", "name", "frame_bytes", "saved_bytes", "shared_by", "frames", "fps",
+                  "dropped_per_sec", "rendered_frames", "skipped_frames", "dropped_frames", "decode_ms", "suspended"]
+    
+    def __init__(self, app, export_dir, export_interval=0):
+        super().__init__(app)
+        self.app = app
+        self.export_dir = export_dir
+        
+        # 名前 -> [回数, 合計, 最大, 直近]（ミリ秒、設定の書き込みスレッドからも記録される）
+        self.timings = {}
+        self.lock = threading.Lock()
+        
+        # 1秒あたりの描画・コマ落ちを求めるための前回の値
+        self.last_sample_time = None
+        self.last_counts = {}  # マスコット -> (描画回数, コマ落ち回数)
+        self.rates = {}  # マスコット -> (描画fps, コマ落ち/秒)
+        
+        # パフォーマンス表示中だけ統計を取り直すタイマー
+        self.sample_timer = QTimer(self)
+        self.sample_timer.setInterval(METRICS_SAMPLE_INTERVAL)
+        self.sample_timer.timeout.connect(self.sample)
+        
+        # 一定間隔で書き出すタイマー
+        self.export_interval = 0
+        self.export_timer = QTimer(self)
+        self.export_timer.timeout.connect(self.export_periodic)
+        self.set_export_interval(export_interval)
+        
+        self.hud = None
+    
+    # 処理時間を記録するメソッド
+    def record_time(self, name, elapsed_ms):
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, elapsed_ms, elapsed_ms, elapsed_ms]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed_ms
+                timing[2] = max(timing[2], elapsed_ms)
+                timing[3] = elapsed_ms
+    
+    # withブロックの処理時間を記録するメソッド
+    @contextmanager
+    def measure(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, (time.perf_counter() - start_time) * 1000)
+    
+    # 一定間隔での書き出しを設定するメソッド（秒、0で無効）
+    def set_export_interval(self, seconds):
+        self.export_interval = seconds
+        if seconds and seconds > 0:
+            self.export_timer.start(int(seconds * 1000))
+        else:
+            self.export_timer.stop()
+    
+    # 各マスコットの1秒あたりの描画・コマ落ちを取り直すメソッド
+    def sample(self):
+        now = time.perf_counter()
+        elapsed = now - self.last_sample_time if self.last_sample_time is not None else 0
+        
+        # 直前に取り直したばかりなら前回の値を使う
+        if self.last_sample_time is not None and elapsed < METRICS_SAMPLE_INTERVAL / 4000:
+            return
+        
+        counts = {}
+        rates = {}
+        for mascot in self.app.mascot_widgets:
+            count = (mascot.rendered_frames, mascot.dropped_frames)
+            last_count = self.last_counts.get(mascot)
+            if last_count is not None and elapsed > 0:
+                rates[mascot] = ((count[0] - last_count[0]) / elapsed, (count[1] - last_count[1]) / elapsed)
+            else:
+                rates[mascot] = (0.0, 0.0)
+            counts[mascot] = count
+        
+        self.last_sample_time = now
+        self.last_counts = counts
+        self.rates = rates
+        self.updated.emit()
+    
+    # 現在の統計を辞書で返すメソッド
+    def snapshot(self, resample=True):
+        if resample:
+            self.sample()
+        
+        app = self.app
+        mascots = []
+        for mascot in app.mascot_widgets:
+            frame_set = mascot.frame_set
+            fps, dropped_per_sec = self.rates.get(mascot, (0.0, 0.0))
+            mascots.append({
+                "id": mascot.mascot_id,
+                "name": mascot.image_info["name"] if mascot.image_info else "",
+                "frame_bytes": frame_set.byte_size if frame_set is not None else 0,
+                "saved_bytes": frame_set.full_bytes - frame_set.byte_size if frame_set is not None else 0,
+                "shared_by": frame_set.ref_count if frame_set is not None else 0,
+                "frames": frame_set.frame_count() if frame_set is not None else 0,
+                "fps": round(fps, 1),
+                "dropped_per_sec": round(dropped_per_sec, 1),
+                "rendered_frames": mascot.rendered_frames,
+                "skipped_frames": mascot.skipped_frames,
+                "dropped_frames": mascot.dropped_frames,
+                "decode_ms": round(frame_set.decode_ms, 1) if frame_set is not None else 0,
+                "suspended": mascot.animation_suspended
+            })
+        
+        # 共有しているフレームは1回だけ数える
+        store = app.frame_store
+        disk_cache = app.disk_cache
+        saver = app.config_saver
+        totals = {
+            "mascots": len(mascots),
+            "frame_bytes": store.total_bytes,
+            "frame_bytes_saved": store.saved_bytes(),
+            "frame_sets": len(store.active),
+            "unused_frame_sets": len(store.unused),
+            "fps": round(sum(m["fps"] for m in mascots), 1),
+            "dropped_per_sec": round(sum(m["dropped_per_sec"] for m in mascots), 1),
+            "dropped_frames": sum(m["dropped_frames"] for m in mascots),
+            "suspended": sum(1 for m in mascots if m["suspended"]),
+            "disk_cache_hits": disk_cache.hit_count,
+            "disk_cache_misses": disk_cache.miss_count,
+            "config_save_requests": saver.request_count,
+            "config_writes": saver.write_count,
+            "config_coalesced": saver.coalesced_count,
+            "widget_pool": app.widget_pool.stats()
+        }
+        
+        with self.lock:
+            timings = {}
+            for name, (count, total, maximum, last) in self.timings.items():
+                timings[name] = {
+                    "count": count,
+                    "total_ms": round(total, 2),
+                    "avg_ms": round(total / count, 2),
+                    "max_ms": round(maximum, 2),
+                    "last_ms": round(last, 2)
+                }
+        
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "totals": totals,
+            "timings": timings,
+            "mascots": mascots
+        }
+    
+    # 統計をJSONとCSVに書き出すメソッド（書き出したJSONのパスを返す）
+    def export(self, base_name=None):
+        snapshot = self.snapshot()
+        if base_name is None:
+            base_name = "perf_" + datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        try:
+            os.makedirs(self.export_dir, exist_ok=True)
+            json_path = os.path.join(self.export_dir, base_name + ".json")
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=4)
+            
+            # CSVはマスコットごとに1行（Excelで開けるようにBOM付き）
+            import csv  # 書き出すときだけ使うので、ここで読み込む
+            csv_path = os.path.join(self.export_dir, base_name + ".csv")
+            with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.CSV_FIELDS)
+                writer.writeheader()
+                for mascot in snapshot["mascots"]:
+                    writer.writerow(dict(mascot, timestamp=snapshot["timestamp"]))
+            return json_path
+        except Exception as e:
+            print(f"統計の書き出しエラー: {e}")
+            return None
+    
+    # 一定間隔で書き出すメソッド（同じファイルを上書きする）
+    def export_periodic(self):
+        self.export("perf_latest")
+    
+    # パフォーマンス表示中かどうかを返すメソッド
+    def hud_visible(self):
+        return self.hud is not None and self.hud.isVisible()
+    
+    # パフォーマンス表示を切り替えるメソッド
+    def set_hud_visible(self, visible):
+        if visible:
+            if self.hud is None:
+                self.hud = PerfHud(self)
+            self.sample_timer.start()
+            self.sample()
+            self.hud.show()
+        else:
+            self.sample_timer.stop()
+            if self.hud is not None:
+                self.hud.hide()
+
+# パフォーマンス表示クラス（画面の隅に統計を小さく表示する、クリックは下に通す）
+class PerfHud(QWidget):
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
         
         # ウィンドウの設定
-        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool |
+                            Qt.WindowTransparentForInput)
         self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setAttribute(Qt.WA_ShowWithoutActivating)
         
-        # レイアウトとイメージラベルの設定
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
-        self.image_label = QLabel()
-        layout.addWidget(self.image_label)
+        self.label = QLabel()
+        self.label.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; "
+                                 "font-family: monospace; padding: 6px;")
+        layout.addWidget(self.label)
         self.setLayout(layout)
         
-        # 画像情報
+        metrics.updated.connect(self.refresh)
+    
+    # 表示を更新するメソッド
+    def refresh(self):
+        if not self.isVisible():
+            return
+        
+        snapshot = self.metrics.snapshot(resample=False)
+        totals = snapshot["totals"]
+        timings = snapshot["timings"]
+        
+        def timing_text(name):
+            timing = timings.get(name)
+            if timing is None:
+                return "-"
+            return f"{timing['count']}回 平均{timing['avg_ms']:.1f}ms 最大{timing['max_ms']:.1f}ms"
+        
+        lines = [
+            f"マスコット {totals['mascots']}（停止中 {totals['suspended']}）",
+            f"フレーム {totals['frame_bytes'] / (1024 * 1024):.1f}MB "
+            f"（使用中 {totals['frame_sets']} / 未使用 {totals['unused_frame_sets']}）"
+            f" 節約 {totals['frame_bytes_saved'] / (1024 * 1024):.1f}MB",
+            f"描画 {totals['fps']:.1f}fps  コマ落ち {totals['dropped_per_sec']:.1f}/s",
+            f"デコード {timing_text('decode')}",
+            f"ディスクキャッシュ {totals['disk_cache_hits']}件ヒット / {totals['disk_cache_misses']}件ミス",
+            f"設定保存 {totals['config_writes']}回（要求 {totals['config_save_requests']}回） "
+            f"書き込み {timing_text('config_write')}",
+            f"メニュー作成 {timing_text('tray_menu')}",
+            f"自動移動 {timing_text('behavior_tick')}",
+            f"ウィジェットプール {totals['widget_pool']['pooled']}/{totals['widget_pool']['capacity']} "
+            f"ヒット率 {totals['widget_pool']['hit_rate'] * 100:.0f}%",
+            f"右クリックメニュー {timing_text('context_menu')}"
+        ]
+        
+        # メモリを多く使っているマスコット
+        heavy = sorted(snapshot["mascots"], key=lambda m: m["frame_bytes"], reverse=True)[:5]
+        for mascot in heavy:
+            lines.append(f"  {mascot['name'][:16]} {mascot['frame_bytes'] / (1024 * 1024):.1f}MB "
+                         f"{mascot['fps']:.0f}fps x{mascot['shared_by']}")
+        
+        self.label.setText("\n".join(lines))
+        self.adjustSize()
+        
+        # 画面の左上に表示
+        screen = QApplication.primaryScreen()
+        if screen is not None:
+            self.move(screen.availableGeometry().topLeft() + QPoint(8, 8))
+    
+    # 表示されたときのイベント
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+
+# マスコットウィジェットクラス（個々のマスコットを管理）
+class MascotWidget(QWidget):
+    def __init__(self, parent=None, image_info=None, placeholder_size=None, scale=1.0, max_size=0, pooled=False):
+        super().__init__(parent)
+        
+        # ウィンドウの設定
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        
+        # 画像情報（フレームはpaintEventで直接描画する）
         self.image_info = image_info
-        self.movie = None
+        self.current_pixmap = QPixmap()  # 現在表示しているフレーム
+        self.current_rect = None  # ピクスマップ上の表示範囲（スプライトシートのとき、Noneは全体）
+        self.hit_mask = None  # 現在のフレームの当たり判定のマスク（Noneは全体が当たる）
+        self.input_masked = False  # ウィンドウの入力範囲をマスクで制限しているかどうか
+        
+        # 表示倍率と最大サイズ（マスコットごとの設定）
+        self.scale = scale
+        self.max_size = max_size
+        
+        # オーバーレイ表示のときは親のMascotAppがまとめて描画する
+        self.compositor = getattr(parent, "compositor", None)
+        
+        # ドラッグの移動と吸着は親のMascotAppがまとめて処理する
+        self.drag_controller = getattr(parent, "drag_controller", None)
+        self.spatial_index = getattr(parent, "spatial_index", None)
+        
+        # 自動移動は親のMascotAppがまとめて計算する
+        self.behavior = getattr(parent, "behavior_engine", None)
+        self.known_pos = QPoint()  # 位置の変化を処理済みの位置（外から動かされたかどうかの判定用）
+        self.z_order = 0  # 表示順（オーバーレイ表示で大きいほど手前に描画する）
+        
+        # 共有フレームストア（親のMascotAppが持つものを使う）
+        self.frame_store = getattr(parent, "frame_store", None) or FrameStore()
+        self.frame_set = None
+        self.pending_frame_set = None  # デコード待ちの新しいフレーム
+        self.frame_index = 0
+        
+        # アニメーションは親のMascotAppが持つ共通スケジューラで進める
+        self.scheduler = getattr(parent, "animation_scheduler", None) or AnimationScheduler(self)
+        self.next_frame_time = 0
+        self.animation_epoch = 0  # 最初のフレームを表示した時刻（共通の時計）
+        
+        # 見えないときはアニメーションを止める（親のMascotAppが管理する）
+        self.visibility = getattr(parent, "visibility_manager", None)
+        self.animation_suspended = False
+        self.frames_released = False  # 止めている間にフレームを返却したかどうか
+        
+        # パフォーマンス統計用の描画・変化がなく省いた描画・コマ落ちの回数
+        self.rendered_frames = 0
+        self.skipped_frames = 0
+        self.dropped_frames = 0
         
         # マスコットID（一意の識別子）
         self.mascot_id = str(uuid.uuid4())
         
-        # 画像をロード
+        # 画像をロード（デコードが終わるまでは保存されたサイズのプレースホルダーを表示）
         if image_info:
+            self.set_placeholder(placeholder_size)
             self.load_image()
         else:
             self.set_default_image()
@@ -42,83 +3644,414 @@ class MascotWidget(QWidget):
         self.dragging = False
         self.offset = QPoint()
         
+        # プール用に先に作っておく場合は、ネイティブウィンドウだけを作って表示しない
+        if pooled:
+            self.winId()
+            return
+        
         # ウィンドウを表示
-        self.show()
+        self.present()
+        
+        if self.visibility is not None:
+            self.visibility.track(self)
+    
+    # オーバーレイ表示で描画されているかどうかを返すメソッド
+    def uses_overlay(self):
+        return self.compositor is not None and self.compositor.enabled
+    
+    # 表示方法に合わせてマスコットを表示するメソッド
+    def present(self):
+        if self.uses_overlay():
+            # 自分のウィンドウは作らずにオーバーレイに描画してもらう
+            self.hide()
+            self.compositor.mascot_geometry_changed(self, self.geometry())
+        else:
+            self.update()
+            self.show()
+    
+    # フレームを表示するメソッド（source_rectを指定するとピクスマップのその範囲だけを描画する）
+    # dirty_rectを指定するとその範囲だけを描き直す（空なら描き直さない）
+    def display_pixmap(self, pixmap, source_rect=None, dirty_rect=None):
+        self.current_pixmap = pixmap
+        self.current_rect = source_rect
+        if dirty_rect is not None and dirty_rect.isEmpty():
+            return
+        if self.uses_overlay():
+            self.compositor.update_mascot(self, dirty_rect)
+        elif dirty_rect is None:
+            self.update()
+        else:
+            self.update(dirty_rect)
+    
+    # フレームセットの指定フレームを表示するメソッド
+    def display_frame(self, index, dirty_rect=None):
+        self.display_pixmap(self.frame_set.pixmap(index), self.frame_set.source_rect(index), dirty_rect)
+        self.set_hit_mask(self.frame_set.hit_mask(index))
+    
+    # 当たり判定のマスクを設定するメソッド（マスクが変わったときだけ入力範囲を更新する）
+    def set_hit_mask(self, hit_mask):
+        if hit_mask is self.hit_mask:
+            return
+        self.hit_mask = hit_mask
+        self.update_input_mask()
+    
+    # 透明な部分のクリックが下に通り抜けるように入力範囲を更新するメソッド
+    def update_input_mask(self):
+        click_through = getattr(self.parent(), "click_through", False)
+        if self.uses_overlay():
+            # オーバーレイ表示では画面ごとのウィンドウの入力範囲をまとめて更新する
+            if click_through:
+                self.compositor.schedule_mask_update(self.geometry())
+        elif click_through and self.hit_mask is not None:
+            self.setMask(self.hit_mask.input_region())
+            self.input_masked = True
+        elif self.input_masked:
+            self.clearMask()
+            self.input_masked = False
+    
+    # 指定位置（マスコット上の座標）でクリックを受け付けるかどうかを返すメソッド
+    # （透明な部分のクリックを通す設定のときだけ不透明な部分に限り、それ以外は今までどおり四角形全体）
+    def hit_test(self, pos):
+        if self.hit_mask is None or not getattr(self.parent(), "click_through", False):
+            return True
+        return self.hit_mask.contains(pos.x(), pos.y())
+    
+    # 現在のフレームを指定位置に描画するメソッド（オーバーレイ表示からも使う）
+    # clipを指定するとその範囲に重なる部分だけを転送する
+    def draw_frame(self, painter, position, clip=None):
+        source = self.current_rect if self.current_rect is not None else self.current_pixmap.rect()
+        target = QRect(position, source.size())
+        if clip is not None:
+            target = target.intersected(clip)
+            if target.isEmpty():
+                return
+        painter.drawPixmap(target, self.current_pixmap,
+                           QRect(source.topLeft() + (target.topLeft() - position), target.size()))
+    
+    # 描画イベント（変化した範囲だけが描き直される）
+    def paintEvent(self, event):
+        if self.current_pixmap.isNull():
+            return
+        painter = QPainter(self)
+        self.draw_frame(painter, QPoint(0, 0), event.rect())
+        painter.end()
+    
+    # 位置を変えるメソッド（オーバーレイ表示では再描画を知らせる）
+    def move(self, *args):
+        old_geometry = self.geometry()
+        self.known_pos = QPoint(*args)  # moveEventで同じ位置をもう一度確認しない
+        super().move(*args)
+        self.geometry_changed(old_geometry)
+    
+    # 自動移動で位置を変えるメソッド（cell_rangeは移動先で重なる空間インデックスのセルの範囲）
+    # 自動移動への通知は省き、表示の確認は自動移動が少しずつまとめて予約する
+    def move_fast(self, x, y, cell_range):
+        old_geometry = self.geometry()
+        self.known_pos = QPoint(x, y)
+        super().move(x, y)
+        if self.spatial_index is not None:
+            self.spatial_index.update(self, cell_range)
+        if self.uses_overlay():
+            self.compositor.mascot_geometry_changed(self, old_geometry)
+    
+    # サイズを変えるメソッド（オーバーレイ表示では再描画を知らせる）
+    def resize(self, *args):
+        old_geometry = self.geometry()
+        super().resize(*args)
+        self.geometry_changed(old_geometry)
+    
+    # 位置やサイズが変わったことを知らせるメソッド
+    def geometry_changed(self, old_geometry):
+        self.known_pos = self.pos()
+        if self.spatial_index is not None:
+            self.spatial_index.update(self)
+        if self.behavior is not None:
+            self.behavior.mascot_moved(self)
+        if self.visibility is not None:
+            self.visibility.schedule_check(self)
+        if self.uses_overlay():
+            self.compositor.mascot_geometry_changed(self, old_geometry)
     
     # デフォルト画像を設定するメソッド
     def set_default_image(self):
         # サンプル用に透明の画像を作成
         default_image = QPixmap(100, 100)
         default_image.fill(Qt.transparent)
-        self.image_label.setPixmap(default_image)
+        self.display_pixmap(default_image)
+        self.set_hit_mask(None)
         self.resize(default_image.size())
     
-    # 画像を読み込むメソッド
+    # 読み込み中のプレースホルダーを設定するメソッド
+    def set_placeholder(self, size=None):
+        if size is None or size.isEmpty():
+            size = QSize(100, 100)
+        placeholder = QPixmap(size)
+        placeholder.fill(QColor(128, 128, 128, 48))
+        self.display_pixmap(placeholder)
+        self.set_hit_mask(None)
+        self.resize(size)
+    
+    # 画像を読み込むメソッド（デコードはバックグラウンドで行う）
     def load_image(self):
         if not self.image_info:
             return
         
         file_path = self.image_info["path"]
         
-        # 現在のGIFがある場合は停止
-        if self.movie is not None:
-            self.movie.stop()
-            self.movie = None
-        
-        # GIFの場合
-        if self.image_info["is_gif"]:
-            movie = QMovie(file_path)
-            
-            # GIFが正常に読み込めた場合
-            if movie.isValid():
-                movie.setCacheMode(QMovie.CacheAll)
-                self.image_label.setMovie(movie)
-                movie.start()
-                self.movie = movie
-                
-                # GIFの最初のフレームサイズに合わせてウィンドウをリサイズ
-                movie.jumpToFrame(0)
-                self.resize(movie.currentPixmap().size())
-        # 静止画の場合
+        # デコード待ちの画像があれば取り消す
+        self.release_pending_frames()
+        
+        # 共有フレームストアからフレームを取得（同じ画像は一度だけデコード）
+        frame_set = self.frame_store.acquire(file_path, self.image_info["is_gif"], self,
+                                             self.scale, self.max_size)
+        if frame_set.failed:
+            self.frame_store.release(frame_set, self)
+        elif frame_set.is_ready():
+            self.show_frame_set(frame_set)
+        else:
+            # 最初のフレームが届くまでは今の画像を表示したままにする
+            self.pending_frame_set = frame_set
+    
+    # 最初のフレームが届いたときに呼ばれるメソッド
+    def on_frames_ready(self, frame_set):
+        if frame_set is self.pending_frame_set:
+            self.pending_frame_set = None
+            self.show_frame_set(frame_set)
+        elif frame_set is self.frame_set and not frame_set.is_animated():
+            # デコードしてみたら1フレームだけだった場合
+            self.scheduler.unregister(self)
+    
+    # デコードに失敗したときに呼ばれるメソッド
+    def on_frames_failed(self, frame_set):
+        if frame_set is self.pending_frame_set:
+            self.release_pending_frames()
+    
+    # フレームセットを表示するメソッド
+    def show_frame_set(self, frame_set):
+        # 現在のフレームがある場合は停止して返却
+        self.release_current_frames()
+        
+        self.frame_set = frame_set
+        self.frame_index = 0
+        self.display_frame(0)
+        
+        # 返却したフレームを読み直した場合は止める前の時計のまま続きから再生する
+        if self.frames_released:
+            self.frames_released = False
+        else:
+            self.animation_epoch = self.scheduler.now()
+        
+        # 最初のフレームサイズに合わせてウィンドウをリサイズ
+        self.resize(frame_set.size())
+        
+        # GIFの場合は再生を開始
+        self.start_animation()
+    
+    # アニメーションを開始するメソッド
+    def start_animation(self):
+        if self.frame_set is None or not self.frame_set.is_animated() or self.animation_suspended:
+            return
+        if not self.scheduler.is_registered(self):
+            self.sync_animation(self.scheduler.now())
+        self.scheduler.register(self)
+    
+    # 共通の時計での経過時間から今表示すべきフレームに合わせるメソッド
+    def sync_animation(self, now):
+        frame_set = self.frame_set
+        elapsed = max(0, now - self.animation_epoch)
+        if frame_set.complete:
+            # ループの開始フレームより前（導入部分）は最初の一回だけ再生する
+            intro = sum(frame_set.delays[:frame_set.loop_start])
+            if elapsed >= intro:
+                elapsed = intro + (elapsed - intro) % (sum(frame_set.delays) - intro)
+        
+        index = 0
+        last_index = frame_set.frame_count() - 1
+        while index < last_index and elapsed >= frame_set.delay(index):
+            elapsed -= frame_set.delay(index)
+            index += 1
+        
+        if index != self.frame_index:
+            self.frame_index = index
+            self.display_frame(index)
+        self.next_frame_time = now + max(0, frame_set.delay(index) - elapsed)
+    
+    # アニメーションを一時停止するメソッド（見えなくなったとき）
+    def suspend_animation(self):
+        self.animation_suspended = True
+        self.scheduler.unregister(self)
+    
+    # アニメーションを再開するメソッド（見えるようになったとき）
+    def resume_animation(self):
+        self.animation_suspended = False
+        if self.frames_released and self.frame_set is None:
+            # 返却したフレームをもう一度取得する（キャッシュに残っていればすぐ表示される）
+            self.load_image()
+        else:
+            self.start_animation()
+    
+    # 止めている間にフレームを返却するメソッド（表示中の1枚だけは残す）
+    def release_suspended_frames(self):
+        if self.frame_set is not None and self.frame_set.is_animated():
+            # スプライトシートはシート全体を持ち続けないように、表示中の範囲だけをコピーして残す
+            if self.current_rect is not None:
+                self.current_pixmap = self.current_pixmap.copy(self.current_rect)
+                self.current_rect = None
+            self.release_current_frames()
+            self.frames_released = True
+    
+    # アニメーションを表示すべきかどうかを返すメソッド（画面外・隠れている場合はFalse）
+    def is_animation_visible(self, screens):
+        if self.uses_overlay():
+            geometry = self.geometry()
+            return any(screen.intersects(geometry) for screen in screens)
+        
+        if not self.isVisible():
+            return False
+        
+        window = self.windowHandle()
+        if window is not None and not window.isExposed():
+            return False
+        
+        geometry = self.frameGeometry()
+        return any(screen.intersects(geometry) for screen in screens)
+    
+    # 指定時刻までアニメーションを進めるメソッド
+    def advance_animation(self, now):
+        if self.next_frame_time > now:
+            return False
+        
+        frame_count = self.frame_set.frame_count()
+        
+        # 長く止まっていた場合は今から再開する
+        if now - self.next_frame_time > sum(self.frame_set.delays):
+            self.next_frame_time = now
+        
+        # 遅れた分のフレームは飛ばして、今表示すべきフレームだけ描画する
+        # 描き直す範囲は飛ばしたフレームも含めて変化した範囲をまとめたもの
+        advanced = 0
+        dirty_rect = QRect()
+        while self.next_frame_time <= now:
+            next_index = self.frame_index + 1
+            if next_index >= frame_count:
+                if not self.frame_set.complete:
+                    # まだデコードされていないフレームは届くまで待つ
+                    self.next_frame_time = now + self.frame_set.delay(self.frame_index)
+                    break
+                next_index = self.frame_set.loop_start
+                if next_index != 0:
+                    # 導入部分のあるループでは戻り先との差分を持っていないので全体を描き直す
+                    dirty_rect = self.rect()
+            self.frame_index = next_index
+            self.next_frame_time += self.frame_set.delay(self.frame_index)
+            dirty_rect = dirty_rect.united(self.frame_set.dirty_rect(self.frame_index))
+            advanced += 1
+        
+        if advanced == 0:
+            return False
+        
+        # 前のフレームと同じ場合は描き直さない
+        if dirty_rect.isEmpty():
+            self.skipped_frames += 1
         else:
-            pixmap = QPixmap(file_path)
-            if not pixmap.isNull():  # 画像の読み込みに成功した場合
-                self.image_label.setPixmap(pixmap)
-                self.resize(pixmap.size())
+            self.rendered_frames += 1
+        self.dropped_frames += advanced - 1
+        self.display_frame(self.frame_index, dirty_rect)
+        return True
+    
+    # フレームをフレームストアに返却するメソッド
+    def release_frames(self):
+        self.release_pending_frames()
+        self.release_current_frames()
+    
+    # 表示中のフレームを返却するメソッド
+    def release_current_frames(self):
+        self.scheduler.unregister(self)
+        if self.frame_set is not None:
+            self.frame_store.release(self.frame_set, self)
+            self.frame_set = None
+    
+    # デコード待ちのフレームを返却するメソッド
+    def release_pending_frames(self):
+        if self.pending_frame_set is not None:
+            self.frame_store.release(self.pending_frame_set, self)
+            self.pending_frame_set = None
     
     # 画像情報を設定するメソッド
     def set_image_info(self, image_info):
         self.image_info = image_info
+        self.frames_released = False
+        self.load_image()
+    
+    # 表示倍率と最大サイズを設定するメソッド（縮小済みのフレームが届くまで今の表示を続ける）
+    def set_scale(self, scale=None, max_size=None):
+        if scale is not None:
+            self.scale = scale
+        if max_size is not None:
+            self.max_size = max_size
         self.load_image()
     
     # 前面表示を設定するメソッド
     def set_topmost(self, topmost):
         flags = self.windowFlags()
         if topmost:
-            self.setWindowFlags(flags | Qt.WindowStaysOnTopHint)
+            new_flags = flags | Qt.WindowStaysOnTopHint
         else:
-            self.setWindowFlags(flags & ~Qt.WindowStaysOnTopHint)
+            new_flags = flags & ~Qt.WindowStaysOnTopHint
+        
+        # フラグを変えるとネイティブウィンドウが作り直されるので、変わるときだけ設定する
+        if new_flags != flags:
+            self.setWindowFlags(new_flags)
         
         # ウィンドウフラグを変更した後に再表示する必要がある
-        self.show()
+        if not self.uses_overlay():
+            self.show()
         
         # GIFの場合は再生を再開する
-        if self.movie:
-            self.movie.start()
+        self.start_animation()
+    
+    # プールから取り出したウィジェットを新しいマスコットとして使い直すメソッド
+    # （ネイティブウィンドウはそのまま使い、画像の状態はset_image_infoで読み込み直す）
+    def reuse(self, image_info, placeholder_size=None, scale=1.0, max_size=0, position=None):
+        self.mascot_id = str(uuid.uuid4())
+        self.menu_serial = None
+        self.rendered_frames = 0
+        self.skipped_frames = 0
+        self.dropped_frames = 0
+        self.dragging = False
+        self.animation_suspended = False
+        self.frame_index = 0
+        self.scale = scale
+        self.max_size = max_size
+        
+        # 表示する前に移動しておく（前の位置に一瞬表示されないように）
+        if position is not None:
+            self.move(position)
+        self.set_placeholder(placeholder_size)
+        self.set_image_info(image_info)
+        self.present()
+        
+        if self.visibility is not None:
+            self.visibility.track(self)
     
     # リソースを解放するメソッド（追加）
     def cleanup_resources(self):
-        # GIFムービーの停止と解放
-        if self.movie is not None:
-            self.movie.stop()
-            self.image_label.setMovie(None)
-            self.movie = None
-        # 静的画像の解放
-        else:
-            self.image_label.setPixmap(QPixmap())
+        # アニメーションを停止し、共有フレームを返却
+        if self.visibility is not None:
+            self.visibility.untrack(self)
+        self.release_frames()
+        self.display_pixmap(QPixmap())
+        self.set_hit_mask(None)
+        if self.uses_overlay():
+            self.compositor.schedule_mask_update(self.geometry())
     
     # マウスボタンが押されたときのイベント
     def mousePressEvent(self, event):
+        # 透明な部分のクリックを通す設定では、透明な部分のクリックは受け付けない
+        if not self.hit_test(event.pos()):
+            event.ignore()
+            return
+        
         if event.button() == Qt.LeftButton:  # 左クリックの場合
             self.dragging = True
             self.offset = event.pos()
@@ -130,13 +4063,41 @@ class MascotWidget(QWidget):
     # マウスが動いたときのイベント（ドラッグ中）
     def mouseMoveEvent(self, event):
         if self.dragging and event.buttons() == Qt.LeftButton:
-            # マスコットを移動
-            self.move(self.mapToGlobal(event.pos() - self.offset))
+            # マスコットを移動（実際の移動は1フレームに1回にまとめる）
+            new_pos = event.globalPos() - self.offset
+            if self.drag_controller is not None:
+                self.drag_controller.request_move(self, new_pos)
+            else:
+                self.move(new_pos)
+    
+    # 表示されたときのイベント（見えるようになったら再生を再開）
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.visibility is not None:
+            self.visibility.mascot_shown(self, True)
+    
+    # 非表示になったときのイベント（見えなくなったら再生を止める）
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        if self.visibility is not None:
+            self.visibility.mascot_shown(self, False)
+    
+    # ウィンドウが移動したときのイベント（画面内に戻ったら再生を再開）
+    def moveEvent(self, event):
+        super().moveEvent(event)
+        # move()やmove_fast()で動かした位置は処理済みなので、ウィンドウが外から動かされたときだけ確認する
+        if self.visibility is not None and self.pos() != self.known_pos:
+            self.known_pos = self.pos()
+            self.visibility.schedule_check(self)
     
     # マウスボタンが離されたときのイベント
     def mouseReleaseEvent(self, event):
-        if event.button() == Qt.LeftButton:
+        if event.button() == Qt.LeftButton and self.dragging:
             self.dragging = False
+            
+            # 最終位置を確定して設定に保存
+            if self.drag_controller is not None:
+                self.drag_controller.finish(self)
     
     # 終了イベント（追加）
     def closeEvent(self, event):
@@ -144,11 +4105,449 @@ class MascotWidget(QWidget):
         self.cleanup_resources()
         super().closeEvent(event)
 
+# マスコットのウィジェットのプールクラス（削除したウィジェットを非表示で残しておき、次の作成で使い回す）
+class MascotWidgetPool(QObject):
+    def __init__(self, app, capacity=DEFAULT_WIDGET_POOL_SIZE):
+        super().__init__(app)
+        self.app = app
+        self.capacity = capacity
+        self.widgets = []  # 使われていないウィジェット（非表示）
+        self.prewarm_remaining = 0  # 先に作っておく残りの数
+        
+        # パフォーマンス統計用の回数
+        self.hit_count = 0  # プールから取り出せた回数
+        self.miss_count = 0  # 新しく作った回数
+        self.returned_count = 0  # プールに戻した回数
+        self.discarded_count = 0  # プールがいっぱいで破棄した回数
+    
+    # マスコットのウィジェットを返すメソッド（プールにあれば使い回し、なければ新しく作る）
+    def acquire(self, image_info, placeholder_size=None, scale=1.0, max_size=0, position=None):
+        while self.widgets:
+            widget = self.widgets.pop()
+            if sip.isdeleted(widget):
+                continue
+            self.hit_count += 1
+            widget.reuse(image_info, placeholder_size, scale, max_size, position)
+            return widget
+        
+        self.miss_count += 1
+        widget = MascotWidget(self.app, image_info, placeholder_size, scale, max_size)
+        if position is not None:
+            widget.move(position)
+        return widget
+    
+    # 削除したマスコットのウィジェットを戻すメソッド（リソースの解放と非表示は呼び出し側で済ませておく）
+    def release(self, widget):
+        if len(self.widgets) < self.capacity and not sip.isdeleted(widget):
+            self.widgets.append(widget)
+            self.returned_count += 1
+            return True
+        
+        self.discarded_count += 1
+        widget.deleteLater()
+        return False
+    
+    # プールの大きさを変えるメソッド（あふれた分は破棄する）
+    def set_capacity(self, capacity):
+        self.capacity = max(0, capacity)
+        while len(self.widgets) > self.capacity:
+            self.widgets.pop().deleteLater()
+    
+    # ウィジェットを先に作っておくメソッド（1回のイベントループで作るのは一定数まで）
+    def prewarm(self, count):
+        self.prewarm_remaining = min(count, self.capacity) - len(self.widgets)
+        if self.prewarm_remaining > 0:
+            QTimer.singleShot(0, self.prewarm_batch)
+    
+    # 先に作っておくウィジェットを少しずつ作るメソッド
+    def prewarm_batch(self):
+        count = min(self.prewarm_remaining, STARTUP_BATCH_SIZE, self.capacity - len(self.widgets))
+        for _ in range(count):
+            self.widgets.append(MascotWidget(self.app, pooled=True))
+        self.prewarm_remaining -= max(0, count)
+        if self.prewarm_remaining > 0 and count > 0:
+            QTimer.singleShot(0, self.prewarm_batch)
+    
+    # パフォーマンス統計用の状態を返すメソッド
+    def stats(self):
+        requests = self.hit_count + self.miss_count
+        return {
+            "pooled": len(self.widgets),
+            "capacity": self.capacity,
+            "hits": self.hit_count,
+            "misses": self.miss_count,
+            "hit_rate": round(self.hit_count / requests, 3) if requests else 0.0,
+            "returned": self.returned_count,
+            "discarded": self.discarded_count
+        }
+
+# 操作用サーバークラス（ローカルソケットで1行ずつJSONのリクエストを受け取り、1行のJSONで応答する）
+# {"ops": [{"op": "spawn", ...}, ...]} のようにまとめて送られた操作は1回のイベントループで続けて行い、
+# 設定の保存とメニューの更新は最後に一度だけ行う
+class ControlServer(QObject):
+    def __init__(self, app, name=None):
+        super().__init__(app)
+        self.app = app
+        self.name = name or control_server_name()
+        self.buffers = {}  # 接続 -> まだ1行になっていない受信データ
+        self.server = None  # QLocalServer（起動を速くするため受け付けを始めるときに作る）
+        
+        # 操作の名前 -> 処理するメソッド
+        self.handlers = {
+            "list_images": self.op_list_images,
+            "list_mascots": self.op_list_mascots,
+            "add_image": self.op_add_image,
+            "spawn": self.op_spawn,
+            "move": self.op_move,
+            "set_image": self.op_set_image,
+            "set_scale": self.op_set_scale,
+            "remove": self.op_remove,
+            "remove_all": self.op_remove_all,
+            "set_topmost": self.op_set_topmost,
+            "set_behavior": self.op_set_behavior,
+            "set_click_through": self.op_set_click_through,
+            "snapshot": self.op_snapshot,
+            "restore": self.op_restore,
+            "open_args": self.op_open_args,
+            "list_scenes": self.op_list_scenes,
+            "save_scene": self.op_save_scene,
+            "switch_scene": self.op_switch_scene,
+            "delete_scene": self.op_delete_scene
+        }
+    
+    # 接続の受け付けを開始するメソッド
+    def start(self):
+        from PyQt5.QtNetwork import QLocalServer
+        if self.server is None:
+            self.server = QLocalServer(self)
+            self.server.setSocketOptions(QLocalServer.UserAccessOption)  # 同じユーザーだけが接続できる
+            self.server.newConnection.connect(self.on_new_connection)
+        
+        if self.server.listen(self.name):
+            return True
+        
+        # 前回異常終了したときのソケットが残っていれば消してからもう一度試す
+        QLocalServer.removeServer(self.name)
+        if self.server.listen(self.name):
+            return True
+        print(f"操作用サーバーの開始エラー: {self.server.errorString()}")
+        return False
+    
+    # 接続の受け付けを終了するメソッド
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for socket in list(self.buffers):
+            socket.abort()
+        self.buffers.clear()
+    
+    # 新しい接続があったときに呼ばれるメソッド
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.buffers[socket] = bytearray()
+            socket.readyRead.connect(lambda s=socket: self.on_ready_read(s))
+            socket.disconnected.connect(lambda s=socket: self.on_disconnected(s))
+    
+    # 接続が切れたときに呼ばれるメソッド
+    def on_disconnected(self, socket):
+        self.buffers.pop(socket, None)
+        socket.deleteLater()
+    
+    # データを受信したときに呼ばれるメソッド（1行ごとに処理して応答する）
+    def on_ready_read(self, socket):
+        buffer = self.buffers.get(socket)
+        if buffer is None:
+            return
+        buffer += bytes(socket.readAll())
+        
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = bytes(buffer[:newline])
+            del buffer[:newline + 1]
+            if line.strip():
+                self.send(socket, self.handle_line(line))
+        
+        # 改行のない大きすぎるデータは受け付けない
+        if len(buffer) > CONTROL_MAX_REQUEST_BYTES:
+            self.send(socket, {"ok": False, "error": "リクエストが大きすぎます"})
+            buffer.clear()
+            socket.disconnectFromServer()
+    
+    # 応答を送るメソッド
+    def send(self, socket, response):
+        socket.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+        socket.flush()
+    
+    # 1行のリクエストを処理して応答を返すメソッド
+    def handle_line(self, line):
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            return {"ok": False, "error": f"JSONとして読めません: {e}"}
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "リクエストはJSONのオブジェクトにしてください"}
+        
+        # opsがなければリクエスト自体を1つの操作として扱う
+        ops = request.get("ops", [request])
+        if not isinstance(ops, list):
+            return {"ok": False, "error": "opsは配列にしてください"}
+        
+        results = self.execute(ops)
+        response = {"ok": all(result["ok"] for result in results), "results": results}
+        if "id" in request:
+            response["id"] = request["id"]
+        return response
+    
+    # 操作をまとめて行うメソッド（保存とメニューの更新は最後に一度だけ）
+    def execute(self, ops):
+        results = []
+        with self.app.perf_metrics.measure("control_batch"), self.app.batch_update():
+            # マスコットIDからすぐに引けるようにしておく（このバッチで作ったものも加える）
+            mascots = {mascot.mascot_id: mascot for mascot in self.app.mascot_widgets}
+            for op in ops:
+                try:
+                    if not isinstance(op, dict):
+                        raise ValueError("操作はJSONのオブジェクトにしてください")
+                    handler = self.handlers.get(op.get("op"))
+                    if handler is None:
+                        raise ValueError(f"不明な操作です: {op.get('op')}")
+                    result = {"ok": True}
+                    value = handler(op, mascots)
+                    if value is not None:
+                        result["result"] = value
+                except Exception as e:
+                    result = {"ok": False, "error": str(e)}
+                results.append(result)
+        return results
+    
+    # 操作で指定された数値を確かめて返すメソッド（数値でないか範囲外ならエラーにする）
+    def number_field(self, op, key, default, minimum, maximum, integer=False):
+        value = op.get(key, default)
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{key}は数値にしてください: {value!r}")
+        if not minimum <= value <= maximum:
+            raise ValueError(f"{key}は{minimum}から{maximum}の範囲にしてください: {value!r}")
+        return int(value) if integer else float(value)
+    
+    # 操作で指定された表示倍率と最大サイズを返すメソッド（指定がなければdefaultを返す）
+    def size_fields(self, op, default_scale, default_max_size):
+        scale = self.number_field(op, "scale", default_scale, *CONTROL_SCALE_RANGE)
+        max_size = self.number_field(op, "max_size", default_max_size, 0, CONTROL_MAX_SIZE_LIMIT, integer=True)
+        return scale, max_size
+    
+    # 操作で指定された位置を返すメソッド（xとyの両方がなければNone）
+    def position_field(self, op):
+        if "x" not in op or "y" not in op:
+            return None
+        limit = CONTROL_COORDINATE_LIMIT
+        return QPoint(self.number_field(op, "x", 0, -limit, limit, integer=True),
+                      self.number_field(op, "y", 0, -limit, limit, integer=True))
+    
+    # 操作で指定されたマスコットを返すメソッド
+    def find_mascot(self, op, mascots):
+        mascot = mascots.get(op.get("mascot_id"))
+        if mascot is None or mascot not in self.app.mascot_widgets:
+            raise ValueError(f"マスコットが見つかりません: {op.get('mascot_id')}")
+        return mascot
+    
+    # 操作で指定された画像を返すメソッド（パスで指定された未登録の画像は登録する）
+    def find_image(self, op):
+        if "image_id" in op:
+            image_info = self.app.image_registry.get(op["image_id"])
+            if image_info is None:
+                raise ValueError(f"画像が見つかりません: {op['image_id']}")
+            return image_info
+        if "path" in op:
+            return self.op_add_image(op, None, as_info=True)
+        raise ValueError("image_idかpathを指定してください")
+    
+    # マスコットの情報を返すメソッド
+    def mascot_state(self, mascot):
+        return {
+            "mascot_id": mascot.mascot_id,
+            "image_id": mascot.image_info["id"] if mascot.image_info else None,
+            "x": mascot.x(),
+            "y": mascot.y(),
+            "width": mascot.width(),
+            "height": mascot.height(),
+            "scale": mascot.scale,
+            "max_size": mascot.max_size
+        }
+    
+    def op_list_images(self, op, mascots):
+        return [{"image_id": image_info["id"], "name": image_info["name"], "path": image_info["path"]}
+                for image_info in self.app.image_registry]
+    
+    def op_list_mascots(self, op, mascots):
+        return [self.mascot_state(mascot) for mascot in self.app.mascot_widgets]
+    
+    def op_add_image(self, op, mascots, as_info=False):
+        path = os.path.abspath(op["path"])
+        if not os.path.isfile(path):
+            raise ValueError(f"ファイルが見つかりません: {path}")
+        
+        image_info = self.app.register_image(path, op.get("name"))
+        return image_info if as_info else {"image_id": image_info["id"]}
+    
+    def op_open_args(self, op, mascots):
+        return {"opened": self.app.handle_arguments(op.get("args", []), op.get("cwd"))}
+    
+    def op_spawn(self, op, mascots):
+        scale, max_size = self.size_fields(op, 1.0, 0)
+        position = self.position_field(op)
+        image_info = self.find_image(op)
+        mascot = self.app.create_mascot(image_info, position, scale, max_size)
+        mascots[mascot.mascot_id] = mascot
+        return {"mascot_id": mascot.mascot_id}
+    
+    def op_move(self, op, mascots):
+        mascot = self.find_mascot(op, mascots)
+        position = self.position_field(op)
+        if position is None:
+            raise ValueError("xとyを指定してください")
+        mascot.move(position)
+        self.app.mascot_moved(mascot)
+    
+    def op_set_image(self, op, mascots):
+        self.app.set_mascot_image(self.find_mascot(op, mascots), self.find_image(op))
+    
+    def op_set_scale(self, op, mascots):
+        mascot = self.find_mascot(op, mascots)
+        scale, max_size = self.size_fields(op, None, None)
+        self.app.set_mascot_scale(mascot, scale, max_size)
+    
+    def op_remove(self, op, mascots):
+        mascot = self.find_mascot(op, mascots)
+        del mascots[mascot.mascot_id]
+        self.app.remove_mascot(mascot)
+    
+    def op_remove_all(self, op, mascots):
+        mascots.clear()
+        self.app.remove_all_mascots()
+    
+    def op_set_topmost(self, op, mascots):
+        if bool(op.get("value", True)) != self.app.is_topmost:
+            self.app.toggle_topmost()
+    
+    def op_set_behavior(self, op, mascots):
+        if not BehaviorEngine.available():
+            raise ValueError("自動移動にはNumPyが必要です")
+        if bool(op.get("value", True)) != self.app.behavior_enabled:
+            self.app.toggle_behavior()
+    
+    def op_set_click_through(self, op, mascots):
+        if bool(op.get("value", True)) != self.app.click_through:
+            self.app.toggle_click_through()
+    
+    def op_snapshot(self, op, mascots):
+        return self.app.layout_snapshot()
+    
+    def op_restore(self, op, mascots):
+        layout = op.get("layout")
+        if not isinstance(layout, list):
+            raise ValueError("layoutは配列にしてください")
+        for mascot_info in layout:
+            if not isinstance(mascot_info, dict):
+                raise ValueError("layoutの要素はJSONのオブジェクトにしてください")
+            self.size_fields(mascot_info, 1.0, 0)
+            position = mascot_info.get("position")
+            if position is not None:
+                if not isinstance(position, dict):
+                    raise ValueError("positionはJSONのオブジェクトにしてください")
+                self.position_field(dict({"x": 0, "y": 0}, **position))
+        ordered, stats = self.app.apply_layout(layout)
+        mascots.clear()
+        mascots.update((mascot.mascot_id, mascot) for mascot in self.app.mascot_widgets)
+        return dict(stats, mascot_ids=[mascot.mascot_id for mascot in ordered])
+    
+    def op_list_scenes(self, op, mascots):
+        return {"scenes": {name: len(layout) for name, layout in self.app.scenes.items()},
+                "current_scene": self.app.current_scene}
+    
+    def op_save_scene(self, op, mascots):
+        self.app.save_scene(str(op["name"]))
+    
+    def op_switch_scene(self, op, mascots):
+        stats = self.app.switch_scene(op.get("name"))
+        if stats is None:
+            raise ValueError(f"シーンが見つかりません: {op.get('name')}")
+        mascots.clear()
+        mascots.update((mascot.mascot_id, mascot) for mascot in self.app.mascot_widgets)
+        return stats
+    
+    def op_delete_scene(self, op, mascots):
+        if op.get("name") not in self.app.scenes:
+            raise ValueError(f"シーンが見つかりません: {op.get('name')}")
+        self.app.delete_scene(op["name"])
+
+# 起動時間の計測クラス（起動の段階ごとにかかった時間を記録する）
+class StartupProfiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled  # Trueなら起動が終わったときに内訳を表示する
+        self.stages = []  # (段階の名前, 開始, 終了)（PROCESS_START_TIMEからの秒数）
+        self.counts = {}  # 段階の名前 -> 実行回数（何回かに分けて行う段階）
+    
+    # 段階の時間を記録するメソッド
+    def add(self, name, start, end):
+        self.stages.append((name, start - PROCESS_START_TIME, end - PROCESS_START_TIME))
+        self.counts[name] = self.counts.get(name, 0) + 1
+    
+    # withブロックの時間を段階として記録するメソッド
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+    
+    # 段階ごとの内訳を返すメソッド（同じ名前の段階はまとめる）
+    def summary(self):
+        totals = OrderedDict()
+        for name, start, end in self.stages:
+            first, total = totals.get(name, (start, 0.0))
+            totals[name] = (min(first, start), total + end - start)
+        return [{
+            "stage": name,
+            "start_ms": round(first * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+            "count": self.counts[name]
+        } for name, (first, total) in totals.items()]
+    
+    # 内訳を表示するメソッド
+    def report(self):
+        if not self.enabled:
+            return
+        print("起動時間の内訳:")
+        for item in self.summary():
+            repeat = f" ({item['count']}回)" if item["count"] > 1 else ""
+            print(f"  {item['stage']:<16} 開始 {item['start_ms']:8.1f}ms  所要 {item['total_ms']:8.1f}ms{repeat}")
+        print(f"  起動完了まで {(time.perf_counter() - PROCESS_START_TIME) * 1000:.1f}ms")
+
 # マスコットアプリのクラスを定義
 class MascotApp(QWidget):
-    def __init__(self):
+    def __init__(self, profiler=None):
         super().__init__()
         
+        # 起動の段階ごとの時間（--profile-startupのときだけ表示する）
+        self.profiler = profiler if profiler is not None else StartupProfiler()
+        self.profiler.add("imports", PROCESS_START_TIME, time.perf_counter())
+        self.startup_finished = False
+        self.pending_mascots = []  # 起動時にまだ作っていないマスコットの情報（優先順）
+        
+        # まとめて操作している間は保存とメニューの更新を最後に一度だけ行う
+        self.batch_depth = 0
+        self.config_writable = True  # 設定ファイルを読めなかったときは、読めるまで上書きしないようにFalseにする
+        self.batch_save_requested = False
+        self.batch_menu_requested = False
+        self.batch_behavior_requested = False
+        paths_start = time.perf_counter()
+        
         # メインウィンドウを非表示にする
         self.setWindowFlags(Qt.Tool)
         self.hide()
@@ -172,6 +4571,9 @@ class MascotApp(QWidget):
         except:
             # 何らかのエラーが発生した場合はスクリプトと同じ場所に保存
             self.config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mascot_config.json")
+        
+        # データディレクトリ（ディスクキャッシュなどを置く）
+        self.app_data_dir = os.path.dirname(self.config_file)
             
         # アイコンファイルのパスも同様に修正
         try:
@@ -181,107 +4583,601 @@ class MascotApp(QWidget):
                 self.icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icon.ico")
         except:
             self.icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icon.ico")
+        self.profiler.add("paths", paths_start, time.perf_counter())
+        config_start = time.perf_counter()
+        
+        # 画像リストの管理
+        self.image_registry = ImageRegistry()  # ID、パス、名前、GIFかどうかを保存
+        self.mascot_widgets = {}  # 表示中のマスコットウィジェットを管理（表示順）
+        self.z_orders = itertools.count()  # マスコットに割り当てる表示順
+        
+        # 前面表示の設定
+        self.is_topmost = True
+        
+        # フレームキャッシュの上限（MB）
+        self.frame_cache_mb = DEFAULT_FRAME_CACHE_MB
+        
+        # アニメーションの最大フレームレート
+        self.max_fps = DEFAULT_MAX_FPS
+        
+        # ディスクキャッシュの上限（MB、0で無効）
+        self.disk_cache_mb = DEFAULT_DISK_CACHE_MB
+        
+        # ドラッグ時に画面の端・ほかのマスコットに吸着させるかどうか
+        self.snap_to_edges = False
+        self.snap_to_mascots = False
+        
+        # マスコットが自動で歩く・落ちるかどうか
+        self.behavior_enabled = False
+        
+        # マスコットの透明な部分のクリックを下のウィンドウに通すかどうか
+        # （ウィンドウの形を切り抜くので、半透明の縁は描かれなくなる）
+        self.click_through = False
+        
+        # 描画方法（"window": マスコットごとのウィンドウ、"overlay": 画面ごとにまとめて描画）
+        self.render_mode = "window"
+        
+        # パフォーマンス統計を書き出す間隔（秒、0で書き出さない）
+        self.metrics_export_interval = 0
+        
+        # 削除したウィジェットを使い回す数と、起動時に先に作っておく数（0で作らない）
+        self.widget_pool_size = DEFAULT_WIDGET_POOL_SIZE
+        self.widget_pool_prewarm = 0
+        
+        # 名前を付けて保存したマスコットの配置（シーン名 -> 配置）と、最後に切り替えたシーン
+        self.scenes = {}
+        self.current_scene = None
+        
+        # 設定を読み込む
+        self.load_config()
+        self.profiler.add("config", config_start, time.perf_counter())
+        core_start = time.perf_counter()
+        
+        # パフォーマンス統計（~/.mascot_app/metricsに書き出す）
+        self.perf_metrics = PerfMetrics(self, os.path.join(self.app_data_dir, "metrics"),
+                                        self.metrics_export_interval)
+        
+        # デコード済みフレームを全マスコットで共有するストア（ディスクキャッシュから先に読む）
+        self.disk_cache = DiskFrameCache(os.path.join(self.app_data_dir, "frame_cache"), self.disk_cache_mb)
+        self.frame_store = FrameStore(self.frame_cache_mb, self, self.disk_cache, self.perf_metrics)
+        
+        # 全マスコットのGIFを1つのタイマーで進めるスケジューラ
+        self.animation_scheduler = AnimationScheduler(self, self.max_fps)
+        
+        # 画面外・隠れている・全画面アプリの裏にあるマスコットのアニメーションを止めるクラス
+        self.visibility_manager = VisibilityManager(self)
+        
+        # ドラッグの移動をまとめて吸着させるクラスと、吸着先を探す空間インデックス
+        self.spatial_index = SpatialIndex()
+        self.drag_controller = DragController(self)
         
-        # 画像リストの管理
-        self.image_list = []  # パス、名前、GIFかどうかを保存
-        self.mascot_widgets = []  # 表示中のマスコットウィジェットを管理
+        # 全マスコットの自動移動をまとめて計算するクラス
+        self.behavior_engine = BehaviorEngine(self)
+        self.behavior_engine.set_enabled(self.behavior_enabled)
         
-        # 前面表示の設定
-        self.is_topmost = True
+        # オーバーレイ表示で全マスコットをまとめて描画するクラス
+        self.compositor = OverlayCompositor(self)
+        self.compositor.set_enabled(self.render_mode == "overlay")
         
-        # 設定を読み込む
-        self.load_config()
+        # 削除したマスコットのウィジェットを使い回すプール
+        self.widget_pool = MascotWidgetPool(self, self.widget_pool_size)
+        
+        # 画像をまとめて調べて追加するクラスと、GIFをスプライトシートに変換するクラス
+        self.image_importer = ImageImporter(self)
+        self.sprite_sheet_converter = SpriteSheetConverter(self, os.path.join(self.app_data_dir, "sprite_sheets"))
+        
+        # マスコットの右クリックメニュー（全マスコットで共有、最初に右クリックされたときに作る）
+        self.thumbnail_cache = None
+        self.mascot_menu = None
+        
+        # 設定の保存をまとめて行うクラス
+        self.config_saver = ConfigSaver(self.config_file, self.build_config, parent=self,
+                                        metrics=self.perf_metrics)
+        self.config_saver.save_failed.connect(self.config_save_failed)
+        QApplication.instance().aboutToQuit.connect(self.config_saver.close)
         
-        # システムトレイアイコンの設定
-        self.setup_system_tray()
+        # 設定ファイルを読めなかったときは、読めるまで間隔を空けながら読み直す
+        self.config_read_failure_count = 0
+        self.config_read_timer = QTimer(self)
+        self.config_read_timer.setSingleShot(True)
+        self.config_read_timer.timeout.connect(self.retry_config_read)
+        if not self.config_writable:
+            self.schedule_config_read_retry()
         
-        # 前回の画像で起動
+        # スクリプトから操作するためのローカルサーバー（受け付けはイベントループが回り始めてから）
+        self.control_server = ControlServer(self)
+        self.profiler.add("core", core_start, time.perf_counter())
+        
+        # システムトレイアイコンの設定（最初は最小限のメニューで、すぐに表示する）
+        with self.profiler.stage("tray_icon"):
+            self.setup_system_tray()
+        if not self.config_writable:
+            self.tray_icon.showMessage("設定ファイルを読み込めません",
+                                       "ほかのプロセスが使用中です。読み込めるまで設定は保存せずに再試行します。",
+                                       QSystemTrayIcon.Warning, 5000)
+        
+        # 前回の画像で起動（メニューの残りとマスコットはイベントループが回り始めてから作る）
         self.load_last_mascots()
+        self.startup_scheduled = time.perf_counter()
+        QTimer.singleShot(0, self.continue_startup)
+    
+    # 起動の続きを行うメソッド（イベントループの最初の回で呼ばれる）
+    def continue_startup(self):
+        self.profiler.add("event_loop", self.startup_scheduled, time.perf_counter())
+        with self.profiler.stage("tray_menu"):
+            self.tray_menu_model.build()
+        with self.profiler.stage("control_server"):
+            self.control_server.start()
+        self.create_pending_mascots()
+    
+    # 起動時のマスコットを少しずつ作るメソッド（1回のイベントループで作るのは一定数まで）
+    def create_pending_mascots(self):
+        if self.startup_finished:
+            return
+        
+        with self.profiler.stage("mascots"):
+            batch = self.pending_mascots[:STARTUP_BATCH_SIZE]
+            del self.pending_mascots[:STARTUP_BATCH_SIZE]
+            for mascot_info in batch:
+                self.create_saved_mascot(mascot_info)
+        
+        if self.pending_mascots:
+            QTimer.singleShot(0, self.create_pending_mascots)
+            return
+        
+        # 全部作り終わったらメニューを更新して、起動時間の内訳を表示する
+        self.update_tray_menu()
+        self.finish_startup()
+    
+    # 起動の完了を記録するメソッド
+    def finish_startup(self):
+        if self.startup_finished:
+            return
+        self.startup_finished = True
+        self.pending_mascots = []
+        self.profiler.report()
+        
+        # 次にマスコットを作るときのためにウィジェットを先に作っておく
+        if self.widget_pool_prewarm > 0:
+            self.widget_pool.prewarm(self.widget_pool_prewarm)
     
     # 設定を読み込むメソッド
     def load_config(self):
         if os.path.exists(self.config_file):
             try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    
-                    # 画像リストを読み込む
-                    if "image_list" in config:
-                        self.image_list = config["image_list"]
-                    
-                    # トップモスト設定を読み込む
-                    if "is_topmost" in config:
-                        self.is_topmost = config["is_topmost"]
-                    
-                    # 前回表示していたマスコット情報を読み込む
-                    self.last_mascots = config.get("last_mascots", [])
+                config = self.read_config_file()
+                
+                # 画像リストを読み込む（IDのない古い設定にはIDを振る）
+                image_ids, id_map = self.register_saved_images(config)
+                
+                # トップモスト設定を読み込む
+                if "is_topmost" in config:
+                    self.is_topmost = config["is_topmost"]
+                
+                # フレームキャッシュの上限を読み込む
+                if "frame_cache_mb" in config:
+                    self.frame_cache_mb = config["frame_cache_mb"]
+                
+                # 最大フレームレートを読み込む
+                if "max_fps" in config:
+                    self.max_fps = config["max_fps"]
+                
+                # ディスクキャッシュの上限を読み込む
+                if "disk_cache_mb" in config:
+                    self.disk_cache_mb = config["disk_cache_mb"]
+                
+                # 吸着の設定を読み込む
+                self.snap_to_edges = config.get("snap_to_edges", self.snap_to_edges)
+                self.behavior_enabled = config.get("behavior_enabled", self.behavior_enabled)
+                self.click_through = config.get("click_through_transparent", self.click_through)
+                self.snap_to_mascots = config.get("snap_to_mascots", self.snap_to_mascots)
+                
+                # 描画方法を読み込む
+                if config.get("render_mode") in ("window", "overlay"):
+                    self.render_mode = config["render_mode"]
+                
+                # パフォーマンス統計を書き出す間隔を読み込む
+                self.metrics_export_interval = config.get("metrics_export_interval", self.metrics_export_interval)
+                
+                # ウィジェットのプールの設定を読み込む
+                self.widget_pool_size = config.get("widget_pool_size", self.widget_pool_size)
+                self.widget_pool_prewarm = config.get("widget_pool_prewarm", self.widget_pool_prewarm)
+                
+                # シーンを読み込む
+                scenes = config.get("scenes", {})
+                if isinstance(scenes, dict):
+                    self.scenes = {name: layout for name, layout in scenes.items() if isinstance(layout, list)}
+                if config.get("current_scene") in self.scenes:
+                    self.current_scene = config["current_scene"]
+                
+                # 前回表示していたマスコット情報を読み込む（画像をインデックスで参照していた古い設定はIDに移行する）
+                self.last_mascots = self.map_saved_image_ids(config.get("last_mascots", []), image_ids, id_map)
+            except TimeoutError as e:
+                # ほかのプロセスが使っていて読めなかった場合は、前回の設定を空の配置で上書きしないように
+                # 読めるまで保存しない（起動後に読み直す）
+                print(f"設定ファイルの読み込みエラー（読み込めるまで設定は保存しません）: {e}")
+                self.config_writable = False
+                self.last_mascots = []
             except Exception as e:
                 print(f"設定ファイルの読み込みエラー: {e}")
                 self.last_mascots = []
         else:
             self.last_mascots = []
     
-    # 設定を保存するメソッド
+    # 設定ファイルを読み込むメソッド（ほかのプロセスが書き込み中で待ちきれなければTimeoutError）
+    def read_config_file(self):
+        with locked_file(self.config_file), open(self.config_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    # 設定の画像リストを登録するメソッド
+    # 戻り値は(設定の順番の画像ID, 設定のID -> 登録したID)（登録済みの画像と同じものはそのIDになる）
+    def register_saved_images(self, config):
+        image_ids = []
+        id_map = {}
+        for image_info in config.get("image_list", []):
+            saved_id = image_info.get("id")
+            image_id = self.image_registry.add(image_info)["id"]
+            image_ids.append(image_id)
+            if saved_id:
+                id_map[saved_id] = image_id
+        return image_ids, id_map
+    
+    # 保存されていたマスコット情報の画像を登録したIDで参照するように直すメソッド
+    def map_saved_image_ids(self, entries, image_ids, id_map):
+        for mascot_info in entries:
+            image_index = mascot_info.pop("image_index", None)
+            if "image_id" in mascot_info:
+                mascot_info["image_id"] = id_map.get(mascot_info["image_id"], mascot_info["image_id"])
+            elif image_index is not None and 0 <= image_index < len(image_ids):
+                mascot_info["image_id"] = image_ids[image_index]
+        return entries
+    
+    # 設定ファイルの読み直しを予約するメソッド（失敗するたびに間隔を倍にする）
+    def schedule_config_read_retry(self):
+        self.config_read_failure_count += 1
+        self.config_read_timer.start(min(CONFIG_RETRY_MAX_DELAY, CONFIG_SAVE_DELAY * 2 ** self.config_read_failure_count))
+    
+    # 起動時に読めなかった設定ファイルを読み直すメソッド
+    # 読めたら前回の画像・マスコット・シーンを今の状態に加えて、設定の保存を再開する（ほかの設定は今のまま）
+    def retry_config_read(self):
+        try:
+            config = self.read_config_file()
+        except TimeoutError:
+            self.schedule_config_read_retry()
+            return
+        except Exception as e:
+            print(f"設定ファイルの読み込みエラー: {e}")
+            config = {}
+        
+        with self.batch_update():
+            image_count = len(self.image_registry)
+            image_ids, id_map = self.register_saved_images(config)
+            if len(self.image_registry) != image_count:
+                self.tray_menu_model.images_added([self.image_registry.get(image_id) for image_id in image_ids])
+            
+            for mascot_info in self.map_saved_image_ids(config.get("last_mascots", []), image_ids, id_map):
+                mascot = self.create_saved_mascot(mascot_info)
+                if mascot is not None:
+                    self.tray_menu_model.mascot_added(mascot)
+            
+            scenes = config.get("scenes", {})
+            if isinstance(scenes, dict):
+                for name, layout in scenes.items():
+                    if isinstance(layout, list) and name not in self.scenes:
+                        self.scenes[name] = self.map_saved_image_ids(layout, image_ids, id_map)
+                self.tray_menu_model.scenes_changed()
+            
+            self.config_writable = True
+            self.save_config()
+        
+        print("設定ファイルを読み込めたので、設定の保存を再開します")
+        self.tray_icon.showMessage("設定ファイルを読み込みました", "設定の保存を再開します。", QSystemTrayIcon.Information, 3000)
+    
+    # 設定を保存するメソッド（実際の書き込みは少し待ってからまとめて行う）
     def save_config(self):
+        if not self.config_writable:
+            return
+        if self.batch_depth > 0:
+            self.batch_save_requested = True
+            return
+        self.config_saver.request_save()
+    
+    # まとめて操作するときに使うコンテキストマネージャ（保存とメニューの更新は最後に一度だけ）
+    @contextmanager
+    def batch_update(self):
+        self.batch_depth += 1
+        try:
+            yield
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                if self.batch_save_requested:
+                    self.batch_save_requested = False
+                    self.save_config()
+                if self.batch_menu_requested:
+                    self.batch_menu_requested = False
+                    self.update_tray_menu()
+                if self.batch_behavior_requested:
+                    self.batch_behavior_requested = False
+                    self.notify_mascots_changed()
+    
+    # マスコットが増減したことを自動移動に知らせるメソッド（まとめて操作している間は最後に一度だけ）
+    def notify_mascots_changed(self):
+        if self.batch_depth > 0:
+            self.batch_behavior_requested = True
+            return
+        self.behavior_engine.mascots_changed()
+    
+    # 保存する設定の辞書を作るメソッド
+    def build_config(self):
         config = {
-            "image_list": self.image_list,
+            "config_version": CONFIG_VERSION,
+            "image_list": self.image_registry.to_list(),
             "is_topmost": self.is_topmost,
+            "frame_cache_mb": self.frame_cache_mb,
+            "max_fps": self.max_fps,
+            "disk_cache_mb": self.disk_cache_mb,
+            "render_mode": self.render_mode,
+            "snap_to_edges": self.snap_to_edges,
+            "behavior_enabled": self.behavior_enabled,
+            "click_through_transparent": self.click_through,
+            "snap_to_mascots": self.snap_to_mascots,
+            "metrics_export_interval": self.metrics_export_interval,
+            "widget_pool_size": self.widget_pool_size,
+            "widget_pool_prewarm": self.widget_pool_prewarm,
+            "scenes": self.scenes,
+            "current_scene": self.current_scene,
             "last_mascots": []
         }
         
         # 現在表示中のマスコット情報を保存
+        config["last_mascots"] = self.layout_snapshot()
+        
+        return config
+    
+    # 表示中のマスコットの配置を返すメソッド（設定の保存と、操作用サーバーのsnapshotで使う）
+    def layout_snapshot(self):
+        layout = []
         for mascot in self.mascot_widgets:
-            if mascot.image_info:
-                # 画像インデックスを保存
-                image_index = None
-                for i, img in enumerate(self.image_list):
-                    if img["path"] == mascot.image_info["path"]:
-                        image_index = i
-                        break
+            if self.image_registry.contains(mascot.image_info):
+                # 画像IDとマスコットの位置を保存
+                layout.append({
+                    "image_id": mascot.image_info["id"],
+                    "position": {
+                        "x": mascot.pos().x(),
+                        "y": mascot.pos().y()
+                    },
+                    "size": {
+                        "width": mascot.width(),
+                        "height": mascot.height()
+                    },
+                    "scale": mascot.scale,
+                    "max_size": mascot.max_size
+                })
+        
+        # 起動中でまだ作っていないマスコットもそのまま残す
+        for mascot_info in self.pending_mascots:
+            if self.image_registry.get(mascot_info.get("image_id")) is not None:
+                layout.append(mascot_info)
+        return layout
+    
+    # 配置を反映するメソッド（今のマスコットとの差分だけを作成・削除・移動する）
+    # 画像と大きさが同じマスコットはそのまま使い（デコード済みのフレームも使い回される）、
+    # 余ったマスコットは画像を切り替えて使う。配置の順番どおりのマスコットと、変更の件数を返す
+    def apply_layout(self, layout):
+        stats = {"reused": 0, "moved": 0, "changed": 0, "created": 0, "removed": 0}
+        
+        # 反映する配置（画像が削除されていれば飛ばす）
+        targets = []
+        for mascot_info in layout:
+            image_info = self.image_registry.get(mascot_info.get("image_id"))
+            if image_info is None:
+                continue
+            position = mascot_info.get("position") or {}
+            targets.append((image_info, mascot_info.get("scale", 1.0), mascot_info.get("max_size", 0),
+                            QPoint(position.get("x", 0), position.get("y", 0)) if position else None))
+        
+        # 今のマスコットを画像と大きさで分けておく（位置も同じものを先に使う）
+        by_key = {}
+        by_place = {}
+        for mascot in self.mascot_widgets:
+            key = (mascot.image_info["id"] if mascot.image_info else None, mascot.scale, mascot.max_size)
+            by_key.setdefault(key, {})[mascot] = True
+            by_place.setdefault((key, mascot.x(), mascot.y()), []).append(mascot)
+        
+        assigned = [None] * len(targets)
+        
+        # 1回目: 画像・大きさ・位置がすべて同じマスコット
+        for index, (image_info, scale, max_size, position) in enumerate(targets):
+            if position is None:
+                continue
+            key = (image_info["id"], scale, max_size)
+            candidates = by_place.get((key, position.x(), position.y()))
+            while candidates:
+                mascot = candidates.pop()
+                if mascot in by_key[key]:
+                    del by_key[key][mascot]
+                    assigned[index] = mascot
+                    break
+        
+        # 2回目: 画像と大きさが同じマスコット（移動だけで済む）
+        for index, (image_info, scale, max_size, position) in enumerate(targets):
+            group = by_key.get((image_info["id"], scale, max_size))
+            if assigned[index] is None and group:
+                mascot = next(iter(group))
+                del group[mascot]
+                assigned[index] = mascot
+        
+        leftovers = [mascot for group in by_key.values() for mascot in group]
+        ordered = []
+        with self.batch_update():
+            # 起動中でまだ作っていないマスコットは作らずに置き換える
+            self.pending_mascots = []
+            
+            for index, (image_info, scale, max_size, position) in enumerate(targets):
+                mascot = assigned[index]
+                if mascot is None and leftovers:
+                    # 3回目: 余ったマスコットの画像と大きさを切り替えて使う
+                    mascot = leftovers.pop()
+                    if mascot.image_info is image_info:
+                        self.set_mascot_scale(mascot, scale, max_size)
+                    else:
+                        mascot.scale = scale
+                        mascot.max_size = max_size
+                        self.set_mascot_image(mascot, image_info)
+                    stats["changed"] += 1
+                elif mascot is None:
+                    mascot = self.create_mascot(image_info, position, scale, max_size)
+                    stats["created"] += 1
+                else:
+                    stats["reused"] += 1
                 
-                if image_index is not None:
-                    # 画像インデックスとマスコットの位置を保存
-                    config["last_mascots"].append({
-                        "image_index": image_index,
-                        "position": {
-                            "x": mascot.pos().x(),
-                            "y": mascot.pos().y()
-                        }
-                    })
+                if position is not None and mascot.pos() != position:
+                    mascot.move(position)
+                    self.mascot_moved(mascot)
+                    stats["moved"] += 1
+                ordered.append(mascot)
+            
+            # 使わなかったマスコットを削除する
+            for mascot in leftovers:
+                self.remove_mascot(mascot)
+                stats["removed"] += 1
+            
+            # 表示順（保存される順番）を配置に合わせる
+            self.mascot_widgets = {mascot: True for mascot in ordered if mascot in self.mascot_widgets}
+            for mascot in self.mascot_widgets:
+                mascot.z_order = next(self.z_orders)
+        return ordered, stats
+    
+    # 今の配置をシーンとして保存するメソッド
+    def save_scene(self, name):
+        self.scenes[name] = self.layout_snapshot()
+        self.current_scene = name
+        self.save_config()
+        self.tray_menu_model.scenes_changed()
+    
+    # シーンを切り替えるメソッド
+    def switch_scene(self, name):
+        layout = self.scenes.get(name)
+        if layout is None:
+            return None
         
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"設定ファイルの保存エラー: {e}")
+        with self.perf_metrics.measure("scene_switch"):
+            _, stats = self.apply_layout(layout)
+        self.current_scene = name
+        self.save_config()
+        self.tray_menu_model.scenes_changed()
+        return stats
+    
+    # シーンを削除するメソッド
+    def delete_scene(self, name):
+        if self.scenes.pop(name, None) is None:
+            return
+        if self.current_scene == name:
+            self.current_scene = None
+        self.save_config()
+        self.tray_menu_model.scenes_changed()
+    
+    # 名前を入力してシーンを保存するメソッド（トレイメニューから使う）
+    def ask_save_scene(self):
+        name, ok = QInputDialog.getText(
+            self, "シーンを保存", "シーンの名前を入力してください:",
+            text=self.current_scene or f"シーン{len(self.scenes) + 1}"
+        )
+        name = name.strip()
+        if not ok or not name:
+            return
+        
+        if name in self.scenes and name != self.current_scene:
+            reply = QMessageBox.question(
+                self, "シーンを保存", f"「{name}」を今の配置で上書きしますか？",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+            if reply != QMessageBox.Yes:
+                return
+        self.save_scene(name)
+    
+    # 画像のファイルを登録するメソッド（登録済みならその画像情報を返す）
+    def register_image(self, path, name=None):
+        image_info = self.image_registry.find_by_path(path)
+        if image_info is None:
+            image_info = self.image_registry.add({
+                "path": path,
+                "name": name or os.path.basename(path),
+                "is_gif": is_animated_image(path)
+            })
+            self.tray_menu_model.image_added(image_info)
+            self.save_config()
+        return image_info
+    
+    # 起動時の引数を処理するメソッド（画像のファイルが渡されたら登録して表示する、表示した数を返す）
+    # 2つ目の起動で渡された引数もここで処理する（notifyがTrueなら画像がなくても起動中であることを知らせる）
+    def handle_arguments(self, args, cwd=None, notify=True):
+        opened = 0
+        with self.batch_update():
+            for arg in args:
+                if arg.startswith("--"):
+                    continue
+                path = os.path.abspath(os.path.join(cwd or os.getcwd(), arg))
+                if not os.path.isfile(path) or not is_image_file(path):
+                    print(f"画像ではない引数を無視しました: {arg}")
+                    continue
+                self.create_mascot(self.register_image(path))
+                opened += 1
+        
+        if opened == 0 and notify:
+            self.tray_icon.showMessage("マスコットアプリ", "マスコットアプリはすでに起動しています。",
+                                       QSystemTrayIcon.Information, 3000)
+        return opened
     
     # 前回のマスコットを読み込むメソッド
     def load_last_mascots(self):
-        if hasattr(self, 'last_mascots') and self.last_mascots and self.image_list:
-            for mascot_info in self.last_mascots:
-                image_index = mascot_info.get("image_index")
-                position = mascot_info.get("position")
-                
-                if image_index is not None and image_index < len(self.image_list):
-                    # マスコットを作成
-                    image_info = self.image_list[image_index]
-                    mascot = MascotWidget(self, image_info)
-                    mascot.set_topmost(self.is_topmost)
-                    
-                    # 保存された位置に移動
-                    if position:
-                        mascot.move(position.get("x", 0), position.get("y", 0))
-                    
-                    self.mascot_widgets.append(mascot)
-            
-            # メニューを更新
-            self.update_tray_menu()
+        if hasattr(self, 'last_mascots') and self.last_mascots and len(self.image_registry) > 0:
+            # 見えている画面（メインの画面、ほかの画面、画面外の順）のマスコットから作る
+            self.pending_mascots = sorted(self.last_mascots, key=self.startup_priority)
+    
+    # 起動時にマスコットを作る順番を返すメソッド（小さいほど先に作る）
+    def startup_priority(self, mascot_info):
+        position = mascot_info.get("position") or {}
+        size = mascot_info.get("size") or {}
+        center = QPoint(position.get("x", 0) + size.get("width", 0) // 2,
+                        position.get("y", 0) + size.get("height", 0) // 2)
+        screen = QApplication.screenAt(center)
+        if screen is None:
+            return 2
+        return 0 if screen is QApplication.primaryScreen() else 1
+    
+    # 保存されていたマスコットを1体作るメソッド
+    def create_saved_mascot(self, mascot_info):
+        image_info = self.image_registry.get(mascot_info.get("image_id"))
+        if image_info is None:
+            return None
+        
+        position = mascot_info.get("position")
+        size = mascot_info.get("size")
+        
+        # マスコットを保存された位置に作成（画像のデコードはバックグラウンドで行う）
+        placeholder_size = QSize(size.get("width", 0), size.get("height", 0)) if size else None
+        mascot = self.widget_pool.acquire(image_info, placeholder_size,
+                                          mascot_info.get("scale", 1.0), mascot_info.get("max_size", 0),
+                                          QPoint(position.get("x", 0), position.get("y", 0)) if position else None)
+        mascot.set_topmost(self.is_topmost)
+        
+        self.mascot_widgets[mascot] = True
+        mascot.z_order = next(self.z_orders)
+        self.image_registry.attach(mascot, image_info)
+        self.spatial_index.insert(mascot)
+        self.notify_mascots_changed()
+        return mascot
     
     # 画像を追加するメソッド
     def add_images(self):
-        file_paths, _ = QFileDialog.getOpenFileNames(
-            self, "画像を選択", "", "画像ファイル (*.png *.jpg *.jpeg *.bmp *.gif)"
-        )
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "画像を選択", "", IMAGE_FILE_FILTER)
+        
+        # 複数選択された場合はまとめて調べて追加する
+        if len(file_paths) > 1:
+            self.image_importer.start(file_paths)
+            return
         
         if file_paths:  # ファイルが選択された場合
             for file_path in file_paths:
@@ -298,18 +5194,13 @@ class MascotApp(QWidget):
                 if not image_name:  # 名前が空の場合
                     image_name = file_name
                 
-                # ファイル拡張子を取得
-                _, ext = os.path.splitext(file_path)
-                is_gif = ext.lower() == ".gif"
-                
-                # 画像リストに追加
-                image_info = {
+                # 画像リストに追加（同じファイルが登録済みならそれを使う、スプライトシートもアニメーションとして扱う）
+                image_info = self.image_registry.add({
                     "path": file_path,
                     "name": image_name,
-                    "is_gif": is_gif
-                }
-                
-                self.image_list.append(image_info)
+                    "is_gif": is_animated_image(file_path)
+                })
+                self.tray_menu_model.image_added(image_info)
                 
                 # マスコットを表示するか尋ねる
                 reply = QMessageBox.question(
@@ -327,98 +5218,257 @@ class MascotApp(QWidget):
             # システムトレイメニューを更新
             self.update_tray_menu()
     
+    # フォルダ内の画像をまとめて追加するメソッド
+    def add_image_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "画像のフォルダを選択")
+        if not folder:
+            return
+        
+        try:
+            file_paths = sorted(entry.path for entry in os.scandir(folder)
+                                if entry.is_file() and is_image_file(entry.name))
+        except OSError as e:
+            print(f"フォルダの読み込みエラー: {e}")
+            file_paths = []
+        
+        if not file_paths:
+            QMessageBox.information(self, "画像の一括追加", "フォルダに画像が見つかりませんでした。")
+            return
+        
+        self.image_importer.start(file_paths)
+    
+    # 一括追加が終わったときに呼ばれるメソッド（保存とメニューの更新は一度だけ）
+    def images_imported(self, added, duplicates, failed):
+        if added:
+            self.tray_menu_model.images_added(added)
+            self.save_config()
+            self.update_tray_menu()
+        
+        # 結果をまとめて1つのダイアログで知らせる
+        lines = [f"追加: {len(added)}件", f"重複: {len(duplicates)}件", f"読み込めない: {len(failed)}件"]
+        for file_name, existing_name in duplicates[:IMPORT_SUMMARY_LIMIT]:
+            lines.append(f"・{file_name}（「{existing_name}」と同じ画像）")
+        for file_name, error in failed[:IMPORT_SUMMARY_LIMIT]:
+            lines.append(f"・{file_name}: {error}")
+        omitted = max(0, len(duplicates) - IMPORT_SUMMARY_LIMIT) + max(0, len(failed) - IMPORT_SUMMARY_LIMIT)
+        if omitted:
+            lines.append(f"ほか{omitted}件")
+        message = "\n".join(lines)
+        
+        if not added:
+            QMessageBox.information(self, "画像の一括追加", message)
+            return
+        
+        reply = QMessageBox.question(
+            self, "画像の一括追加",
+            message + f"\n\n追加した{len(added)}件の画像をすぐに表示しますか？",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        if reply == QMessageBox.Yes:
+            for image_info in added:
+                self.create_mascot(image_info)
+    
+    # 登録済みのGIFをスプライトシートに変換するメソッド
+    def convert_gifs_to_sprite_sheets(self):
+        if self.sprite_sheet_converter.is_running():
+            return
+        
+        targets = [image_info for image_info in self.image_registry
+                   if image_info.get("is_gif") and not is_sprite_sheet(image_info["path"])]
+        if not targets:
+            QMessageBox.information(self, "スプライトシートに変換", "変換するGIFがありません。")
+            return
+        
+        self.sprite_sheet_converter.start(targets)
+    
+    # スプライトシートへの変換が終わったときに呼ばれるメソッド
+    def sprite_sheets_converted(self, results):
+        converted = 0
+        errors = []
+        for image_id, json_path, error in results:
+            image_info = self.image_registry.get(image_id)
+            if image_info is None:
+                continue
+            if error:
+                errors.append(f"・{image_info['name']}: {error}")
+                continue
+            
+            # 画像IDはそのままで、表示中のマスコットもスプライトシートで読み込み直す
+            self.image_registry.set_path(image_id, json_path)
+            for mascot in self.image_registry.mascots_for(image_id):
+                mascot.set_image_info(image_info)
+            converted += 1
+        
+        if converted:
+            self.save_config()
+        
+        message = f"{converted}件のGIFをスプライトシートに変換しました。"
+        if errors:
+            message += "\n" + "\n".join(errors[:IMPORT_SUMMARY_LIMIT])
+        QMessageBox.information(self, "スプライトシートに変換", message)
+    
     # マスコットを作成するメソッド
-    def create_mascot(self, image_info):
-        mascot = MascotWidget(self, image_info)
-        mascot.set_topmost(self.is_topmost)
+    def create_mascot(self, image_info, position=None, scale=1.0, max_size=0):
+        # 位置の指定がなければ既存のマスコットから少しずらした位置に表示
+        if position is None and self.mascot_widgets:
+            last_mascot = next(reversed(self.mascot_widgets))
+            position = last_mascot.pos() + QPoint(20, 20)
         
-        # 新しいマスコットを既存のマスコットから少しずらした位置に表示
-        if self.mascot_widgets:
-            last_mascot = self.mascot_widgets[-1]
-            new_pos = last_mascot.pos() + QPoint(20, 20)
-            mascot.move(new_pos)
+        # 削除したマスコットのウィジェットが残っていれば使い回す
+        mascot = self.widget_pool.acquire(image_info, None, scale, max_size, position)
+        mascot.set_topmost(self.is_topmost)
         
-        self.mascot_widgets.append(mascot)
+        self.mascot_widgets[mascot] = True
+        mascot.z_order = next(self.z_orders)
+        self.image_registry.attach(mascot, image_info)
+        self.spatial_index.insert(mascot)
+        self.notify_mascots_changed()
         
         # 設定を保存
         self.save_config()
         
-        # メニューを更新
-        self.update_tray_menu()
+        # メニューを更新（追加したマスコットの項目だけ）
+        self.tray_menu_model.mascot_added(mascot)
+        return mascot
     
     # 選択したマスコットを削除するメソッド（修正）
     def remove_mascot(self, mascot):
         try:
             if mascot in self.mascot_widgets:
                 # リストから削除（先に行う）
-                self.mascot_widgets.remove(mascot)
+                del self.mascot_widgets[mascot]
+                self.image_registry.detach(mascot, mascot.image_info)
+                self.spatial_index.remove(mascot)
+                self.notify_mascots_changed()
                 
                 # リソースをクリーンアップしてから閉じる
                 mascot.cleanup_resources()
                 mascot.hide()  # いきなり閉じるのではなく、まず非表示に
                 
-                # イベントループの次のサイクルで削除するようスケジュール
-                mascot.deleteLater()
+                # プールに戻す（いっぱいならイベントループの次のサイクルで削除する）
+                self.widget_pool.release(mascot)
                 
                 # 設定を保存
                 self.save_config()
                 
-                # メニューを更新
-                self.update_tray_menu()
+                # メニューを更新（削除したマスコットの項目だけ）
+                self.tray_menu_model.mascot_removed(mascot)
         except Exception as e:
             print(f"マスコット削除エラー: {e}")
     
     # 全てのマスコットを削除（修正）
     def remove_all_mascots(self):
         try:
+            # 起動中でまだ作っていないマスコットも作らないようにする
+            self.pending_mascots = []
+            
             # すべてのマスコットのリストのコピーを作成
             mascots_to_remove = self.mascot_widgets.copy()
             
             # マスコットリストをクリア
             self.mascot_widgets.clear()
             
-            # 各マスコットを安全に削除
-            for mascot in mascots_to_remove:
-                mascot.cleanup_resources()
-                mascot.hide()  # 先に非表示にする
-                mascot.deleteLater()  # 次のイベントループで削除
-            
-            # 設定を保存
-            self.save_config()
-            
-            # メニューを更新
-            self.update_tray_menu()
-        except Exception as e:
-            print(f"全マスコット削除エラー: {e}")
-    
-    # 画像を削除するメソッド（修正）
-    def remove_image(self, index):
-        try:
-            if 0 <= index < len(self.image_list):
-                # 削除する画像情報
-                removed_image = self.image_list[index]
-                
-                # 画像リストから削除
-                del self.image_list[index]
-                
-                # この画像を使用しているマスコットを特定
-                mascots_to_remove = []
-                for mascot in self.mascot_widgets:
-                    if mascot.image_info == removed_image:
-                        mascots_to_remove.append(mascot)
-                
-                # 特定したマスコットを削除
+            # 各マスコットを安全に削除（設定の保存とメニューの更新は最後に一度だけ）
+            with self.batch_update():
                 for mascot in mascots_to_remove:
-                    self.remove_mascot(mascot)
+                    self.image_registry.detach(mascot, mascot.image_info)
+                    self.spatial_index.remove(mascot)
+                    self.tray_menu_model.mascot_removed(mascot)
+                    mascot.cleanup_resources()
+                    mascot.hide()  # 先に非表示にする
+                    self.widget_pool.release(mascot)  # プールに戻すか、次のイベントループで削除
+                self.notify_mascots_changed()
                 
                 # 設定を保存
                 self.save_config()
                 
                 # メニューを更新
                 self.update_tray_menu()
+        except Exception as e:
+            print(f"全マスコット削除エラー: {e}")
+    
+    # 画像を削除するメソッド（修正）
+    def remove_image(self, image_id):
+        try:
+            # 画像リストから削除し、この画像を使用しているマスコットを取得
+            removed_image, mascots_to_remove = self.image_registry.remove(image_id)
+            
+            if removed_image is not None:
+                # 特定したマスコットを削除（設定の保存とメニューの更新は最後に一度だけ）
+                with self.batch_update():
+                    for mascot in mascots_to_remove:
+                        self.remove_mascot(mascot)
+                    
+                    # 設定を保存
+                    self.save_config()
+                    
+                    # メニューを更新（削除した画像の項目だけ）
+                    self.tray_menu_model.image_removed(image_id)
         except Exception as e:
             print(f"画像削除エラー: {e}")
     
+    # マスコットの画像を切り替えるメソッド
+    def set_mascot_image(self, mascot, image_info):
+        if mascot not in self.mascot_widgets:
+            return
+        
+        self.image_registry.detach(mascot, mascot.image_info)
+        mascot.set_image_info(image_info)
+        self.image_registry.attach(mascot, image_info)
+        
+        # 設定を保存
+        self.save_config()
+        
+        # メニューを更新（このマスコットの表示名だけ）
+        self.tray_menu_model.mascot_changed(mascot)
+    
+    # ドラッグでマスコットが移動し終わったときに呼ばれるメソッド
+    def mascot_moved(self, mascot):
+        if mascot in self.mascot_widgets:
+            # 設定を保存（ドラッグ中は保存せず、離したときに一度だけ）
+            self.save_config()
+    
+    # 画面の端への吸着を切り替えるメソッド
+    def toggle_snap_to_edges(self):
+        self.snap_to_edges = not self.snap_to_edges
+        self.save_config()
+        self.update_tray_menu()
+    
+    # ほかのマスコットへの吸着を切り替えるメソッド
+    def toggle_snap_to_mascots(self):
+        self.snap_to_mascots = not self.snap_to_mascots
+        self.save_config()
+        self.update_tray_menu()
+    
+    # 自動で歩く・落ちるを切り替えるメソッド
+    def toggle_behavior(self):
+        self.behavior_enabled = not self.behavior_enabled and BehaviorEngine.available()
+        self.behavior_engine.set_enabled(self.behavior_enabled)
+        
+        # 設定を保存（止めたときはその位置で）
+        self.save_config()
+        self.update_tray_menu()
+    
+    # 透明な部分のクリックを通すかどうかを切り替えるメソッド
+    def toggle_click_through(self):
+        self.click_through = not self.click_through
+        for mascot in self.mascot_widgets:
+            mascot.update_input_mask()
+        self.compositor.schedule_mask_update()
+        
+        self.save_config()
+        self.update_tray_menu()
+    
+    # マスコットの表示倍率と最大サイズを変えるメソッド
+    def set_mascot_scale(self, mascot, scale=None, max_size=None):
+        if mascot not in self.mascot_widgets:
+            return
+        
+        mascot.set_scale(scale, max_size)
+        
+        # 設定を保存
+        self.save_config()
+    
     # 前面表示を切り替えるメソッド
     def toggle_topmost(self):
         self.is_topmost = not self.is_topmost
@@ -426,6 +5476,26 @@ class MascotApp(QWidget):
         # 全てのマスコットの前面表示設定を変更
         for mascot in self.mascot_widgets:
             mascot.set_topmost(self.is_topmost)
+        self.compositor.set_topmost(self.is_topmost)
+        
+        # 全画面アプリに隠れるかどうかが変わるので確認し直す
+        self.visibility_manager.schedule_check_all()
+        
+        # 設定を保存
+        self.save_config()
+        
+        # メニューを更新
+        self.update_tray_menu()
+    
+    # オーバーレイ表示を切り替えるメソッド
+    def toggle_render_mode(self):
+        self.render_mode = "window" if self.render_mode == "overlay" else "overlay"
+        self.compositor.set_enabled(self.render_mode == "overlay")
+        
+        # 全てのマスコットを新しい方法で表示し直す
+        for mascot in self.mascot_widgets:
+            mascot.present()
+            mascot.update_input_mask()
         
         # 設定を保存
         self.save_config()
@@ -433,6 +5503,23 @@ class MascotApp(QWidget):
         # メニューを更新
         self.update_tray_menu()
     
+    # パフォーマンス表示を切り替えるメソッド
+    def toggle_perf_hud(self):
+        self.perf_metrics.set_hud_visible(not self.perf_metrics.hud_visible())
+        self.update_tray_menu()
+    
+    # パフォーマンス統計をファイルに書き出すメソッド
+    def export_metrics(self):
+        json_path = self.perf_metrics.export()
+        if json_path is not None:
+            self.tray_icon.showMessage("統計を書き出しました", json_path, QSystemTrayIcon.Information, 3000)
+    
+    # 設定の保存に失敗し始めたときに呼ばれるメソッド（トレイで一度だけ知らせる）
+    def config_save_failed(self, error):
+        if getattr(self, "tray_icon", None) is not None:
+            self.tray_icon.showMessage("設定を保存できません", f"保存できるようになるまで再試行します。\n{error}",
+                                       QSystemTrayIcon.Warning, 5000)
+    
     # システムトレイアイコンを設定するメソッド
     def setup_system_tray(self):
         # システムトレイアイコンの作成
@@ -447,72 +5534,21 @@ class MascotApp(QWidget):
             empty_icon = QIcon()
             self.tray_icon.setIcon(empty_icon)
         
-        # トレイアイコンのメニュー作成
-        self.tray_menu = QMenu()
-        
-        # メニュー項目を追加
-        self.create_tray_menu()
+        # トレイアイコンのメニュー作成（変更があった項目だけを更新する）
+        self.tray_menu_model = TrayMenuModel(self)
+        self.tray_menu = self.tray_menu_model.menu
         
         # トレイアイコンにメニューをセット
         self.tray_icon.setContextMenu(self.tray_menu)
         # トレイアイコンを表示
         self.tray_icon.show()
     
-    # トレイメニューを作成するメソッド
-    def create_tray_menu(self):
-        # メニューをクリア
-        self.tray_menu.clear()
-        
-        # 「画像を追加」メニュー項目
-        add_images_action = QAction("画像を追加", self)
-        add_images_action.triggered.connect(self.add_images)
-        self.tray_menu.addAction(add_images_action)
-        
-        self.tray_menu.addSeparator()  # 区切り線
-        
-        # 「マスコットを表示」サブメニュー
-        self.display_menu = QMenu("マスコットを表示", self)
-        self.update_display_menu()
-        self.tray_menu.addMenu(self.display_menu)
-        
-        # 「表示中のマスコット」サブメニュー
-        self.active_mascots_menu = QMenu("表示中のマスコット", self)
-        self.update_active_mascots_menu()
-        self.tray_menu.addMenu(self.active_mascots_menu)
-        
-        # 「画像管理」サブメニュー
-        self.images_menu = QMenu("画像管理", self)
-        self.update_images_menu()
-        self.tray_menu.addMenu(self.images_menu)
-        
-        self.tray_menu.addSeparator()  # 区切り線
-        
-        # 「すべてのマスコットを削除」メニュー項目
-        remove_all_action = QAction("すべてのマスコットを削除", self)
-        remove_all_action.triggered.connect(self.remove_all_mascots)
-        remove_all_action.setEnabled(len(self.mascot_widgets) > 0)
-        self.tray_menu.addAction(remove_all_action)
-        
-        self.tray_menu.addSeparator()  # 区切り線
-        
-        # 「常に前面に表示」メニュー項目（チェックボックス付き）
-        topmost_action = QAction("常に前面に表示", self)
-        topmost_action.setCheckable(True)  # チェックボックスにする
-        topmost_action.setChecked(self.is_topmost)  # 初期状態をセット
-        topmost_action.triggered.connect(self.toggle_topmost)
-        self.tray_menu.addAction(topmost_action)
-        
-        self.tray_menu.addSeparator()  # 区切り線
-        
-        # 「終了」メニュー項目
-        exit_action = QAction("終了", self)
-        exit_action.triggered.connect(self.on_exit)
-        self.tray_menu.addAction(exit_action)
-    
     # 終了時の処理メソッド
     def on_exit(self):
-        # 設定を保存
-        self.save_config()
+        # 設定をすぐに保存し、この後の削除で上書きされないようにする
+        self.config_saver.close()
+        self.control_server.close()
+        self.perf_metrics.set_hud_visible(False)
         
         # すべてのマスコットを安全に閉じる
         self.remove_all_mascots()
@@ -520,136 +5556,52 @@ class MascotApp(QWidget):
         # アプリケーションを終了
         QApplication.quit()
     
-    # 「マスコットを表示」メニューを更新するメソッド
-    def update_display_menu(self):
-        self.display_menu.clear()
-        
-        # 画像リストが空の場合
-        if len(self.image_list) == 0:
-            no_images_action = QAction("画像がありません", self)
-            no_images_action.setEnabled(False)
-            self.display_menu.addAction(no_images_action)
-            return
-        
-        # 画像ごとにアクションを追加
-        for i, image_info in enumerate(self.image_list):
-            image_action = QAction(image_info["name"], self)
-            
-            # ラムダ式を使って各アクションに対応するインデックスを保持
-            info_copy = image_info  # ローカル変数にコピー
-            image_action.triggered.connect(lambda checked=False, info=info_copy: self.create_mascot(info))
-            
-            self.display_menu.addAction(image_action)
-    
-    # 「表示中のマスコット」メニューを更新するメソッド
-    def update_active_mascots_menu(self):
-        self.active_mascots_menu.clear()
-        
-        # 表示中のマスコットがない場合
-        if len(self.mascot_widgets) == 0:
-            no_mascots_action = QAction("表示中のマスコットがありません", self)
-            no_mascots_action.setEnabled(False)
-            self.active_mascots_menu.addAction(no_mascots_action)
-            return
-        
-        # マスコットごとにアクションを追加
-        for i, mascot in enumerate(self.mascot_widgets):
-            name = mascot.image_info["name"] if mascot.image_info else "無名マスコット"
-            mascot_action = QAction(f"{i+1}: {name}", self)
-            
-            # マスコットを削除するサブメニュー
-            remove_action = QAction("削除", self)
-            # ローカル変数にコピー
-            target_mascot = mascot
-            remove_action.triggered.connect(lambda checked=False, m=target_mascot: self.remove_mascot(m))
-            
-            # マスコットに移動するサブメニュー
-            goto_action = QAction("移動", self)
-            target_mascot_goto = mascot  # もう一度コピー
-            goto_action.triggered.connect(lambda checked=False, m=target_mascot_goto: m.activateWindow())
-            
-            # サブメニューを作成
-            mascot_submenu = QMenu()
-            mascot_submenu.addAction(goto_action)
-            mascot_submenu.addAction(remove_action)
-            
-            mascot_action.setMenu(mascot_submenu)
-            self.active_mascots_menu.addAction(mascot_action)
-    
-    # 「画像管理」メニューを更新するメソッド
-    def update_images_menu(self):
-        self.images_menu.clear()
-        
-        # 画像リストが空の場合
-        if len(self.image_list) == 0:
-            no_images_action = QAction("画像がありません", self)
-            no_images_action.setEnabled(False)
-            self.images_menu.addAction(no_images_action)
-            return
-        
-        # 画像ごとにアクションを追加
-        for i, image_info in enumerate(self.image_list):
-            image_action = QAction(image_info["name"], self)
-            
-            # 画像を削除するサブメニュー
-            remove_action = QAction("削除", self)
-            # 正しくインデックスを渡すためにローカル変数にコピー
-            idx = i
-            remove_action.triggered.connect(lambda checked=False, idx=idx: self.remove_image(idx))
-            
-            # サブメニューを作成
-            image_submenu = QMenu()
-            image_submenu.addAction(remove_action)
-            
-            image_action.setMenu(image_submenu)
-            self.images_menu.addAction(image_action)
-    
-    # トレイメニューを更新するメソッド
+    # トレイメニューの状態を更新するメソッド
     def update_tray_menu(self):
-        # トレイメニューを再作成
-        self.create_tray_menu()
+        if self.batch_depth > 0:
+            self.batch_menu_requested = True
+            return
+        self.tray_menu_model.refresh_state()
     
     # マスコットのコンテキストメニューを表示するメソッド（修正）
     def show_mascot_context_menu(self, mascot, position):
         try:
-            # コンテキストメニューを作成
-            context_menu = QMenu()
-            
-            # メニュー項目を追加
-            remove_action = QAction("このマスコットを削除", self)
-            # ラムダ関数内でマスコットの参照を使う
-            target_mascot = mascot  # ローカル変数にコピー
-            remove_action.triggered.connect(lambda checked=False, m=target_mascot: self.remove_mascot(m))
-            
-            # 画像を切り替えるサブメニュー
-            change_image_menu = QMenu("画像を変更", self)
-            for image_info in self.image_list:
-                image_action = QAction(image_info["name"], self)
-                # 正しく画像情報を渡す
-                info_copy = image_info  # ローカル変数にコピー
-                target_mascot_for_image = mascot  # ここでもコピーを作成
-                image_action.triggered.connect(lambda checked=False, info=info_copy, m=target_mascot_for_image: m.set_image_info(info))
-                change_image_menu.addAction(image_action)
-            
-            if len(self.image_list) == 0:
-                no_images_action = QAction("画像がありません", self)
-                no_images_action.setEnabled(False)
-                change_image_menu.addAction(no_images_action)
-            
-            # メニューに項目を追加
-            context_menu.addMenu(change_image_menu)
-            context_menu.addAction(remove_action)
+            if self.mascot_menu is None:
+                self.thumbnail_cache = ThumbnailCache(self)
+                self.mascot_menu = MascotContextMenu(self, self.thumbnail_cache)
             
-            # コンテキストメニューを表示
-            context_menu.exec_(mascot.mapToGlobal(position))
+            # 共有のメニューをこのマスコット用に表示（項目は作り直さない）
+            self.mascot_menu.show(mascot, mascot.mapToGlobal(position))
         except Exception as e:
             print(f"コンテキストメニューエラー: {e}")
 
 # プログラムのメイン部分
 if __name__ == '__main__':
+    # --control '<JSON>' で起動中のマスコットアプリにリクエストを送り、応答を表示して終了する
+    if "--control" in sys.argv:
+        index = sys.argv.index("--control")
+        try:
+            response = send_control_request(json.loads(sys.argv[index + 1]))
+        except Exception as e:
+            print(f"操作エラー: {e}")
+            sys.exit(1)
+        print(json.dumps(response, ensure_ascii=False, indent=2))
+        sys.exit(0 if response.get("ok") else 1)
+    
+    # すでに起動していれば、起動中のアプリに引数を渡してすぐに終了する
+    # （ロックはプロセスが終わるまで持ち続け、異常終了で残ったロックはQLockFileが検出する）
+    lock_dir = os.path.join(os.path.expanduser('~'), '.mascot_app')
+    os.makedirs(lock_dir, exist_ok=True)
+    instance_lock = QLockFile(os.path.join(lock_dir, INSTANCE_LOCK_FILE))
+    instance_lock.setStaleLockTime(0)
+    if not instance_lock.tryLock(0):
+        sys.exit(forward_to_running_instance(sys.argv[1:]))
+    
     # QApplicationインスタンスを作成
     app = QApplication(sys.argv)
-    # マスコットアプリのインスタンスを作成
-    mascot_app = MascotApp()
+    # マスコットアプリのインスタンスを作成（--profile-startupで起動時間の内訳を表示）
+    mascot_app = MascotApp(StartupProfiler("--profile-startup" in sys.argv))
+    # 引数で渡された画像を表示
+    mascot_app.handle_arguments(sys.argv[1:], notify=False)
     # アプリケーションのイベントループを開始
     sys.exit(app.exec_())
\ No newline at end of file